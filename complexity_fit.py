@@ -0,0 +1,175 @@
+"""
+Least-squares fits of the usual complexity classes
+"""
+import numpy as np
+from scipy import optimize, special
+
+# Models of the form a * g(n) + b, by their basis function g. Every basis is
+# built from numpy ufuncs, so it takes a whole array of sizes at once
+BASES = {
+    "log(n)": np.log2,
+    "log(n)^2": lambda n: np.log2(n) ** 2,
+    "n": lambda n: n,
+    "n*log(n)": lambda n: n * np.log2(n),
+    "n*log(n)^2": lambda n: n * np.log2(n) ** 2,
+    "n^2": np.square,
+    "n^3": lambda n: n ** 3,
+    "n^4": lambda n: n ** 4,
+    "2^n": np.exp2,
+    "n!": lambda n: special.gamma(n + 1),
+}
+
+
+def linear_model(basis):
+    """Returns the model a * basis(n) + b"""
+    def model(x, a, b):
+        return a * basis(np.asarray(x, dtype=np.float64)) + b
+    return model
+
+
+# name -> function(x, a, b), in the order ties are broken in
+MODELS = {name: linear_model(BASES[name])
+          for name in ("log(n)", "log(n)^2", "n", "n*log(n)", "n*log(n)^2",
+                       "n^2", "n^3", "n^4", "2^n")}
+MODELS["n^a"] = lambda x, a, b: np.asarray(x, dtype=np.float64) ** a + b
+MODELS["a^n"] = lambda x, a, b: np.float_power(a, x) + b
+MODELS["n!"] = linear_model(BASES["n!"])
+
+
+def r_squared(y, residuals):
+    """
+    Coefficient of determination for each row of `residuals`, scored the
+    way sklearn.metrics.r2_score does
+    """
+    total = np.sum((y - np.mean(y)) ** 2)
+    residual = np.sum(residuals ** 2, axis=-1)
+    if total == 0:
+        return np.where(residual == 0, 1.0, 0.0)
+    return 1 - residual / total
+
+
+def fit_linear(x, y, names):
+    """
+    Fits a * g(n) + b for the basis g of every name in one batched
+    closed-form solve. Returns arrays of a, b and r^2, which are nan for
+    models that cannot be evaluated at every size, e.g. 2^n for large n.
+    """
+    with np.errstate(over='ignore', invalid='ignore'):
+        columns = np.stack([BASES[name](x) for name in names])
+    usable = np.all(np.isfinite(columns), axis=1)
+    columns[~usable] = 0
+    # Columns are scaled to at most 1 so that n! or 2^n can be squared
+    scale = np.max(np.abs(columns), axis=1)
+    scale[scale == 0] = 1
+    columns /= scale[:, None]
+
+    # Simple linear regression of y on each column at once
+    column_means = np.mean(columns, axis=1)
+    centred = columns - column_means[:, None]
+    spread = np.einsum('ij,ij->i', centred, centred)
+    usable &= spread > 0
+    spread[~usable] = 1
+    slope = centred @ (y - np.mean(y)) / spread
+    intercept = np.mean(y) - slope * column_means
+    residuals = y - (slope[:, None] * columns + intercept[:, None])
+
+    nan = np.full(len(names), np.nan)
+    return (np.where(usable, slope / scale, nan),
+            np.where(usable, intercept, nan),
+            np.where(usable, r_squared(y, residuals), nan))
+
+
+def fit_exponent(exponents, y, limit, steps=201):
+    """
+    Fits exp(t * exponents) + b. The offset has a closed form for any t, so
+    only t is searched for within [-limit, limit]: first on a grid of
+    `steps` values, all evaluated at once, then by a bounded scalar search
+    between the neighbours of the best one. Returns t, b and r^2.
+    """
+    def residuals_for(t):
+        with np.errstate(over='ignore', invalid='ignore'):
+            curves = np.exp(np.multiply.outer(t, exponents))
+            offsets = np.mean(y - curves, axis=-1)
+            return offsets, y - curves - offsets[..., None]
+
+    def cost(t):
+        with np.errstate(over='ignore', invalid='ignore'):
+            residual = np.sum(residuals_for(t)[1] ** 2, axis=-1)
+        return np.where(np.isfinite(residual), residual, np.inf)
+
+    grid = np.linspace(-limit, limit, steps)
+    best = int(np.argmin(cost(grid)))
+    t = optimize.minimize_scalar(
+        lambda t: float(cost(t)), method='bounded',
+        bounds=(grid[max(best - 1, 0)], grid[min(best + 1, steps - 1)])).x
+    offset, residuals = residuals_for(t)
+    return t, float(offset), float(r_squared(y, residuals))
+
+
+def fit_models(x_data, y_data, models=None):
+    """
+    Fits every model in `models`, by default MODELS, to the data.
+
+    Models in BASES are solved together in closed form. n^a and a^n are not
+    linear in their parameters and are fitted by a bounded search over the
+    exponent, and any other function(x, a, b) falls back to curve_fit.
+
+    Returns
+    -------
+    dict
+        name -> (params, r^2) in the order of `models`, where params is an
+        array of (a, b). Models that could not be fitted are left out.
+    """
+    if models is None:
+        models = MODELS
+    x = np.asarray(x_data, dtype=np.float64)
+    y = np.asarray(y_data, dtype=np.float64)
+    fits = {}
+
+    linear = [name for name, model in models.items()
+              if name in BASES and model is MODELS[name]]
+    if linear:
+        slopes, intercepts, scores = fit_linear(x, y, linear)
+        for name, a, b, r_2 in zip(linear, slopes, intercepts, scores):
+            if not np.isnan(r_2):
+                fits[name] = (np.array([a, b]), float(r_2))
+
+    for name, model in models.items():
+        if name in fits or name in linear:
+            continue
+        if name == "n^a" and model is MODELS[name]:
+            # n^a = exp(a * ln n)
+            log_x = np.log(x)
+            a, b, r_2 = fit_exponent(log_x, y,
+                                     min(10.0, 700 / np.max(np.abs(log_x))))
+        elif name == "a^n" and model is MODELS[name]:
+            # a^n = exp(n * ln a)
+            t, b, r_2 = fit_exponent(x, y, min(50.0, 700 / np.max(x)))
+            a = np.exp(t)
+        else:
+            try:
+                params, _ = optimize.curve_fit(model, x, y, p0=[1, 1])
+            except (OverflowError, RuntimeError):
+                continue
+            fits[name] = (params, float(r_squared(y, y - model(x, *params))))
+            continue
+        if np.isfinite(r_2):
+            fits[name] = (np.array([a, b]), r_2)
+    return {name: fits[name] for name in models if name in fits}
+
+
+def best_fit(x_data, y_data, models=None):
+    """
+    Returns the name, (a, b) and r^2 of the model that fits the data best.
+    Ties go to the model that comes first in `models`.
+    """
+    fits = fit_models(x_data, y_data, models)
+    best_function = ""
+    best_params = ()
+    best_r = float('-inf')
+    for name, (params, r_2) in fits.items():
+        if r_2 > best_r:
+            best_function = name
+            best_params = params
+            best_r = r_2
+    return best_function, best_params, best_r
@@ -0,0 +1,22 @@
+cdef class ImageGeneration:
+    cdef public int seeds, dim_x, dim_y
+    cdef public double p, radius
+    cdef public bint progress_bar
+    cdef public object img, palette
+    cdef int shift, per_axis
+    cdef unsigned long long rng_state
+    cdef unsigned char[:, :, ::1] canvas_view
+    cdef unsigned char[:, ::1] filled, colors
+    cdef long long[::1] counts, starts
+    cdef int[::1] owner, entries, slots
+    cdef long long[::1] cells, positions, neighbours
+    cdef long long[:, ::1] offsets
+    cdef long long size
+
+    cdef long long random_below(self, long long n) noexcept nogil
+    cdef void remove_color(self, long long index) noexcept nogil
+    cdef long long nearest(self, long long c_0, long long c_1,
+                           long long c_2) noexcept nogil
+    cdef void place(self, long long x, long long y,
+                    long long index) noexcept nogil
+    cdef bint propagate(self) noexcept nogil
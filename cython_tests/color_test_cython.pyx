@@ -1,280 +1,267 @@
-import colorsys
-import math
-import random
-import time
-import threading
-
-
+#cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+"""
+Typed Cython backend for ImageGeneration.
+
+Same algorithm as the pure-Python version in color_testing.py, and it builds
+its palette and stencil with the same classmethods, but every hot container
+is a typed memoryview: the canvas, the occupancy map, the palette and its
+buckets, the frontier and the stencil. The growth loop runs without the GIL
+and draws from a C-level xorshift64* generator.
+"""
 import numpy as np
-
-
-from colormath.color_objects import sRGBColor, LabColor
-from colormath.color_conversions import convert_color
-from colormath.color_diff import delta_e_cie2000
-
-from PIL import Image, ImageDraw
-from cmath import phase
+from PIL import Image
 from tqdm import tqdm
-import sys
-
 
-def normal_round(n):
-    if n - np.floor(n) < 0.5:
-        return int(np.floor(n))
-    return int(np.ceil(n))
+from color_testing import ImageGeneration as PythonImageGeneration
+from color_testing import RandomStream, child_seeds
 
+cdef int BUCKET_BITS = 4
 
-def color_distance(color_1, color_2):
-    dr = (color_1[0] - color_2[0]) ** 2
-    dg = (color_1[1] - color_2[1]) ** 2
-    db = (color_1[2] - color_2[2]) ** 2
-    delta = (dr + dg + db) ** (1/2)
-    return delta
-    # color_1_rgb = sRGBColor(
-    #     color_1[0] / 255, color_1[1] / 255, color_1[2] / 255)
-    # color_2_rgb = sRGBColor(
-    #     color_2[0] / 255, color_2[1] / 255, color_2[2] / 255)
-    # color1_lab = convert_color(color_1_rgb, LabColor)
-    # color2_lab = convert_color(color_2_rgb, LabColor)
-    # return delta_e_cie2000(color1_lab, color2_lab)
 
+cdef inline unsigned long long next_random(
+        unsigned long long *state) noexcept nogil:
+    cdef unsigned long long x = state[0]
+    x ^= x >> 12
+    x ^= x << 25
+    x ^= x >> 27
+    state[0] = x
+    return x * 0x2545F4914F6CDD1DULL
 
-def get_closest_color(color, color_list):
-    champion_distance = 999_999_999_999
-    champion_color = (0, 0, 0)
-    for i in color_list:
-        current_distance = color_distance(color, i)
-        if current_distance < champion_distance:
-            champion_distance = current_distance
-            champion_color = i
-    return champion_color
 
+cdef inline long long box_distance(long long value, long long bucket,
+                                   long long cell) noexcept nogil:
+    # Distance along one axis from a value to the span of a bucket
+    cdef long long low = bucket * cell
+    if value < low:
+        return low - value
+    if value > low + cell - 1:
+        return value - (low + cell - 1)
+    return 0
 
-# def is_perfect_square(x):
 
-#     # Find floating point value of
-#     # square root of x.
-#     sr = np.sqrt(x)
-
-#     # If square root is an integer
-#     return (sr - np.floor(sr)) == 0
-
-
-class ImageGeneration:
+cdef class ImageGeneration:
     def __init__(self, dim_x, dim_y, seeds, radius=1.5, p=2, min_value_color=0,
-                 random_seed=None, progress_bar=True):
-        if random_seed is not None:
-            random.seed(random_seed)
+                 random_seed=None, progress_bar=True, palette=None):
+        cdef long long i, n_colors, n_buckets, bucket
+        cdef long long[::1] fill
+
+        # Same streams as the pure-Python version: one shuffles the palette,
+        # the other places the seeds and then seeds the C generator
+        palette_seed, growth_seed = child_seeds(random_seed, 2)
+        stream = RandomStream(growth_seed)
         self.seeds = seeds
         self.dim_x = dim_x
         self.dim_y = dim_y
         self.p = float(p)
         self.radius = float(radius)
         self.progress_bar = progress_bar
+        self.offsets = np.array(
+            PythonImageGeneration.build_stencil(self.radius, self.p),
+            dtype=np.int64).reshape(-1, 2)
+        self.neighbours = np.empty(len(self.offsets), dtype=np.int64)
 
         self.img = Image.new('RGB', (dim_x, dim_y))
-        self.draw = ImageDraw.Draw(self.img)
-
-        self.color_list = self.populate_colors(unique_colors=dim_x*dim_y,
-                                               min_value=min_value_color)
-        random.shuffle(self.color_list)
-
-        if dim_x * dim_y < 255 ** 3:
-            self.color_list = set(self.color_list)
-
-        self.image_array = []
-        self.remaining_pixels = set()
-
-        for x in range(dim_x):
-            self.image_array.append([])
-            for y in range(dim_y):
-                self.image_array[x].append((-1, -1, -1))
-                # remaining_pixels.append((x, y))
-
-        for _ in range(seeds):
-            color = self.color_list.pop()
-            rand_x = random.randint(0, dim_x - 1)
-            rand_y = random.randint(0, dim_y - 1)
-            self.add_pixel(rand_x, rand_y, color)
-
-    def add_pixel(self, x, y, color):
-        self.image_array[x][y] = color
-        lower_x = max(0, normal_round(x - self.radius))
-        upper_x = min(self.dim_x - 1, normal_round(x + self.radius)) + 1
-        lower_y = max(0, normal_round(y - self.radius))
-        upper_y = min(self.dim_y - 1, normal_round(y + self.radius)) + 1
-
-        for i in range(lower_x, upper_x):
-            for j in range(lower_y, upper_y):
-                if (i, j) in self.remaining_pixels \
-                        or self.image_array[i][j][0] != -1:
-                    continue
-                x_dist = np.abs(i-x)
-                y_dist = np.abs(j-y)
-                reg_dist = np.power(
-                    (np.power(x_dist, self.p)
-                     + np.power(y_dist, self.p)), (1/self.p))
-                if reg_dist <= self.radius:
-                    self.remaining_pixels.add((i, j))
-
-    def get_neighbor(self, x, y):
-        neighbor_list = []
-        lower_x = max(0, normal_round(x - self.radius))
-        upper_x = min(self.dim_x - 1, normal_round(x + self.radius)) + 1
-        lower_y = max(0, normal_round(y - self.radius))
-        upper_y = min(self.dim_y - 1, normal_round(y + self.radius)) + 1
-
-        for i in range(lower_x, upper_x):
-            for j in range(lower_y, upper_y):
-                if self.image_array[i][j][0] == -1:
-                    continue
-                x_dist = abs(i-x)
-                y_dist = abs(j-y)
-                reg_dist = (x_dist ** self.p + y_dist ** self.p) ** (1/self.p)
-                if reg_dist <= self.radius:
-                    neighbor_list.append((i, j))
-        return random.choice(neighbor_list)
-
-    # def methoddddd(self,
-    #                lower_x: int,
-    #                upper_x: int,
-    #                lower_y: int,
-    #                upper_y: int,
-    #                x: int, y: int):
-    #     neighbor_list = np.array([(-1, -1)])
-    #     # !
-    #     # !
-    #     # !
-    #     # ! Vectorize this
-    #     # !
-    #     # !
-    #     # !
-    #     for i in range(lower_x, upper_x):
-    #         for j in range(lower_y, upper_y):
-    #             if self.image_array[i][j][0] == -1:
-    #                 continue
-    #             x_dist = np.abs(i-x)
-    #             y_dist = np.abs(j-y)
-
-    #             reg_dist = (x_dist ** self.p + y_dist ** self.p) ** (1/self.p)
-    #             # if reg_dist <= self.radius:
-    #             #     return (i, j)
-    #             if reg_dist <= self.radius:
-    #                 # print(i, j)
-    #                 neighbor_list = np.append(neighbor_list, (i, j))
-    #     # !
-    #     # !
-    #     # !
-    #     # ! Vectorize this
-    #     # !
-    #     # !
-    #     # !
-    #     # for i in range(5):
-    #     #     print()
-    #     # print(neighbor_list)
-    #     # for i in range(5):
-    #     #     print()
-    #     neighbor_list = np.delete(neighbor_list, (-1, -1))
-    #     print(neighbor_list)
-    #     choice = random.choice(neighbor_list)
-    #     return choice
-
-    @classmethod
-    def populate_colors(cls, max_pixel=255, unique_colors=256**2, min_value=0):
-        """Returns evenly spaced colors"""
-        all_colors = []
-        max_value = max_pixel ** 3
-        dim_1_colors = np.linspace(min_value, max_value, num=unique_colors)
-        for i in dim_1_colors:
-            red = int(i % max_pixel)
-            green = int((i // max_pixel) % max_pixel)
-            blue = int(i // (max_pixel ** 2))
-            all_colors.append((red, green, blue))
-        return all_colors
-
-    def fit_colors(self):
-        last_value = self.dim_x * self.dim_y - 1 - self.seeds
-
-        if self.progress_bar:
-            for i in tqdm(range(last_value)):
-                self.propagate()
-        else:
-            for i in range(last_value):
-                self.propagate()
-
-            # if is_perfect_square(i):
-            #     for x in range(self.dim_x):
-            #         for y in range(self.dim_y):
-            #             self.draw.point((x, y), self.image_array[x][y])
-            #     self.save(f"image_tests/images/growth/{i}.png")
-        for x in range(self.dim_x):
-            for y in range(self.dim_y):
-                self.draw.point((x, y), self.image_array[x][y])
-
-    def propagate(self):
-        chosen = random.choice(tuple(self.remaining_pixels))
-        x, y = chosen
-        # print(len(remaining_pixels))
-
-        neighbor = self.get_neighbor(*chosen)
-        n_x, n_y = neighbor
-        color = get_closest_color(
-            self.image_array[n_x][n_y], self.color_list)
-        self.add_pixel(x, y, color)
-
-        self.remaining_pixels.remove(chosen)
-        self.color_list.remove(color)
-
-        # if is_perfect_square(i):
-        #     for x in range(self.dim_x):
-        #         for y in range(self.dim_y):
-        #             self.draw.point((x, y), self.image_array[x][y])
-        #     self.save(f"image_tests/images/growth/{i}.png")
+
+        if palette is None:
+            palette = PythonImageGeneration.build_palette(
+                unique_colors=dim_x*dim_y, min_value=min_value_color,
+                rng=palette_seed)
+        elif len(palette) < dim_x * dim_y:
+            raise ValueError(f'A {dim_x}x{dim_y} image needs at least '
+                             f'{dim_x * dim_y} colors, got {len(palette)}')
+        self.palette = palette
+        self.colors = np.ascontiguousarray(palette, dtype=np.uint8)
+
+        # Bucket the palette: the live colors of each bucket sit at the front
+        # of its run of `entries`, so removal is a swap with the last one
+        self.shift = 8 - BUCKET_BITS
+        self.per_axis = 1 << BUCKET_BITS
+        n_colors = len(self.palette)
+        n_buckets = self.per_axis ** 3
+        self.owner = np.empty(n_colors, dtype=np.int32)
+        self.counts = np.zeros(n_buckets, dtype=np.int64)
+        self.starts = np.zeros(n_buckets + 1, dtype=np.int64)
+        self.entries = np.empty(n_colors, dtype=np.int32)
+        self.slots = np.empty(n_colors, dtype=np.int32)
+        for i in range(n_colors):
+            bucket = ((self.colors[i, 0] >> self.shift) * self.per_axis
+                      + (self.colors[i, 1] >> self.shift)) * self.per_axis \
+                + (self.colors[i, 2] >> self.shift)
+            self.owner[i] = bucket
+            self.counts[bucket] += 1
+        for bucket in range(n_buckets):
+            self.starts[bucket + 1] = self.starts[bucket] + self.counts[bucket]
+        fill = np.array(self.starts[:n_buckets], dtype=np.int64)
+        for i in range(n_colors):
+            self.entries[fill[self.owner[i]]] = i
+            self.slots[i] = fill[self.owner[i]]
+            fill[self.owner[i]] += 1
+
+        self.canvas_view = np.zeros((dim_y, dim_x, 3), dtype=np.uint8)
+        self.filled = np.zeros((dim_y, dim_x), dtype=np.uint8)
+        self.cells = np.empty(dim_x * dim_y, dtype=np.int64)
+        self.positions = np.full(dim_x * dim_y, -1, dtype=np.int64)
+        self.size = 0
+
+        for seed in range(seeds):
+            # Seeds take colors from the back of the palette
+            index = n_colors - 1 - seed
+            rand_x = stream.below(dim_x)
+            rand_y = stream.below(dim_y)
+            self.place(rand_x, rand_y, index)
+
+        self.rng_state = stream.raw() | 1
+
+    @property
+    def canvas(self):
+        return np.asarray(self.canvas_view)
+
+    cdef inline long long random_below(self, long long n) noexcept nogil:
+        return <long long>(next_random(&self.rng_state)
+                           % <unsigned long long>n)
+
+    cdef void remove_color(self, long long index) noexcept nogil:
+        cdef long long bucket = self.owner[index]
+        cdef long long last = self.starts[bucket] + self.counts[bucket] - 1
+        cdef long long position = self.slots[index]
+        cdef long long moved
+        if position > last:
+            return
+        moved = self.entries[last]
+        self.entries[position] = moved
+        self.slots[moved] = position
+        self.entries[last] = index
+        self.slots[index] = last
+        self.counts[bucket] -= 1
+
+    cdef long long nearest(self, long long c_0, long long c_1,
+                           long long c_2) noexcept nogil:
+        cdef long long cell = 1 << self.shift
+        cdef long long q_0 = c_0 >> self.shift
+        cdef long long q_1 = c_1 >> self.shift
+        cdef long long q_2 = c_2 >> self.shift
+        cdef long long best_distance = 0x7FFFFFFFFFFFFFFF
+        cdef long long best_index = -1
+        cdef long long shell, bound, b_0, b_1, b_2, step, bucket, k, i
+        cdef long long d_0, d_1, d_2, dr, dg, db, distance
+        cdef bint on_face
+
+        for shell in range(self.per_axis):
+            if shell > 0 and best_index != -1:
+                # Nothing in this shell or beyond can be closer than this
+                bound = (shell - 1) * cell + 1
+                if bound * bound > best_distance:
+                    break
+            for b_0 in range(max(0, q_0 - shell),
+                             min(self.per_axis, q_0 + shell + 1)):
+                d_0 = box_distance(c_0, b_0, cell)
+                for b_1 in range(max(0, q_1 - shell),
+                                 min(self.per_axis, q_1 + shell + 1)):
+                    d_1 = box_distance(c_1, b_1, cell)
+                    on_face = abs(b_0 - q_0) == shell \
+                        or abs(b_1 - q_1) == shell
+                    step = 1 if on_face or shell == 0 else 2 * shell
+                    b_2 = q_2 - shell
+                    while b_2 <= q_2 + shell:
+                        if 0 <= b_2 < self.per_axis:
+                            bucket = (b_0 * self.per_axis + b_1) \
+                                * self.per_axis + b_2
+                            d_2 = box_distance(c_2, b_2, cell)
+                            if self.counts[bucket] != 0 and \
+                                    d_0 * d_0 + d_1 * d_1 + d_2 * d_2 \
+                                    <= best_distance:
+                                for k in range(self.starts[bucket],
+                                               self.starts[bucket]
+                                               + self.counts[bucket]):
+                                    i = self.entries[k]
+                                    dr = self.colors[i, 0] - c_0
+                                    dg = self.colors[i, 1] - c_1
+                                    db = self.colors[i, 2] - c_2
+                                    distance = dr * dr + dg * dg + db * db
+                                    if distance < best_distance or (
+                                            distance == best_distance
+                                            and i < best_index):
+                                        best_distance = distance
+                                        best_index = i
+                        b_2 += step
+        return best_index
+
+    cdef void place(self, long long x, long long y,
+                    long long index) noexcept nogil:
+        """Colors a cell, retires its color and updates the frontier"""
+        cdef long long cell = y * self.dim_x + x
+        cdef long long k, i, j, flat, last
+        cdef int c
+
+        self.remove_color(index)
+        for c in range(3):
+            self.canvas_view[y, x, c] = self.colors[index, c]
+        self.filled[y, x] = 1
+
+        if self.positions[cell] != -1:
+            self.size -= 1
+            last = self.cells[self.size]
+            self.cells[self.positions[cell]] = last
+            self.positions[last] = self.positions[cell]
+            self.positions[cell] = -1
+
+        for k in range(self.offsets.shape[0]):
+            i = x + self.offsets[k, 0]
+            j = y + self.offsets[k, 1]
+            if 0 <= i < self.dim_x and 0 <= j < self.dim_y \
+                    and not self.filled[j, i]:
+                flat = j * self.dim_x + i
+                if self.positions[flat] == -1:
+                    self.cells[self.size] = flat
+                    self.positions[flat] = self.size
+                    self.size += 1
+
+    cdef bint propagate(self) noexcept nogil:
+        cdef long long cell, x, y, k, i, j, n_found, neighbour, n_x, n_y
+        if self.size == 0:
+            return False
+        cell = self.cells[self.random_below(self.size)]
+        x = cell % self.dim_x
+        y = cell // self.dim_x
+
+        # Copy the color of a random filled neighbour
+        n_found = 0
+        for k in range(self.offsets.shape[0]):
+            i = x + self.offsets[k, 0]
+            j = y + self.offsets[k, 1]
+            if 0 <= i < self.dim_x and 0 <= j < self.dim_y \
+                    and self.filled[j, i]:
+                self.neighbours[n_found] = j * self.dim_x + i
+                n_found += 1
+        neighbour = self.neighbours[self.random_below(n_found)]
+        n_x = neighbour % self.dim_x
+        n_y = neighbour // self.dim_x
+
+        self.place(x, y, self.nearest(self.canvas_view[n_y, n_x, 0],
+                                      self.canvas_view[n_y, n_x, 1],
+                                      self.canvas_view[n_y, n_x, 2]))
+        return True
+
+    def fit_colors(self, report_every=4096):
+        cdef long long i, start, stop
+        cdef long long last_value = self.dim_x * self.dim_y - self.seeds
+
+        progress = tqdm(total=last_value) if self.progress_bar else None
+        for start in range(0, last_value, report_every):
+            stop = min(start + report_every, last_value)
+            with nogil:
+                for i in range(start, stop):
+                    if not self.propagate():
+                        break
+            if progress is not None:
+                progress.update(stop - start)
+        if progress is not None:
+            progress.close()
+
+        self.img = Image.fromarray(self.canvas)
 
     def show(self, *args, **kwargs):
         self.img.show(*args, **kwargs)
 
     def save(self, *args, **kwargs):
         self.img.save(*args, **kwargs)
-
-
-def grow(optional=None, progress_bar=True):
-    # print(f'enter start {postfix}')
-    # r = random.uniform(1.0, 5.0)
-    # p = random.uniform(0.5, 5.0)
-    r = 1.0
-    p = 1.0
-    dim_x = dim_y = 128
-    seeds = 1
-    start = time.time()
-    image_generator = ImageGeneration(dim_x, dim_y,
-                                      seeds, radius=r, p=p,
-                                      random_seed=optional,
-                                      progress_bar=progress_bar)
-    image_generator.fit_colors()
-    end = time.time()
-    # print(dim_x * dim_y)
-    print(f'{end-start}\n')
-    image_generator.save(f"image_tests/temp/{dim_x}x{dim_y}_{optional}_radius_{r:.5f}_power_{p:.5f}.png")
-    #     f"image_tests/images/out_min_power_{i}.png")
-    # print(f'exit start {postfix}')
-    # image_generator.show()
-
-
-# image_generator = ImageGeneration(5, 5, 5, progress_bar=False)
-# image_generator.fit_colors()
-# num_threads = 2
-# for i in range(num_threads):
-#     progress_bar = (i == num_threads - 1)
-#     seed_to_use = random.randint(0, 1_000_000_000)
-#     thread = threading.Thread(target=grow, args=(seed_to_use, progress_bar))
-#     thread.start()
-
-seed_to_use = random.randint(0, 1_000_000_000)
-grow(optional=seed_to_use)
-
-# Speedup options:
-# //Write in another language
-# *Optimize for interpreter
-# *JIT Compilation
-# ?Parallelization
@@ -4,6 +4,7 @@ import math
 import random
 import time
 import threading
+from array import array
 
 
 import numpy as np
@@ -13,7 +14,7 @@ from colormath.color_objects import sRGBColor, LabColor
 from colormath.color_conversions import convert_color
 from colormath.color_diff import delta_e_cie2000
 
-from PIL import Image, ImageDraw
+from PIL import Image
 from cmath import phase
 from tqdm import tqdm
 import sys
@@ -51,6 +52,187 @@ def get_closest_color(color, color_list):
     return champion_color
 
 
+class PaletteIndex:
+    """
+    Bucketed RGB cube over the colors that have not been placed yet. A query
+    walks outwards from the bucket of the query color one shell at a time and
+    stops once no unvisited bucket can beat the best match. Ties go to the
+    lowest palette index, which is what `get_closest_color` returns.
+
+    Colors are kept packed into 24-bit ints in flat int32 arrays rather than
+    as tuples, four bytes per color for each array. Each bucket owns a run of `entries` with its live colors at the
+    front, so removing a color is a swap with the last live one.
+    """
+
+    def __init__(self, colors, bucket_bits=4):
+        colors = np.asarray(colors, dtype=np.int64)
+        self.shift = 8 - bucket_bits
+        self.per_axis = 1 << bucket_bits
+        self.packed = array('i', (colors[:, 0] << 16 | colors[:, 1] << 8
+                                  | colors[:, 2]).tolist())
+        owner = ((colors[:, 0] >> self.shift) * self.per_axis
+                 + (colors[:, 1] >> self.shift)) * self.per_axis \
+            + (colors[:, 2] >> self.shift)
+        counts = np.bincount(owner, minlength=self.per_axis ** 3)
+        order = np.argsort(owner, kind='stable')
+        slots = np.empty_like(order)
+        slots[order] = np.arange(len(order))
+
+        self.owner = array('i', owner.tolist())
+        self.counts = array('i', counts.tolist())
+        self.starts = array('i', np.concatenate(([0], np.cumsum(counts)))
+                            .tolist())
+        self.entries = array('i', order.tolist())
+        self.slots = array('i', slots.tolist())
+        self.remaining = len(self.packed)
+
+    def __len__(self):
+        return self.remaining
+
+    def bucket_of(self, color):
+        return tuple(channel >> self.shift for channel in color)
+
+    def color(self, index):
+        packed = self.packed[index]
+        return packed >> 16, packed >> 8 & 0xFF, packed & 0xFF
+
+    def remove(self, index):
+        bucket = self.owner[index]
+        last = self.starts[bucket] + self.counts[bucket] - 1
+        position = self.slots[index]
+        if position > last:
+            return
+        moved = self.entries[last]
+        self.entries[position] = moved
+        self.slots[moved] = position
+        self.entries[last] = index
+        self.slots[index] = last
+        self.counts[bucket] -= 1
+        self.remaining -= 1
+
+    def nearest(self, color):
+        """Index of the closest remaining color, -1 if none are left"""
+        c_0, c_1, c_2 = (int(channel) for channel in color)
+        cell = 1 << self.shift
+        query = self.bucket_of((c_0, c_1, c_2))
+        best_distance = float('inf')
+        best_index = -1
+        for shell in range(self.per_axis):
+            if shell > 0 and best_index != -1:
+                bound = (shell - 1) * cell + 1
+                if bound * bound > best_distance:
+                    break
+            for b_0, b_1, b_2 in self.shell_buckets(query, shell):
+                bucket = (b_0 * self.per_axis + b_1) * self.per_axis + b_2
+                count = self.counts[bucket]
+                if not count:
+                    continue
+                start = self.starts[bucket]
+                for index in self.entries[start:start + count]:
+                    packed = self.packed[index]
+                    d_0 = (packed >> 16) - c_0
+                    d_1 = (packed >> 8 & 0xFF) - c_1
+                    d_2 = (packed & 0xFF) - c_2
+                    distance = d_0 * d_0 + d_1 * d_1 + d_2 * d_2
+                    if distance < best_distance or (
+                            distance == best_distance and index < best_index):
+                        best_distance = distance
+                        best_index = index
+        return best_index
+
+    def shell_buckets(self, query, shell):
+        """Yields the buckets exactly `shell` steps away from `query`"""
+        q_0, q_1, q_2 = query
+        for b_0 in range(max(0, q_0 - shell),
+                         min(self.per_axis, q_0 + shell + 1)):
+            for b_1 in range(max(0, q_1 - shell),
+                             min(self.per_axis, q_1 + shell + 1)):
+                if abs(b_0 - q_0) == shell or abs(b_1 - q_1) == shell:
+                    b_2_values = range(max(0, q_2 - shell),
+                                       min(self.per_axis, q_2 + shell + 1))
+                else:
+                    b_2_values = (q_2 - shell, q_2 + shell)
+                for b_2 in b_2_values:
+                    if 0 <= b_2 < self.per_axis:
+                        yield b_0, b_1, b_2
+
+
+class Frontier:
+    """
+    Set of cells waiting to be colored with O(1) add, remove, membership test
+    and uniform random pick. `positions` maps each cell to its slot in
+    `cells`, so removal is a swap with the last cell instead of a search.
+    """
+
+    def __init__(self):
+        self.cells = []
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __contains__(self, cell):
+        return cell in self.positions
+
+    def add(self, x, y):
+        if (x, y) in self.positions:
+            return
+        self.positions[(x, y)] = len(self.cells)
+        self.cells.append((x, y))
+
+    def remove(self, x, y):
+        position = self.positions.pop((x, y), None)
+        if position is None:
+            return
+        last = self.cells.pop()
+        if last != (x, y):
+            self.cells[position] = last
+            self.positions[last] = position
+
+    def choice(self, stream):
+        return stream.choice(self.cells)
+
+
+class RandomStream:
+    """
+    Uniform integers from a per-instance numpy Generator. Raw 64-bit words
+    are drawn a block at a time and scaled with a multiply and a shift.
+    """
+
+    def __init__(self, seed=None, block=4096):
+        self.generator = np.random.default_rng(seed)
+        self.block = block
+        self.words = []
+        self.position = 0
+
+    def raw(self):
+        if self.position == len(self.words):
+            self.words = self.generator.bit_generator.random_raw(
+                self.block).tolist()
+            self.position = 0
+        word = self.words[self.position]
+        self.position += 1
+        return word
+
+    def below(self, n):
+        return self.raw() * n >> 64
+
+    def choice(self, sequence):
+        return sequence[self.below(len(sequence))]
+
+
+def child_seeds(random_seed, n):
+    """The first `n` children of the SeedSequence for `random_seed`"""
+    if isinstance(random_seed, np.random.SeedSequence):
+        parent = random_seed
+    else:
+        parent = np.random.SeedSequence(random_seed)
+    return [np.random.SeedSequence(parent.entropy,
+                                   spawn_key=parent.spawn_key + (i,),
+                                   pool_size=parent.pool_size)
+            for i in range(n)]
+
+
 # def is_perfect_square(x):
 
 #     # Find floating point value of
@@ -63,78 +245,87 @@ def get_closest_color(color, color_list):
 
 class ImageGeneration:
     def __init__(self, dim_x, dim_y, seeds, radius=1.5, p=2, min_value_color=0,
-                 random_seed=None, progress_bar=True):
-        if random_seed is not None:
-            random.seed(random_seed)
+                 random_seed=None, progress_bar=True, palette=None):
+        # One stream shuffles the palette and the other drives growth
+        palette_seed, growth_seed = child_seeds(random_seed, 2)
+        self.stream = RandomStream(growth_seed)
         self.seeds = seeds
         self.dim_x = dim_x
         self.dim_y = dim_y
         self.p = float(p)
         self.radius = float(radius)
         self.progress_bar = progress_bar
+        self.stencil = self.build_stencil(self.radius, self.p)
 
         self.img = Image.new('RGB', (dim_x, dim_y))
-        self.draw = ImageDraw.Draw(self.img)
-
-        self.color_list = self.populate_colors(unique_colors=dim_x*dim_y,
-                                               min_value=min_value_color)
-        random.shuffle(self.color_list)
-
-        if dim_x * dim_y < 255 ** 3:
-            self.color_list = set(self.color_list)
-
-        self.image_array = []
-        self.remaining_pixels = set()
 
-        for x in range(dim_x):
-            self.image_array.append([])
-            for y in range(dim_y):
-                self.image_array[x].append((-1, -1, -1))
-                # remaining_pixels.append((x, y))
-
-        for _ in range(seeds):
-            color = self.color_list.pop()
-            rand_x = random.randint(0, dim_x - 1)
-            rand_y = random.randint(0, dim_y - 1)
+        if palette is None:
+            palette = self.build_palette(unique_colors=dim_x*dim_y,
+                                         min_value=min_value_color,
+                                         rng=palette_seed)
+        elif len(palette) < dim_x * dim_y:
+            raise ValueError(f'A {dim_x}x{dim_y} image needs at least '
+                             f'{dim_x * dim_y} colors, got {len(palette)}')
+        self.palette = palette
+        self.palette_index = PaletteIndex(self.palette)
+
+        # Row-major like the final image; `filled` marks the cells that
+        # already hold a color
+        self.canvas = np.zeros((dim_y, dim_x, 3), dtype=np.uint8)
+        self.filled = np.zeros((dim_y, dim_x), dtype=bool)
+        self.frontier = Frontier()
+
+        for seed in range(seeds):
+            # Seeds take colors from the back of the palette
+            index = len(self.palette) - 1 - seed
+            color = self.palette_index.color(index)
+            self.palette_index.remove(index)
+            rand_x = self.stream.below(dim_x)
+            rand_y = self.stream.below(dim_y)
             self.add_pixel(rand_x, rand_y, color)
 
     def add_pixel(self, x, y, color):
-        self.image_array[x][y] = color
-        lower_x = max(0, normal_round(x - self.radius))
-        upper_x = min(self.dim_x - 1, normal_round(x + self.radius)) + 1
-        lower_y = max(0, normal_round(y - self.radius))
-        upper_y = min(self.dim_y - 1, normal_round(y + self.radius)) + 1
-
-        for i in range(lower_x, upper_x):
-            for j in range(lower_y, upper_y):
-                if (i, j) in self.remaining_pixels \
-                        or self.image_array[i][j][0] != -1:
-                    continue
-                x_dist = np.abs(i-x)
-                y_dist = np.abs(j-y)
-                reg_dist = np.power(
-                    (np.power(x_dist, self.p)
-                     + np.power(y_dist, self.p)), (1/self.p))
-                if reg_dist <= self.radius:
-                    self.remaining_pixels.add((i, j))
+        self.canvas[y, x] = color
+        self.filled[y, x] = True
+        for d_x, d_y in self.stencil:
+            i = x + d_x
+            j = y + d_y
+            if i < 0 or j < 0 or i >= self.dim_x or j >= self.dim_y:
+                continue
+            if (i, j) in self.frontier or self.filled[j, i]:
+                continue
+            self.frontier.add(i, j)
 
     def get_neighbor(self, x, y):
         neighbor_list = []
-        lower_x = max(0, normal_round(x - self.radius))
-        upper_x = min(self.dim_x - 1, normal_round(x + self.radius)) + 1
-        lower_y = max(0, normal_round(y - self.radius))
-        upper_y = min(self.dim_y - 1, normal_round(y + self.radius)) + 1
-
-        for i in range(lower_x, upper_x):
-            for j in range(lower_y, upper_y):
-                if self.image_array[i][j][0] == -1:
+        for d_x, d_y in self.stencil:
+            i = x + d_x
+            j = y + d_y
+            if i < 0 or j < 0 or i >= self.dim_x or j >= self.dim_y:
+                continue
+            if self.filled[j, i]:
+                neighbor_list.append((i, j))
+        return self.stream.choice(neighbor_list)
+
+    @classmethod
+    def build_stencil(cls, radius, power):
+        """
+        Returns every (dx, dy) offset within `radius` of a pixel under the
+        Minkowski distance of order `power`, leaving out the pixel itself.
+        Offsets are ordered by dx, then dy, like the old bounding-box scan.
+        """
+        stencil = []
+        lower = normal_round(-radius)
+        upper = normal_round(radius) + 1
+        for d_x in range(lower, upper):
+            for d_y in range(lower, upper):
+                if d_x == 0 and d_y == 0:
                     continue
-                x_dist = abs(i-x)
-                y_dist = abs(j-y)
-                reg_dist = (x_dist ** self.p + y_dist ** self.p) ** (1/self.p)
-                if reg_dist <= self.radius:
-                    neighbor_list.append((i, j))
-        return random.choice(neighbor_list)
+                distance = (abs(d_x) ** power
+                            + abs(d_y) ** power) ** (1 / power)
+                if distance <= radius:
+                    stencil.append((d_x, d_y))
+        return stencil
 
     # def methoddddd(self,
     #                lower_x: int,
@@ -182,19 +373,42 @@ class ImageGeneration:
 
     @classmethod
     def populate_colors(cls, max_pixel=255, unique_colors=256**2, min_value=0):
-        """Returns evenly spaced colors"""
-        all_colors = []
+        """
+        Returns evenly spaced colors as an (unique_colors, 3) uint8 array.
+        Channels are digits of the color number in base `max_pixel`, so
+        `max_pixel` should be at most 255.
+        """
         max_value = max_pixel ** 3
         dim_1_colors = np.linspace(min_value, max_value, num=unique_colors)
-        for i in dim_1_colors:
-            red = int(i % max_pixel)
-            green = int((i // max_pixel) % max_pixel)
-            blue = int(i // (max_pixel ** 2))
-            all_colors.append((red, green, blue))
-        return all_colors
+        colors = np.empty((unique_colors, 3), dtype=np.uint8)
+        colors[:, 0] = dim_1_colors % max_pixel
+        colors[:, 1] = (dim_1_colors // max_pixel) % max_pixel
+        colors[:, 2] = dim_1_colors // (max_pixel ** 2)
+        return colors
+
+    @classmethod
+    def build_palette(cls, unique_colors, min_value=0, max_pixel=255,
+                      rng=None):
+        """
+        Returns the shuffled palette for a run as an (N, 3) uint8 array.
+        Duplicate colors are dropped unless more colors are asked for than
+        there are in the cube, in which case some have to repeat. `rng` is
+        anything np.random.default_rng accepts.
+        """
+        colors = cls.populate_colors(max_pixel=max_pixel,
+                                     unique_colors=unique_colors,
+                                     min_value=min_value)
+        if unique_colors < 255 ** 3:
+            packed = (colors[:, 0].astype(np.int64) << 16
+                      | colors[:, 1].astype(np.int64) << 8
+                      | colors[:, 2])
+            _, first = np.unique(packed, return_index=True)
+            colors = colors[np.sort(first)]
+        generator = np.random.default_rng(rng)
+        return colors[generator.permutation(len(colors))]
 
     def fit_colors(self):
-        last_value = self.dim_x * self.dim_y - 1 - self.seeds
+        last_value = self.dim_x * self.dim_y - self.seeds
 
         if self.progress_bar:
             for i in tqdm(range(last_value)):
@@ -208,23 +422,21 @@ class ImageGeneration:
             #         for y in range(self.dim_y):
             #             self.draw.point((x, y), self.image_array[x][y])
             #     self.save(f"image_tests/images/growth/{i}.png")
-        for x in range(self.dim_x):
-            for y in range(self.dim_y):
-                self.draw.point((x, y), self.image_array[x][y])
+        self.img = Image.fromarray(self.canvas)
 
     def propagate(self):
-        chosen = random.choice(tuple(self.remaining_pixels))
+        chosen = self.frontier.choice(self.stream)
         x, y = chosen
-        # print(len(remaining_pixels))
+        # print(len(self.frontier))
 
         neighbor = self.get_neighbor(*chosen)
         n_x, n_y = neighbor
-        color = get_closest_color(
-            self.image_array[n_x][n_y], self.color_list)
+        index = self.palette_index.nearest(self.canvas[n_y, n_x])
+        color = self.palette_index.color(index)
         self.add_pixel(x, y, color)
 
-        self.remaining_pixels.remove(chosen)
-        self.color_list.remove(color)
+        self.frontier.remove(x, y)
+        self.palette_index.remove(index)
 
         # if is_perfect_square(i):
         #     for x in range(self.dim_x):
@@ -271,8 +483,9 @@ def grow(optional=None, progress_bar=True):
 #     thread = threading.Thread(target=grow, args=(seed_to_use, progress_bar))
 #     thread.start()
 
-seed_to_use = random.randint(0, 1_000_000_000)
-grow(optional=seed_to_use)
+if __name__ == '__main__':
+    seed_to_use = random.randint(0, 1_000_000_000)
+    grow(optional=seed_to_use)
 
 # Speedup options:
 # //Write in another language
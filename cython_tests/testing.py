@@ -1,4 +1,28 @@
+import sys
+import time
+
 import pyximport
 pyximport.install()
 
 import color_test_cython
+import color_testing
+
+# Both backends take the same arguments and produce the same kind of image
+BACKENDS = {
+    'python': color_testing.ImageGeneration,
+    'cython': color_test_cython.ImageGeneration,
+}
+
+
+def run(backend='cython', dim_x=128, dim_y=128, seeds=1, radius=1.0, p=1.0,
+        random_seed=None):
+    start = time.time()
+    image_generator = BACKENDS[backend](dim_x, dim_y, seeds, radius=radius,
+                                        p=p, random_seed=random_seed)
+    image_generator.fit_colors()
+    print(f'{backend}: {time.time() - start}')
+    return image_generator
+
+
+if __name__ == '__main__':
+    run(*sys.argv[1:2])
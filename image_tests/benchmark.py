@@ -0,0 +1,356 @@
+"""
+Benchmarks every ImageGeneration backend on the same workloads.
+
+Each run is split into phases that are timed on their own: building the
+palette, constructing the generator around it, growing the image and saving
+it as a PNG. Every run appends one JSON line to the results file so that
+numbers from different commits can be compared later.
+
+Backends that draw from the same random stream must produce identical
+images for the same seed, and every image must use each palette color
+exactly once. Both are checked and recorded with the timings, along with
+the image's roughness as a measure of its quality.
+
+With `--schedulers` the numba engine is run once per growth scheduler
+instead, to weigh each one's runtime against the roughness it leaves.
+
+Run from the repository root, e.g.
+    python image_tests/benchmark.py --sizes 256x256 --backends pyx-numba
+    python image_tests/benchmark.py --sizes 512x512 --schedulers random bfs
+"""
+import pyximport; pyximport.install()
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                '..', 'cython_tests'))
+
+import color_test
+import color_test_cython
+import color_testing
+from schedulers import SCHEDULERS
+
+SIZES = [(64, 64), (256, 256), (512, 512), (1920, 1080)]
+SETTINGS = [(1.0, 1.0), (1.5, 2.0), (3.0, 0.5)]
+
+# name -> (constructor, keyword for the Minkowski power, extra keywords,
+#          random stream). Backends sharing a stream should agree pixel for
+#          pixel: the Python ones step through a RandomStream, the compiled
+#          ones through an xorshift64* generator seeded from it.
+BACKENDS = {
+    'pure-python': (color_testing.ImageGeneration, 'p', {}, 'stream'),
+    'pyx-python': (color_test.ImageGeneration, 'power', {}, 'stream'),
+    'pyx-numba': (color_test.ImageGeneration, 'power', {'engine': 'numba'},
+                  'xorshift'),
+    'cython-typed': (color_test_cython.ImageGeneration, 'p', {}, 'xorshift'),
+}
+
+# The pure-Python backends place a few thousand pixels a second, which
+# would make a 1080p run take the better part of an hour each
+SLOW_BACKENDS = {'pure-python', 'pyx-python'}
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def roughness(canvas):
+    """
+    Mean RGB distance between horizontally and vertically adjacent pixels.
+    Lower is smoother.
+    """
+    canvas = np.asarray(canvas, dtype=np.float64)
+    across = np.sqrt(np.sum(np.diff(canvas, axis=1) ** 2, axis=-1))
+    down = np.sqrt(np.sum(np.diff(canvas, axis=0) ** 2, axis=-1))
+    return float((np.sum(across) + np.sum(down)) / (across.size + down.size))
+
+
+def run_once(backend, dim_x, dim_y, radius, power, seed, seeds, directory,
+             **options):
+    """
+    Grows one image and returns its phase timings, a canvas digest, whether
+    it used the palette exactly and its roughness. `options` go to the
+    constructor, e.g. `scheduler`.
+    """
+    constructor, power_keyword, extra, _ = BACKENDS[backend]
+    extra = {**extra, **options}
+    timings = {}
+
+    start = time.perf_counter()
+    palette = color_testing.ImageGeneration.build_palette(
+        unique_colors=dim_x * dim_y, rng=seed)
+    timings['palette'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    generator = constructor(dim_x, dim_y, seeds, radius=radius,
+                            random_seed=seed, progress_bar=False,
+                            palette=palette, **{power_keyword: power}, **extra)
+    timings['init'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    generator.fit_colors()
+    timings['propagate'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    generator.save(os.path.join(directory, f'{backend}.png'))
+    timings['save'] = time.perf_counter() - start
+
+    pixels = np.asarray(generator.img).reshape(-1, 3).astype(np.int64)
+    packed = np.sort(pixels @ np.array([1 << 16, 1 << 8, 1]))
+    expected = np.sort(palette[:dim_x * dim_y].astype(np.int64)
+                       @ np.array([1 << 16, 1 << 8, 1]))
+    valid = bool(np.array_equal(packed, expected))
+    digest = hashlib.sha256(np.asarray(generator.img).tobytes()).hexdigest()
+    return timings, digest, valid, roughness(generator.img)
+
+
+def warm_up(backends, schedulers=('random',)):
+    """Compiles the numba kernels so that no run is charged for it"""
+    for backend in backends:
+        for scheduler in schedulers:
+            options = {} if scheduler == 'random' else \
+                {'scheduler': scheduler}
+            with tempfile.TemporaryDirectory() as directory:
+                run_once(backend, 8, 8, 1.0, 1.0, 0, 1, directory, **options)
+
+
+def environment():
+    return {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'system': platform.system(),
+    }
+
+
+def append_records(records, results):
+    if results is None:
+        return
+    os.makedirs(os.path.dirname(results) or '.', exist_ok=True)
+    with open(results, 'a') as handle:
+        for record in records:
+            handle.write(json.dumps(record) + '\n')
+
+
+def benchmark(sizes=SIZES, settings=SETTINGS, backends=tuple(BACKENDS),
+              seed=1, seeds=1, max_slow_pixels=512 * 512,
+              results='image_tests/benchmarks/results.jsonl'):
+    """
+    Runs every backend on every size and (radius, power) setting.
+
+    Parameters
+    ----------
+    sizes : list of (int, int)
+        Canvas sizes as (dim_x, dim_y)
+    settings : list of (float, float)
+        (radius, power) pairs
+    backends : sequence of str
+        Keys of BACKENDS to run
+    seed : int, optional
+        Random seed shared by every run, by default 1
+    seeds : int, optional
+        Number of seed pixels, by default 1
+    max_slow_pixels : int, optional
+        Largest canvas the pure-Python backends are run on, by default
+        512 * 512
+    results : str, optional
+        JSON-lines file the records are appended to, or None to skip
+        writing them
+
+    Returns
+    -------
+    list of dict
+        One record per run
+    """
+    warm_up(backends)
+    machine = environment()
+    records = []
+
+    for dim_x, dim_y in sizes:
+        for radius, power in settings:
+            digests = {}
+            for backend in backends:
+                if backend in SLOW_BACKENDS and \
+                        dim_x * dim_y > max_slow_pixels:
+                    continue
+                with tempfile.TemporaryDirectory() as directory:
+                    timings, digest, valid, rough = run_once(
+                        backend, dim_x, dim_y, radius, power, seed, seeds,
+                        directory)
+                stream = BACKENDS[backend][3]
+                reference = digests.setdefault(stream, (backend, digest))
+                record = {
+                    'time': time.time(),
+                    'backend': backend,
+                    'dim_x': dim_x,
+                    'dim_y': dim_y,
+                    'radius': radius,
+                    'power': power,
+                    'seed': seed,
+                    'seeds': seeds,
+                    'timings': timings,
+                    'total': sum(timings.values()),
+                    'pixels_per_second':
+                        (dim_x * dim_y - seeds) / timings['propagate'],
+                    'roughness': rough,
+                    'digest': digest,
+                    'valid': valid,
+                    # Compared against the first backend run on this stream
+                    'reference': reference[0],
+                    'matches_reference': digest == reference[1],
+                    **machine,
+                }
+                records.append(record)
+                report(record)
+
+    append_records(records, results)
+    return records
+
+
+def compare_schedulers(sizes=SIZES, settings=SETTINGS, schedulers=SCHEDULERS,
+                       seed=1, seeds=1,
+                       results='image_tests/benchmarks/schedulers.jsonl'):
+    """
+    Runs the numba engine with every scheduler on every size and (radius,
+    power) setting, recording runtime and roughness.
+
+    Parameters
+    ----------
+    sizes : list of (int, int)
+        Canvas sizes as (dim_x, dim_y)
+    settings : list of (float, float)
+        (radius, power) pairs
+    schedulers : sequence of str
+        Entries of schedulers.SCHEDULERS to run
+    seed : int, optional
+        Random seed shared by every run, by default 1
+    seeds : int, optional
+        Number of seed pixels, by default 1
+    results : str, optional
+        JSON-lines file the records are appended to, or None to skip
+        writing them
+
+    Returns
+    -------
+    list of dict
+        One record per run
+    """
+    backend = 'pyx-numba'
+    warm_up([backend], schedulers)
+    machine = environment()
+    records = []
+
+    for dim_x, dim_y in sizes:
+        for radius, power in settings:
+            for scheduler in schedulers:
+                with tempfile.TemporaryDirectory() as directory:
+                    timings, digest, valid, rough = run_once(
+                        backend, dim_x, dim_y, radius, power, seed, seeds,
+                        directory, scheduler=scheduler)
+                record = {
+                    'time': time.time(),
+                    'backend': backend,
+                    'scheduler': scheduler,
+                    'dim_x': dim_x,
+                    'dim_y': dim_y,
+                    'radius': radius,
+                    'power': power,
+                    'seed': seed,
+                    'seeds': seeds,
+                    'timings': timings,
+                    'total': sum(timings.values()),
+                    'pixels_per_second':
+                        (dim_x * dim_y - seeds) / timings['propagate'],
+                    'roughness': rough,
+                    'digest': digest,
+                    'valid': valid,
+                    **machine,
+                }
+                records.append(record)
+                print(f"{scheduler:>9} {dim_x:>5}x{dim_y:<5}"
+                      f" r={radius:<4} p={power:<4}"
+                      f" propagate {timings['propagate']:8.3f}s"
+                      f" {record['pixels_per_second']:>11,.0f} px/s"
+                      f" roughness {rough:7.3f}"
+                      f"{'' if valid else ' INVALID'}")
+
+    append_records(records, results)
+    return records
+
+
+def report(record):
+    timings = record['timings']
+    flags = []
+    if not record['valid']:
+        flags.append('INVALID')
+    if not record['matches_reference']:
+        flags.append(f"differs from {record['reference']}")
+    print(f"{record['backend']:>13} {record['dim_x']:>5}x{record['dim_y']:<5}"
+          f" r={record['radius']:<4} p={record['power']:<4}"
+          f" palette {timings['palette']:7.3f}s"
+          f" init {timings['init']:7.3f}s"
+          f" propagate {timings['propagate']:8.3f}s"
+          f" save {timings['save']:6.3f}s"
+          f" {record['pixels_per_second']:>11,.0f} px/s"
+          f" roughness {record['roughness']:7.3f}"
+          f" {' '.join(flags)}")
+
+
+def parse_size(text):
+    dim_x, dim_y = text.lower().split('x')
+    return int(dim_x), int(dim_y)
+
+
+def parse_setting(text):
+    radius, power = text.split(',')
+    return float(radius), float(power)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', nargs='+', type=parse_size,
+                        default=SIZES, metavar='WxH')
+    parser.add_argument('--settings', nargs='+', type=parse_setting,
+                        default=SETTINGS, metavar='RADIUS,POWER')
+    parser.add_argument('--backends', nargs='+', choices=list(BACKENDS),
+                        default=list(BACKENDS))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--seeds', type=int, default=1)
+    parser.add_argument('--max-slow-pixels', type=int, default=512 * 512)
+    parser.add_argument('--schedulers', nargs='+', choices=SCHEDULERS,
+                        help='compare growth schedulers on the numba engine '
+                             'instead of comparing backends')
+    parser.add_argument('--results')
+    arguments = parser.parse_args()
+
+    if arguments.schedulers:
+        records = compare_schedulers(
+            arguments.sizes, arguments.settings, arguments.schedulers,
+            arguments.seed, arguments.seeds,
+            arguments.results or 'image_tests/benchmarks/schedulers.jsonl')
+        sys.exit(0 if all(record['valid'] for record in records) else 1)
+
+    records = benchmark(arguments.sizes, arguments.settings,
+                        arguments.backends, arguments.seed, arguments.seeds,
+                        arguments.max_slow_pixels,
+                        arguments.results
+                        or 'image_tests/benchmarks/results.jsonl')
+    if not all(record['valid'] and record['matches_reference']
+               for record in records):
+        sys.exit(1)
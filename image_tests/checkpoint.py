@@ -0,0 +1,123 @@
+"""
+Checkpoints of a growth run.
+
+A checkpoint holds everything `fit_colors` needs to carry on: the canvas,
+the occupancy map (bit-packed), the frontier cells in order, the order of
+the palette index's entries and the live count of each bucket, the palette
+itself and both random states, the instance's RandomStream and the numba
+kernel's xorshift word, and the heap keys of a priority scheduler.
+Everything else is rebuilt from the run's parameters and the canvas, so a
+run restored from a checkpoint places exactly the pixels the original would
+have.
+
+Checkpoints are single `.npz` files, written to a temporary file and moved
+into place so that a crash while writing leaves the previous one intact.
+"""
+import json
+import os
+
+import numpy as np
+
+from random_stream import seed_from_json, seed_to_json
+
+PARAMETERS = ('dim_x', 'dim_y', 'seeds', 'radius', 'power',
+              'min_value_color', 'distance', 'batch_size', 'engine',
+              'scheduler', 'target')
+
+
+def save_checkpoint(generation, path):
+    """Writes the state of an ImageGeneration to `path`"""
+    index = generation.palette_index
+    frontier = generation.frontier
+    stream_state, stream_words = generation.stream.getstate()
+    rng_state = generation.rng_state
+    meta = {name: getattr(generation, name) for name in PARAMETERS}
+    meta.update(done=generation.done,
+                random_seed=seed_to_json(generation.seed_sequence),
+                stream_state=stream_state)
+    cells = frontier.cells[:frontier.size]
+    # Keys of the cells in heap order; a heap that was never built has none
+    schedule = generation.schedule
+    heap = {}
+    if schedule is not None and schedule.origins is not None:
+        meta.update(tick=schedule.tick)
+        heap = dict(keys=schedule.keys[cells], ticks=schedule.ticks[cells],
+                    sources=schedule.sources[cells],
+                    origins=schedule.origins)
+
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as handle:
+        np.savez(handle,
+                 meta=np.frombuffer(json.dumps(meta).encode(), np.uint8),
+                 palette=np.asarray(generation.palette),
+                 canvas=np.asarray(generation.canvas),
+                 filled=np.packbits(generation.filled),
+                 cells=cells,
+                 counts=index.counts,
+                 entries=index.entries,
+                 stream_words=stream_words,
+                 rng_state=np.zeros(1, dtype=np.uint64)
+                 if rng_state is None else np.asarray(rng_state),
+                 **heap)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(temporary, path)
+
+
+def load_checkpoint(cls, path, **kwargs):
+    """
+    Returns an instance of the ImageGeneration class `cls` in the state
+    saved at `path`. `kwargs` go to the constructor, e.g. `progress_bar`.
+    """
+    with np.load(path) as saved:
+        meta = json.loads(saved['meta'].tobytes())
+        generation = cls(meta['dim_x'], meta['dim_y'], meta['seeds'],
+                         radius=meta['radius'], power=meta['power'],
+                         min_value_color=meta['min_value_color'],
+                         random_seed=seed_from_json(meta['random_seed']),
+                         palette=saved['palette'],
+                         distance=meta['distance'],
+                         batch_size=meta['batch_size'],
+                         engine=meta['engine'],
+                         scheduler=meta.get('scheduler', 'random'),
+                         target=meta.get('target', 'neighbour'),
+                         **kwargs)
+
+        generation.canvas[...] = saved['canvas']
+        filled = np.unpackbits(saved['filled'], count=generation.filled.size)
+        generation.filled[...] = filled.reshape(generation.filled.shape)
+
+        frontier = generation.frontier
+        cells = saved['cells']
+        frontier.positions[frontier.cells[:frontier.size]] = -1
+        frontier.cells[:len(cells)] = cells
+        frontier.positions[cells] = np.arange(len(cells))
+        frontier.size = len(cells)
+
+        if generation.neighbourhood is not None:
+            generation.neighbourhood.rebuild(generation.canvas,
+                                             generation.filled,
+                                             generation.offsets)
+
+        if 'origins' in saved:
+            schedule = generation.schedule
+            schedule.keys[cells] = saved['keys']
+            schedule.ticks[cells] = saved['ticks']
+            schedule.sources[cells] = saved['sources']
+            schedule.origins = saved['origins']
+            schedule.tick = meta['tick']
+
+        index = generation.palette_index
+        index.counts[...] = saved['counts']
+        index.entries[...] = saved['entries']
+        index.slots[index.entries] = np.arange(len(index.entries))
+        index.remaining = int(np.sum(index.counts))
+
+        if generation.rng_state is None:
+            generation.rng_state = np.zeros(1, dtype=np.uint64)
+        generation.rng_state[...] = saved['rng_state']
+        generation.stream.setstate((meta['stream_state'],
+                                    saved['stream_words']))
+
+    generation.done = meta['done']
+    return generation
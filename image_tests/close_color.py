@@ -21,7 +21,8 @@ def grow(optional=None, progress_bar=True):
     image_generator = ImageGeneration(dim_x, dim_y,
                                       seeds, radius=r, power=p,
                                       random_seed=optional,
-                                      progress_bar=progress_bar)
+                                      progress_bar=progress_bar,
+                                      engine='numba')
     image_generator.fit_colors()
     end = time.time()
     # print(dim_x * dim_y)
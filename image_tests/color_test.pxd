@@ -1,6 +1,13 @@
 from cpython cimport bool
 
 cdef class ImageGeneration:
-    cdef public int seeds, random_seed, dim_x, dim_y
+    cdef public int seeds, dim_x, dim_y, batch_size
+    cdef public int min_value_color
+    cdef public long long done
     cdef public double power, radius
-    cdef public bool progress_bar
\ No newline at end of file
+    cdef public bool progress_bar
+    cdef public object img
+    cdef public object palette, palette_index, distance, engine, rng_state
+    cdef public object scheduler, schedule, target, neighbourhood
+    cdef public object random_seed, seed_sequence, stream
+    cdef public object canvas, filled, frontier, stencil, offsets, store
@@ -1,14 +1,24 @@
 #cython: language_level=3
-import random
+import signal
+import threading
 import time
 
 import numpy as np
-from numba.typed import List
 # from libcpp cimport bool
-from PIL import Image, ImageDraw
+from PIL import Image
 from tqdm import tqdm
 
-from numba_funcs import get_closest_color, is_perfect_square, normal_round
+from numba_funcs import normal_round
+from checkpoint import load_checkpoint, save_checkpoint
+from disk import DiskStore, write_png
+from frontier import Frontier
+from growth_kernel import grow
+from neighbourhood import NeighbourhoodSums
+from palette_index import PaletteIndex
+from perceptual import LabPaletteIndex
+from random_stream import (RandomStream, children, seed_from_json,
+                           seed_to_json)
+from schedulers import SCHEDULERS, Scheduler
 
 # TODO: Break this code back down from class, then Cythonize it from there
 cdef class ImageGeneration:
@@ -18,92 +28,269 @@ cdef class ImageGeneration:
                  radius=1.0, power=1.0,
                  min_value_color=0,
                  random_seed=None,
-                 progress_bar=True):
+                 progress_bar=True,
+                 palette=None,
+                 distance='rgb',
+                 batch_size=1,
+                 engine='python',
+                 directory=None,
+                 scheduler='random',
+                 target='neighbour'):
 
-        if random_seed is not None:
-            random.seed(random_seed)
-            self.random_seed = random_seed
+        # Every instance has its own streams, so instances never disturb
+        # each other. `random_seed` can be an int or a SeedSequence, such as
+        # one of the children RandomStream.spawn hands to worker processes
+        self.random_seed = 42 if random_seed is None else random_seed
+        if isinstance(self.random_seed, np.random.SeedSequence):
+            self.seed_sequence = self.random_seed
         else:
-            self.random_seed = 42
-            random.seed(42)
+            self.seed_sequence = np.random.SeedSequence(self.random_seed)
+        # The palette shuffle has a stream of its own, so passing in a
+        # palette leaves the growth of the image unchanged
+        palette_seed, growth_seed = children(self.seed_sequence, 2)
+        self.stream = RandomStream(growth_seed)
 
         self.seeds = seeds
+        self.min_value_color = min_value_color
         self.dim_x = dim_x
         self.dim_y = dim_y
         self.power = float(power)
         self.radius = float(radius)
         self.progress_bar = progress_bar
+        self.stencil = self.build_stencil(self.radius, self.power)
+        self.offsets = np.array(self.stencil, dtype=np.int64).reshape(-1, 2)
+        # Pixels placed per step; 1 keeps the exact sequential behaviour
+        self.batch_size = batch_size
+        # 'python' steps through propagate(), 'numba' hands the whole loop
+        # to growth_kernel.grow
+        self.engine = engine
+        if engine not in ('python', 'numba'):
+            raise ValueError(f'Unknown engine {engine!r}')
+        if engine == 'numba' and (distance != 'rgb' or batch_size != 1):
+            raise ValueError("The numba engine only supports distance='rgb' "
+                             "with batch_size=1")
+        # 'random' colors a uniformly random frontier cell each step, the
+        # others keep the frontier in a heap (see schedulers.py)
+        self.scheduler = scheduler
+        if scheduler not in SCHEDULERS:
+            raise ValueError(f'Unknown scheduler {scheduler!r}')
+        if scheduler != 'random' and (engine != 'numba'
+                                      or directory is not None):
+            raise ValueError(f'The {scheduler!r} scheduler needs the numba '
+                             f'engine and an in-memory run')
+        # 'neighbour' matches the color of a random filled neighbour,
+        # 'average' the mean color of all of them
+        self.target = target
+        if target not in ('neighbour', 'average'):
+            raise ValueError(f'Unknown target {target!r}')
+        if target == 'average' and scheduler == 'error':
+            raise ValueError("The 'error' scheduler targets the pixel that "
+                             "brought a cell in, not the average")
 
-        self.img = Image.new('RGB', (dim_x, dim_y))
-        self.draw = ImageDraw.Draw(self.img)
+        # With a directory every array of the run is memmapped from there,
+        # so the canvas can be bigger than memory and the run picks up where
+        # it stopped when the same directory is used again
+        self.store = None
+        if directory is not None:
+            if distance != 'rgb':
+                raise ValueError("Out-of-core runs only support "
+                                 "distance='rgb'")
+            self.store = DiskStore(directory)
+            if self.store.resuming:
+                self.check_meta(min_value_color)
+            self.img = None
+        else:
+            self.img = Image.new('RGB', (dim_x, dim_y))
+        resuming = self.store is not None and self.store.resuming
 
-        self.color_list = self.populate_colors(unique_colors=dim_x*dim_y,
-                                               min_value=min_value_color)
-        random.shuffle(self.color_list)
+        if resuming:
+            palette = self.store.array('palette', np.uint8,
+                                       (self.store.meta['colors'], 3))
+        elif palette is None:
+            if self.store is None:
+                palette = self.build_palette(unique_colors=dim_x*dim_y,
+                                             min_value=min_value_color,
+                                             rng=palette_seed)
+            else:
+                palette = self.build_palette_on_disk(
+                    self.store, unique_colors=dim_x*dim_y,
+                    min_value=min_value_color, rng=palette_seed)
+        elif len(palette) < dim_x * dim_y:
+            raise ValueError(f'A {dim_x}x{dim_y} image needs at least '
+                             f'{dim_x * dim_y} colors, got {len(palette)}')
+        elif self.store is not None:
+            palette = self.store.array('palette', np.uint8, np.shape(palette),
+                                       fill=palette)
+        self.palette = palette
+        # 'rgb' matches on Euclidean RGB distance, 'ciede2000' perceptually
+        self.distance = distance
+        if distance == 'rgb':
+            self.palette_index = PaletteIndex(self.palette, store=self.store)
+        elif distance == 'ciede2000':
+            self.palette_index = LabPaletteIndex(self.palette)
+        else:
+            raise ValueError(f'Unknown distance {distance!r}')
 
-        if dim_x * dim_y < 255 ** 3:
-            self.color_list = set(self.color_list)
+        # Row-major like the final image; `filled` marks the cells that
+        # already hold a color
+        if self.store is None:
+            self.canvas = np.zeros((dim_y, dim_x, 3), dtype=np.uint8)
+            self.filled = np.zeros((dim_y, dim_x), dtype=bool)
+            self.rng_state = None
+        else:
+            self.canvas = self.store.array('canvas', np.uint8,
+                                           (dim_y, dim_x, 3), fill=0)
+            self.filled = self.store.array('filled', bool, (dim_y, dim_x),
+                                           fill=False)
+            self.rng_state = self.store.array('rng_state', np.uint64, 1,
+                                              fill=0)
+        # Pixels placed by fit_colors so far
+        self.done = 0
+        saved = None
+        if resuming:
+            self.done = int(np.count_nonzero(self.filled)) \
+                - self.store.meta['seeded']
+            # The frontier size and the python stream are only recorded when
+            # fit_colors stops, and are stale after a hard kill
+            if self.store.meta.get('done') == self.done:
+                saved = self.store.meta
+        self.frontier = Frontier(dim_x, dim_y, store=self.store,
+                                 size=None if saved is None
+                                 else saved['frontier_size'])
+        self.neighbourhood = None
+        if target == 'average':
+            self.neighbourhood = NeighbourhoodSums(dim_x, dim_y,
+                                                   store=self.store)
+        self.schedule = None
+        if scheduler != 'random':
+            self.schedule = Scheduler(scheduler, dim_x, dim_y)
+        if resuming:
+            if saved is not None:
+                self.stream.setstate((saved['stream_state'],
+                                      saved['stream_words']))
+            return
 
-        # self.color_list = List()
-        temp = List()
-        for i in self.color_list:
-            temp.append(i)
-        self.color_list = temp
-        del temp
+        for seed in range(seeds):
+            # Seeds take colors from the back of the palette
+            index = len(self.palette) - 1 - seed
+            color = self.palette_index.color(index)
+            self.palette_index.remove(index)
+            rand_x = self.stream.below(dim_x)
+            rand_y = self.stream.below(dim_y)
+            self.add_pixel(rand_x, rand_y, color)
 
-        self.image_array = []
-        self.remaining_pixels = set()
+        if self.store is not None:
+            self.store.write_meta({
+                'dim_x': dim_x, 'dim_y': dim_y, 'seeds': seeds,
+                'radius': self.radius, 'power': self.power,
+                'min_value_color': min_value_color,
+                'random_seed': seed_to_json(self.seed_sequence),
+                'target': target,
+                'engine': engine, 'batch_size': batch_size,
+                'colors': len(self.palette),
+                'seeded': int(np.count_nonzero(self.filled)),
+            })
+            # A run reopened before it ever grew carries on from the seeds
+            self.save_state()
 
-        for x in range(dim_x):
-            self.image_array.append([])
-            for y in range(dim_y):
-                self.image_array[x].append((-1, -1, -1))
-                # remaining_pixels.append((x, y))
+    @classmethod
+    def resume(cls, directory, **kwargs):
+        """
+        Reopens the out-of-core run in `directory`. `kwargs` go to the
+        constructor, e.g. `progress_bar`. The engine, batch size and target
+        default to the ones the run was started with.
+        """
+        meta = DiskStore(directory).meta
+        if meta is None:
+            raise FileNotFoundError(f'No run to resume in {directory}')
+        kwargs = {**{key: meta[key] for key in ('engine', 'batch_size',
+                                                'target') if key in meta},
+                  **kwargs}
+        return cls(meta['dim_x'], meta['dim_y'], meta['seeds'],
+                   radius=meta['radius'], power=meta['power'],
+                   min_value_color=meta['min_value_color'],
+                   random_seed=seed_from_json(meta['random_seed']),
+                   directory=directory,
+                   **kwargs)
 
-        for _ in range(seeds):
-            color = self.color_list.pop()
-            rand_x = random.randint(0, dim_x - 1)
-            rand_y = random.randint(0, dim_y - 1)
-            self.add_pixel(rand_x, rand_y, color)
+    @classmethod
+    def from_checkpoint(cls, path, **kwargs):
+        """
+        Restores a run from a checkpoint written by `fit_colors` or
+        `checkpoint`. `kwargs` go to the constructor, e.g. `progress_bar`.
+        """
+        return load_checkpoint(cls, path, **kwargs)
+
+    def checkpoint(self, path):
+        save_checkpoint(self, path)
+
+    def check_meta(self, min_value_color):
+        # Runs from before targets were configurable matched a neighbour
+        meta = {'target': 'neighbour', **self.store.meta}
+        expected = {'dim_x': self.dim_x, 'dim_y': self.dim_y,
+                    'seeds': self.seeds, 'radius': self.radius,
+                    'power': self.power, 'min_value_color': min_value_color,
+                    'random_seed': seed_to_json(self.seed_sequence),
+                    'target': self.target, 'engine': self.engine,
+                    'batch_size': self.batch_size}
+        for key, value in expected.items():
+            # Runs from before the engine and batch size were recorded are
+            # taken on trust
+            if key in meta and meta[key] != value:
+                raise ValueError(f'{self.store.directory} holds a run with '
+                                 f'{key}={meta[key]!r}, not {value!r}')
 
     def add_pixel(self, x, y, color):
-        self.image_array[x][y] = color
-        lower_x = max(0, normal_round(x - self.radius))
-        upper_x = min(self.dim_x - 1, normal_round(x + self.radius)) + 1
-        lower_y = max(0, normal_round(y - self.radius))
-        upper_y = min(self.dim_y - 1, normal_round(y + self.radius)) + 1
-
-        for i in range(lower_x, upper_x):
-            for j in range(lower_y, upper_y):
-                if (i, j) in self.remaining_pixels \
-                        or self.image_array[i][j][0] != -1:
-                    continue
-                x_dist = np.abs(i-x)
-                y_dist = np.abs(j-y)
-                reg_dist = np.power(
-                    (np.power(x_dist, self.power)
-                     + np.power(y_dist, self.power)), (1/self.power))
-                if reg_dist <= self.radius:
-                    self.remaining_pixels.add((i, j))
+        self.canvas[y, x] = color
+        self.filled[y, x] = True
+        if self.neighbourhood is not None:
+            self.neighbourhood.add(x, y, color, self.filled, self.offsets)
+        for d_x, d_y in self.stencil:
+            i = x + d_x
+            j = y + d_y
+            if i < 0 or j < 0 or i >= self.dim_x or j >= self.dim_y:
+                continue
+            if (i, j) in self.frontier or self.filled[j, i]:
+                continue
+            self.frontier.add(i, j)
 
     def get_neighbor(self, x, y):
         neighbor_list = []
-        lower_x = max(0, normal_round(x - self.radius))
-        upper_x = min(self.dim_x - 1, normal_round(x + self.radius)) + 1
-        lower_y = max(0, normal_round(y - self.radius))
-        upper_y = min(self.dim_y - 1, normal_round(y + self.radius)) + 1
-
-        for i in range(lower_x, upper_x):
-            for j in range(lower_y, upper_y):
-                if self.image_array[i][j][0] == -1:
+        for d_x, d_y in self.stencil:
+            i = x + d_x
+            j = y + d_y
+            if i < 0 or j < 0 or i >= self.dim_x or j >= self.dim_y:
+                continue
+            if self.filled[j, i]:
+                neighbor_list.append((i, j))
+        return self.stream.choice(neighbor_list)
+
+    def target_color(self, x, y):
+        """The color the pixel at (x, y) should be matched to"""
+        if self.neighbourhood is not None:
+            return self.neighbourhood.average(x, y)
+        n_x, n_y = self.get_neighbor(x, y)
+        return self.canvas[n_y, n_x]
+
+    @classmethod
+    def build_stencil(cls, radius, power):
+        """
+        Returns every (dx, dy) offset within `radius` of a pixel under the
+        Minkowski distance of order `power`, leaving out the pixel itself.
+        Offsets are ordered by dx, then dy, like the old bounding-box scan.
+        """
+        stencil = []
+        lower = normal_round(-radius)
+        upper = normal_round(radius) + 1
+        for d_x in range(lower, upper):
+            for d_y in range(lower, upper):
+                if d_x == 0 and d_y == 0:
                     continue
-                x_dist = abs(i-x)
-                y_dist = abs(j-y)
-                reg_dist = (x_dist ** self.power + y_dist **
-                            self.power) ** (1/self.power)
-                if reg_dist <= self.radius:
-                    neighbor_list.append((i, j))
-        return random.choice(neighbor_list)
+                distance = (abs(d_x) ** power
+                            + abs(d_y) ** power) ** (1 / power)
+                if distance <= radius:
+                    stencil.append((d_x, d_y))
+        return stencil
 
     # def methoddddd(self,
     #                lower_x: int,
@@ -150,57 +337,350 @@ cdef class ImageGeneration:
     #     return choice
 
     @classmethod
-    def populate_colors(cls, max_pixel=255, unique_colors=256**2, min_value=0):
-        """Returns evenly spaced colors"""
-        all_colors = []
+    def populate_colors(cls, max_pixel=255, unique_colors=256**2, min_value=0,
+                        first=0, last=None):
+        """
+        Returns evenly spaced colors as an (unique_colors, 3) uint8 array, or
+        only its rows `first` to `last`. Channels are digits of the color
+        number in base `max_pixel`, so `max_pixel` should be at most 255.
+        """
+        if last is None:
+            last = unique_colors
         max_value = max_pixel ** 3
-        dim_1_colors = np.linspace(min_value, max_value, num=unique_colors)
-        for i in dim_1_colors:
-            red = int(i % max_pixel)
-            green = int((i // max_pixel) % max_pixel)
-            blue = int(i // (max_pixel ** 2))
-            all_colors.append((red, green, blue))
-        return all_colors
-
-    def fit_colors(self):
-        last_value = self.dim_x * self.dim_y - 1 - self.seeds
-
-        if self.progress_bar:
-            for i in tqdm(range(last_value)):
-                self.propagate(i)
-        else:
-            for i in range(last_value):
-                self.propagate(i)
+        # The same values np.linspace(min_value, max_value, unique_colors)
+        # gives, computed for just the rows asked for
+        step = (max_value - min_value) / max(unique_colors - 1, 1)
+        dim_1_colors = np.arange(first, last, dtype=np.float64) * step \
+            + min_value
+        if last == unique_colors and unique_colors > 1:
+            dim_1_colors[-1] = max_value
+        colors = np.empty((last - first, 3), dtype=np.uint8)
+        colors[:, 0] = dim_1_colors % max_pixel
+        colors[:, 1] = (dim_1_colors // max_pixel) % max_pixel
+        colors[:, 2] = dim_1_colors // (max_pixel ** 2)
+        return colors
+
+    @classmethod
+    def build_palette(cls, unique_colors, min_value=0, max_pixel=255,
+                      rng=None):
+        """
+        Returns the shuffled palette for a run as an (N, 3) uint8 array.
+        Duplicate colors are dropped unless more colors are asked for than
+        there are in the cube, in which case some have to repeat. `rng` is
+        anything np.random.default_rng accepts.
+        """
+        colors = cls.populate_colors(max_pixel=max_pixel,
+                                     unique_colors=unique_colors,
+                                     min_value=min_value)
+        if unique_colors < 255 ** 3:
+            packed = (colors[:, 0].astype(np.int64) << 16
+                      | colors[:, 1].astype(np.int64) << 8
+                      | colors[:, 2])
+            _, first = np.unique(packed, return_index=True)
+            colors = colors[np.sort(first)]
+        generator = np.random.default_rng(rng)
+        return colors[generator.permutation(len(colors))]
+
+    @classmethod
+    def build_palette_on_disk(cls, store, unique_colors, min_value=0,
+                              max_pixel=255, rng=None, rows=1 << 22):
+        """
+        build_palette into an array of `store`. Palettes that repeat colors
+        are generated `rows` colors at a time and shuffled in place, which
+        gives the same order as build_palette without holding them in
+        memory. Smaller ones have to be deduplicated and are built in memory.
+        """
+        if unique_colors < 255 ** 3:
+            colors = cls.build_palette(unique_colors, min_value, max_pixel,
+                                       rng)
+            return store.array('palette', np.uint8, colors.shape, fill=colors)
+
+        palette = store.array('palette', np.uint8, (unique_colors, 3))
+        for first in range(0, unique_colors, rows):
+            last = min(first + rows, unique_colors)
+            palette[first:last] = cls.populate_colors(
+                max_pixel, unique_colors, min_value, first, last)
+        generator = np.random.default_rng(rng)
+        generator.shuffle(palette)
+        return palette
+
+    def fit_colors(self, progress=None, report_every=4096, snapshots=None,
+                   trace=None, checkpoint=None, checkpoint_every=1 << 20):
+        """
+        Grows the image until the canvas is full. `progress` can be anything
+        with a tqdm-style `update(n)`, and is told about finished steps every
+        `report_every` pixels rather than on each one. `snapshots` is an
+        optional SnapshotWriter that gets every placed pixel, and `trace` an
+        optional instruments.GrowthTrace that gets sampled step timings and
+        per-chunk counters. With a `checkpoint` path the state of the run is
+        saved there about every `checkpoint_every` pixels, for
+        `from_checkpoint` to pick up.
+
+        A run that was restored, or reopened from its directory, carries on
+        from where it stopped. Out of core, Ctrl-C stops the run at the end
+        of the current chunk and records the state the arrays do not hold,
+        so that `resume` places exactly the pixels an uninterrupted run
+        would with either engine. Snapshots are closed either way, and a
+        SnapshotWriter with `append=True` carries on their animation.
+        """
+        last_value = self.dim_x * self.dim_y - self.seeds
+        done = self.done
 
-        for x in range(self.dim_x):
-            for y in range(self.dim_y):
-                self.draw.point((x, y), self.image_array[x][y])
+        own_bar = progress is None and self.progress_bar
+        if own_bar:
+            progress = tqdm(total=last_value, initial=done)
+
+        if snapshots is not None:
+            snapshots.start(self.canvas, self.filled)
+
+        interrupted = []
+        handler = None
+        if self.store is not None and \
+                threading.current_thread() is threading.main_thread():
+            handler = signal.signal(signal.SIGINT,
+                                    lambda *_: interrupted.append(True))
+        try:
+            try:
+                self.grow_chunks(done, last_value, progress, report_every,
+                                 snapshots, trace, checkpoint,
+                                 checkpoint_every, interrupted)
+            finally:
+                if handler is not None:
+                    signal.signal(signal.SIGINT, handler)
+            if self.store is not None:
+                self.save_state()
+            if interrupted:
+                raise KeyboardInterrupt
+        finally:
+            # An interrupted run still finishes its frames and animation,
+            # which a resumed run can then append to
+            if snapshots is not None:
+                snapshots.close(self.canvas, self.done)
+            if own_bar:
+                progress.close()
+
+        if self.store is None:
+            self.img = Image.fromarray(self.canvas)
+
+    def grow_chunks(self, done, last_value, progress, report_every,
+                    snapshots, trace, checkpoint, checkpoint_every,
+                    interrupted):
+        """
+        The growth loop of `fit_colors`, which returns early once
+        `interrupted` is set
+        """
+        while done < last_value and not interrupted:
+            stop = min(done + report_every, last_value)
+            if trace is not None:
+                started = time.perf_counter_ns()
+            if self.engine == 'numba':
+                if snapshots is not None:
+                    stop = min(stop, snapshots.next_frame(done) + 1)
+                stop = self.grow_compiled(done, stop, snapshots)
+            elif self.batch_size > 1:
+                stop = self.grow_batches(done, stop, snapshots)
+            elif trace is not None:
+                self.grow_traced(done, stop, trace, snapshots)
+            elif snapshots is None:
+                for i in range(done, stop):
+                    self.propagate(i)
+            else:
+                for i in range(done, stop):
+                    x, y = self.propagate(i)
+                    snapshots.update(self.canvas, x, y, i)
+            if trace is not None:
+                trace.chunk(stop - 1, stop - done, len(self.frontier),
+                            len(self.palette_index), started,
+                            time.perf_counter_ns() - started)
+            if progress is not None:
+                progress.update(stop - done)
+            if checkpoint is not None and \
+                    stop // checkpoint_every > done // checkpoint_every:
+                self.done = stop
+                self.checkpoint(checkpoint)
+            done = self.done = stop
+
+    def save_state(self):
+        """
+        Records what an out-of-core run keeps outside its arrays: the pixel
+        count, the frontier size and the growth stream
+        """
+        stream_state, stream_words = self.stream.getstate()
+        self.store.write_meta({**self.store.meta, 'done': self.done,
+                               'frontier_size': len(self.frontier),
+                               'stream_state': stream_state,
+                               'stream_words': stream_words.tolist()})
 
     def propagate(self, iteration):
-        chosen = random.choice(tuple(self.remaining_pixels))
+        chosen = self.frontier.choice(self.stream)
         x, y = chosen
-        # print(len(remaining_pixels))
+        # print(len(self.frontier))
 
-        neighbor = self.get_neighbor(*chosen)
-        n_x, n_y = neighbor
-        color = get_closest_color(
-            self.image_array[n_x][n_y], self.color_list)
+        index = self.palette_index.nearest(self.target_color(x, y))
+        color = self.palette_index.color(index)
         self.add_pixel(x, y, color)
 
-        self.remaining_pixels.remove(chosen)
-        self.color_list.remove(color)
+        self.frontier.remove(x, y)
+        self.palette_index.remove(index)
+        return chosen
+
+    def grow_traced(self, start, stop, trace, snapshots=None):
+        """
+        Places pixels `start` to `stop` one at a time, sending the steps that
+        `trace` samples through propagate_traced
+        """
+        for i in range(start, stop):
+            if trace.is_sample(i):
+                x, y = self.propagate_traced(i, trace)
+            else:
+                x, y = self.propagate(i)
+            if snapshots is not None:
+                snapshots.update(self.canvas, x, y, i)
+
+    def propagate_traced(self, iteration, trace):
+        """propagate with a timer around each phase"""
+        started = time.perf_counter_ns()
+        chosen = self.frontier.choice(self.stream)
+        x, y = chosen
+        selected = time.perf_counter_ns()
+
+        target = self.target_color(x, y)
+        neighboured = time.perf_counter_ns()
+
+        index = self.palette_index.nearest(target)
+        color = self.palette_index.color(index)
+        queried = time.perf_counter_ns()
+
+        self.add_pixel(x, y, color)
+        self.frontier.remove(x, y)
+        self.palette_index.remove(index)
+        updated = time.perf_counter_ns()
+
+        distance = float(np.linalg.norm(np.subtract(color, target,
+                                                    dtype=np.int64)))
+        trace.step(iteration, len(self.frontier), len(self.palette_index),
+                   distance, started,
+                   (selected - started, neighboured - selected,
+                    queried - neighboured, updated - queried))
+        return chosen
+
+    def grow_compiled(self, start, stop, snapshots=None):
+        """
+        Places pixels `start` to `stop` with the numba kernel and returns
+        the new pixel count
+        """
+        if self.rng_state is None:
+            self.rng_state = np.zeros(1, dtype=np.uint64)
+        if not self.rng_state[0]:
+            # Seed the kernel's generator from the instance's stream
+            self.rng_state[0] = self.stream.raw() | 1
+        index = self.palette_index
+        order = np.empty(stop - start, dtype=np.int64)
+        average = self.neighbourhood is not None
+        if average:
+            sums = self.neighbourhood.sums
+            sum_counts = self.neighbourhood.counts
+        else:
+            sums = np.zeros((0, 0, 3), dtype=np.int32)
+            sum_counts = np.zeros((0, 0), dtype=np.int32)
+        if self.schedule is not None:
+            placed = self.schedule.grow(self.canvas, self.filled,
+                                        self.frontier, index, self.offsets,
+                                        self.rng_state, order,
+                                        sums, sum_counts, average)
+        else:
+            placed, self.frontier.size = grow(
+                self.canvas, self.filled,
+                self.frontier.cells, self.frontier.positions,
+                self.frontier.size,
+                index.colors, index.owner, index.starts, index.counts,
+                index.entries, index.slots, index.shift, index.per_axis,
+                self.offsets, self.rng_state, order,
+                sums, sum_counts, average)
+        index.remaining -= placed
+        if snapshots is not None:
+            order = order[:placed]
+            snapshots.extend(self.canvas, order % self.dim_x,
+                             order // self.dim_x, start + placed - 1)
+        return start + placed
+
+    def grow_batches(self, start, stop, snapshots=None):
+        """
+        Runs batched steps until at least `stop - start` pixels are placed,
+        never going past `stop`, and returns the new pixel count
+        """
+        done = start
+        while done < stop:
+            xs, ys = self.propagate_batch(stop - done)
+            if snapshots is not None:
+                for x, y in zip(xs.tolist(), ys.tolist()):
+                    snapshots.update(self.canvas, x, y, done)
+                    done += 1
+            else:
+                done += len(xs)
+        return done
+
+    def propagate_batch(self, limit):
+        """
+        Places up to `batch_size` pixels at once and returns their
+        coordinates as two arrays.
+
+        Frontier pixels are drawn at random, skipping any that fall inside
+        the stencil of one already drawn, so no pixel in the batch can see
+        another. Their nearest-color queries are then resolved in a single
+        call in draw order: when two want the same color the first one
+        drawn gets it.
+        """
+        batch = min(self.batch_size, limit, len(self.frontier))
+        blocked = set()
+        chosen = []
+        for _ in range(2 * batch):
+            x, y = self.frontier.choice(self.stream)
+            if (x, y) in blocked:
+                continue
+            chosen.append((x, y))
+            if len(chosen) == batch:
+                break
+            blocked.add((x, y))
+            blocked.update((x + d_x, y + d_y) for d_x, d_y in self.stencil)
+
+        targets = np.empty((len(chosen), 3), dtype=np.int64)
+        for k, (x, y) in enumerate(chosen):
+            targets[k] = self.target_color(x, y)
+        indices = self.palette_index.take_nearest(targets)
+
+        xs = np.array([x for x, _ in chosen], dtype=np.int64)
+        ys = np.array([y for _, y in chosen], dtype=np.int64)
+        self.canvas[ys, xs] = self.palette[indices]
+        self.filled[ys, xs] = True
+        for x, y in chosen:
+            self.frontier.remove(x, y)
 
-        # if is_perfect_square(iteration):
-        #     for x in range(self.dim_x):
-        #         for y in range(self.dim_y):
-        #             self.draw.point((x, y), self.image_array[x][y])
-        #     self.save(
-        #         f"image_tests/images/grow/1/{self.dim_x}x{self.dim_y}_"
-        #         f"{self.random_seed}_radius_{self.radius:.1f}_power_"
-        #         f"{self.p:.1f}_{np.sqrt(iteration)}.png")
+        # Every empty cell in the stencil of a new pixel joins the frontier
+        n_xs = (xs[:, None] + self.offsets[:, 0]).ravel()
+        n_ys = (ys[:, None] + self.offsets[:, 1]).ravel()
+        inside = (n_xs >= 0) & (n_xs < self.dim_x) \
+            & (n_ys >= 0) & (n_ys < self.dim_y)
+        n_xs = n_xs[inside]
+        n_ys = n_ys[inside]
+        if self.neighbourhood is not None:
+            colors = np.repeat(self.palette[indices], len(self.offsets),
+                               axis=0)
+            self.neighbourhood.add_many(n_xs, n_ys, colors[inside],
+                                        self.filled)
+        empty = ~self.filled[n_ys, n_xs]
+        self.frontier.add_many(n_ys[empty] * self.dim_x + n_xs[empty])
+        return xs, ys
 
     def show(self, *args, **kwargs):
+        if self.store is not None:
+            Image.fromarray(np.asarray(self.canvas)).show(*args, **kwargs)
+            return
         self.img.show(*args, **kwargs)
 
     def save(self, *args, **kwargs):
+        if self.store is not None:
+            # Out-of-core canvases are written as PNG a strip at a time
+            write_png(self.canvas, *args, **kwargs)
+            return
         self.img.save(*args, **kwargs)
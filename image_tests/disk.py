@@ -0,0 +1,107 @@
+"""
+Out-of-core storage for canvases too big to hold in memory.
+
+A DiskStore keeps every array a run needs as an `np.memmap` file in one
+directory, next to a small JSON file with the run's parameters. The growth
+loop updates those arrays in place, so the directory always holds the state
+of the run up to the last placed pixel and can be reopened to carry on after
+an interruption. `write_png` encodes a canvas a strip of rows at a time, so
+saving never needs more than one strip in memory.
+"""
+import json
+import os
+import struct
+import zlib
+
+import numpy as np
+
+META = 'meta.json'
+
+
+class DiskStore:
+    """
+    Directory of named memmapped arrays.
+
+    Parameters
+    ----------
+    directory : str
+        Where the arrays live. Created if missing
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.meta = self.read_meta()
+        # Arrays are only trusted once the run that made them has written
+        # its metadata; anything else is a run that died while starting up
+        self.resuming = self.meta is not None
+        self.arrays = {}
+
+    def path(self, name):
+        return os.path.join(self.directory, f'{name}.bin')
+
+    def array(self, name, dtype, shape, fill=None):
+        """
+        Returns the named array, reopening it when resuming and creating it
+        (filled with `fill`, if given) otherwise
+        """
+        mode = 'r+' if self.resuming else 'w+'
+        array = np.memmap(self.path(name), dtype=dtype, mode=mode,
+                          shape=shape)
+        if fill is not None and not self.resuming:
+            array[...] = fill
+        self.arrays[name] = array
+        return array
+
+    def flush(self):
+        for array in self.arrays.values():
+            array.flush()
+
+    def read_meta(self):
+        try:
+            with open(os.path.join(self.directory, META)) as handle:
+                return json.load(handle)
+        except FileNotFoundError:
+            return None
+
+    def write_meta(self, meta):
+        """Flushes the arrays, then writes `meta` atomically"""
+        self.flush()
+        path = os.path.join(self.directory, META)
+        with open(path + '.tmp', 'w') as handle:
+            json.dump(meta, handle, indent=2)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(path + '.tmp', path)
+        self.meta = meta
+
+
+def png_chunk(kind, data):
+    body = kind + data
+    return struct.pack('>I', len(data)) + body \
+        + struct.pack('>I', zlib.crc32(body))
+
+
+def write_png(canvas, path, rows=256, level=6):
+    """
+    Writes a (dim_y, dim_x, 3) uint8 canvas as an RGB PNG, `rows` rows at a
+    time. Every row uses the Sub filter, which is cheap to apply to a whole
+    strip with numpy and suits the smooth gradients these images are made of.
+    """
+    dim_y, dim_x, _ = canvas.shape
+    compressor = zlib.compressobj(level)
+    with open(path, 'wb') as handle:
+        handle.write(b'\x89PNG\r\n\x1a\n')
+        handle.write(png_chunk(b'IHDR', struct.pack('>IIBBBBB', dim_x, dim_y,
+                                                    8, 2, 0, 0, 0)))
+        for top in range(0, dim_y, rows):
+            strip = np.asarray(canvas[top:top + rows]).reshape(-1, dim_x * 3)
+            filtered = np.empty((len(strip), dim_x * 3 + 1), dtype=np.uint8)
+            filtered[:, 0] = 1
+            filtered[:, 1:4] = strip[:, :3]
+            np.subtract(strip[:, 3:], strip[:, :-3], out=filtered[:, 4:])
+            data = compressor.compress(filtered.tobytes())
+            if data:
+                handle.write(png_chunk(b'IDAT', data))
+        handle.write(png_chunk(b'IDAT', compressor.flush()))
+        handle.write(png_chunk(b'IEND', b''))
@@ -0,0 +1,87 @@
+"""
+Set of canvas cells waiting to be colored
+"""
+import numpy as np
+
+
+class Frontier:
+    """
+    Frontier with O(1) add, remove, membership test and uniform random pick.
+
+    Cells are stored as flat indices `y * dim_x + x`, packed at the front of
+    `cells`. `positions` maps each cell back to its slot in `cells`, or -1
+    when the cell is not in the frontier, so removal is a swap with the last
+    cell instead of a search. Both are int32 unless the canvas has too many
+    cells for that.
+
+    With a disk.DiskStore as `store` both arrays live on disk, and a
+    frontier reopened from a store it was saved to has the cells it held.
+    Its `size` is taken from the caller when known, and counted a chunk at a
+    time otherwise.
+    """
+
+    def __init__(self, dim_x, dim_y, store=None, size=None):
+        self.dim_x = dim_x
+        n_cells = dim_x * dim_y
+        dtype = np.int32 if n_cells <= np.iinfo(np.int32).max else np.int64
+        if store is None:
+            self.cells = np.empty(n_cells, dtype=dtype)
+            self.positions = np.full(n_cells, -1, dtype=dtype)
+            self.size = 0
+            return
+
+        self.cells = store.array('cells', dtype, n_cells)
+        self.positions = store.array('positions', dtype, n_cells, fill=-1)
+        self.size = self.count() if size is None else size
+
+    def count(self, chunk=1 << 22):
+        """
+        Counts the cells in the frontier from `positions`, `chunk` entries
+        at a time so the count needs no canvas-sized temporary
+        """
+        total = 0
+        for start in range(0, len(self.positions), chunk):
+            total += int(np.count_nonzero(
+                self.positions[start:start + chunk] != -1))
+        return total
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, cell):
+        x, y = cell
+        return self.positions[y * self.dim_x + x] != -1
+
+    def add(self, x, y):
+        flat = y * self.dim_x + x
+        if self.positions[flat] != -1:
+            return
+        self.cells[self.size] = flat
+        self.positions[flat] = self.size
+        self.size += 1
+
+    def remove(self, x, y):
+        flat = y * self.dim_x + x
+        position = self.positions[flat]
+        if position == -1:
+            return
+        self.size -= 1
+        last = self.cells[self.size]
+        self.cells[position] = last
+        self.positions[last] = position
+        self.positions[flat] = -1
+
+    def add_many(self, flat_cells):
+        """Adds an array of flat cell indices, skipping ones already present"""
+        flat_cells = flat_cells[self.positions[flat_cells] == -1]
+        _, first = np.unique(flat_cells, return_index=True)
+        flat_cells = flat_cells[np.sort(first)]
+        stop = self.size + len(flat_cells)
+        self.cells[self.size:stop] = flat_cells
+        self.positions[flat_cells] = np.arange(self.size, stop)
+        self.size = stop
+
+    def choice(self, stream):
+        """Returns a uniformly random cell as `(x, y)`, drawn from `stream`"""
+        flat = int(self.cells[stream.below(self.size)])
+        return flat % self.dim_x, flat // self.dim_x
@@ -0,0 +1,99 @@
+"""
+The whole growth loop as one numba kernel.
+
+`grow` works only on plain arrays: the canvas and its occupancy map, the
+frontier's `cells`/`positions` arrays, the PaletteIndex buckets, the
+stencil offsets, a one-word xorshift64* random state and, when targets are
+neighbourhood averages, the NeighbourhoodSums arrays. Nothing crosses
+back into Python per pixel. ImageGeneration calls it in chunks so that it
+can still drive a progress bar and snapshots between chunks.
+"""
+import numpy as np
+from numba import njit
+
+from neighbourhood import add_color, average_color
+from palette_index import nearest_color, remove_color
+
+
+@njit
+def next_random(state):
+    """Advances a one-element uint64 xorshift64* state"""
+    x = state[0]
+    x ^= x >> np.uint64(12)
+    x ^= x << np.uint64(25)
+    x ^= x >> np.uint64(27)
+    state[0] = x
+    return x * np.uint64(0x2545F4914F6CDD1D)
+
+
+@njit
+def random_below(state, n):
+    return np.int64(next_random(state) % np.uint64(n))
+
+
+@njit
+def grow(canvas, filled,
+         cells, positions, size,
+         colors, owner, starts, counts, entries, slots, shift, per_axis,
+         offsets, state, order, sums, sum_counts, average):
+    """
+    Places up to `len(order)` pixels, writing the flat index of each one
+    into `order`. Returns how many were placed and the new frontier size.
+    With `average` each pixel matches the mean of its filled neighbours
+    from `sums` and `sum_counts`, which may be empty arrays otherwise.
+    """
+    dim_y, dim_x = filled.shape
+    neighbours = np.empty(offsets.shape[0], dtype=np.int64)
+    query = np.empty(3, dtype=np.int64)
+
+    for step in range(order.shape[0]):
+        if size == 0:
+            return step, size
+        cell = cells[random_below(state, size)]
+        x = cell % dim_x
+        y = cell // dim_x
+
+        if average:
+            average_color(sums, sum_counts, x, y, query)
+        else:
+            # Copy the color of a random filled neighbour
+            n_found = 0
+            for k in range(offsets.shape[0]):
+                i = x + offsets[k, 0]
+                j = y + offsets[k, 1]
+                if 0 <= i < dim_x and 0 <= j < dim_y and filled[j, i]:
+                    neighbours[n_found] = j * dim_x + i
+                    n_found += 1
+            neighbour = neighbours[random_below(state, n_found)]
+            for c in range(3):
+                query[c] = canvas[neighbour // dim_x, neighbour % dim_x, c]
+
+        index = nearest_color(query, colors, starts, counts, entries,
+                              shift, per_axis)
+        remove_color(index, owner, starts, counts, entries, slots)
+        for c in range(3):
+            canvas[y, x, c] = colors[index, c]
+        filled[y, x] = True
+        order[step] = cell
+        if average:
+            add_color(sums, sum_counts, filled, x, y, colors[index], offsets)
+
+        # Swap the cell out of the frontier...
+        size -= 1
+        last = cells[size]
+        cells[positions[cell]] = last
+        positions[last] = positions[cell]
+        positions[cell] = -1
+
+        # ...and bring in its empty neighbours
+        for k in range(offsets.shape[0]):
+            i = x + offsets[k, 0]
+            j = y + offsets[k, 1]
+            if 0 <= i < dim_x and 0 <= j < dim_y and not filled[j, i]:
+                flat = j * dim_x + i
+                if positions[flat] == -1:
+                    cells[size] = flat
+                    positions[flat] = size
+                    size += 1
+
+    return order.shape[0], size
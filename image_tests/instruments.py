@@ -0,0 +1,114 @@
+"""
+Opt-in instrumentation for the growth loop.
+
+A GrowthTrace handed to `ImageGeneration.fit_colors` gets two kinds of rows.
+Every `every`-th step of the stepwise engine is run through a timed copy of
+`propagate`, which records how long each phase took, the frontier and palette
+sizes and how far the placed color was from its target. Every chunk of work,
+on any engine, records its wall time and the same sizes. Without a trace
+fit_colors takes its usual loop, so turning instrumentation off costs
+nothing per step.
+"""
+import csv
+import json
+import os
+
+PHASES = ('select', 'neighbour', 'query', 'update')
+COLUMNS = ('kind', 'iteration', 'placed', 'frontier', 'remaining',
+           'distance', 'start_ns', 'elapsed_ns') \
+    + tuple(f'{phase}_ns' for phase in PHASES)
+
+
+class GrowthTrace:
+    """
+    Collects sampled step timings and per-chunk counters from a run.
+
+    Parameters
+    ----------
+    every : int, optional
+        Time one step in every `every`, by default 1024. 1 times them all
+    """
+
+    def __init__(self, every=1024):
+        self.every = every
+        self.rows = []
+
+    def is_sample(self, iteration):
+        return iteration % self.every == 0
+
+    def step(self, iteration, frontier, remaining, distance, start, phases):
+        """
+        Records one timed step that began at `start` on the
+        `time.perf_counter_ns` clock. `phases` holds the nanoseconds spent
+        on each of PHASES, in order.
+        """
+        row = {'kind': 'step', 'iteration': iteration, 'placed': 1,
+               'frontier': frontier, 'remaining': remaining,
+               'distance': distance, 'start_ns': start,
+               'elapsed_ns': sum(phases)}
+        for phase, elapsed in zip(PHASES, phases):
+            row[f'{phase}_ns'] = elapsed
+        self.rows.append(row)
+
+    def chunk(self, iteration, placed, frontier, remaining, start, elapsed):
+        """Records a chunk of `placed` pixels that ended at `iteration`"""
+        self.rows.append({'kind': 'chunk', 'iteration': iteration,
+                          'placed': placed, 'frontier': frontier,
+                          'remaining': remaining, 'start_ns': start,
+                          'elapsed_ns': elapsed})
+
+    def steps(self):
+        return [row for row in self.rows if row['kind'] == 'step']
+
+    def chunks(self):
+        return [row for row in self.rows if row['kind'] == 'chunk']
+
+    def summary(self):
+        """Mean nanoseconds per sampled step for each phase"""
+        steps = self.steps()
+        if not steps:
+            return {}
+        return {phase: sum(row[f'{phase}_ns'] for row in steps) / len(steps)
+                for phase in PHASES}
+
+    def to_csv(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', newline='') as handle:
+            writer = csv.DictWriter(handle, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(self.rows)
+
+    def to_chrome_trace(self, path):
+        """
+        Writes the rows in the Chrome trace event format, for
+        chrome://tracing or Perfetto. Chunks are slices on one track, with
+        the sampled steps they contain broken into phases on another, and
+        the frontier and palette sizes are counters.
+        """
+        origin = min((row['start_ns'] for row in self.rows), default=0)
+        events = []
+        for row in self.rows:
+            clock = (row['start_ns'] - origin) / 1000
+            if row['kind'] == 'step':
+                for phase in PHASES:
+                    duration = row[f'{phase}_ns'] / 1000
+                    events.append({'name': phase, 'cat': 'step', 'ph': 'X',
+                                   'ts': clock, 'dur': duration,
+                                   'pid': 0, 'tid': 1,
+                                   'args': {'iteration': row['iteration']}})
+                    clock += duration
+            else:
+                events.append({'name': 'chunk', 'cat': 'chunk', 'ph': 'X',
+                               'ts': clock, 'dur': row['elapsed_ns'] / 1000,
+                               'pid': 0, 'tid': 0,
+                               'args': {'iteration': row['iteration'],
+                                        'placed': row['placed']}})
+                clock += row['elapsed_ns'] / 1000
+            events.append({'name': 'sizes', 'ph': 'C', 'ts': clock,
+                           'pid': 0,
+                           'args': {'frontier': row['frontier'],
+                                    'remaining': row['remaining']}})
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as handle:
+            json.dump({'traceEvents': events,
+                       'displayTimeUnit': 'ms'}, handle)
@@ -0,0 +1,90 @@
+"""
+Running sums of the filled neighbours of every cell.
+
+With `target='average'` a pixel matches the mean color of its filled
+neighbours instead of the color of one of them. Rather than scanning the
+neighbourhood each time, placing a pixel adds its color to a per-cell sum
+and count for every cell in its stencil, which makes the mean of any cell
+one division away. Stencils are symmetric, so those are exactly the cells
+that have the new pixel in their own stencil.
+"""
+import numpy as np
+from numba import njit
+
+
+@njit
+def add_color(sums, counts, filled, x, y, color, offsets):
+    """
+    Adds `color`, just placed at (x, y), to the sums of the empty cells
+    around it. Filled cells are skipped, as nothing asks for their targets.
+    """
+    dim_y, dim_x = filled.shape
+    for k in range(offsets.shape[0]):
+        i = x + offsets[k, 0]
+        j = y + offsets[k, 1]
+        if 0 <= i < dim_x and 0 <= j < dim_y and not filled[j, i]:
+            for c in range(3):
+                sums[j, i, c] += color[c]
+            counts[j, i] += 1
+
+
+@njit
+def average_color(sums, counts, x, y, out):
+    """Writes the mean color around (x, y), rounded, into `out`"""
+    count = counts[y, x]
+    for c in range(3):
+        out[c] = (sums[y, x, c] + count // 2) // count
+
+
+@njit
+def fill_sums(sums, counts, canvas, filled, offsets):
+    dim_y, dim_x = filled.shape
+    for y in range(dim_y):
+        for x in range(dim_x):
+            if filled[y, x]:
+                add_color(sums, counts, filled, x, y, canvas[y, x], offsets)
+
+
+class NeighbourhoodSums:
+    """
+    Per-cell color sums and counts of filled neighbours.
+
+    `sums` is a (dim_y, dim_x, 3) and `counts` a (dim_y, dim_x) int32 array.
+    With a disk.DiskStore as `store` both live on disk next to the canvas.
+    """
+
+    def __init__(self, dim_x, dim_y, store=None):
+        if store is None:
+            self.sums = np.zeros((dim_y, dim_x, 3), dtype=np.int32)
+            self.counts = np.zeros((dim_y, dim_x), dtype=np.int32)
+        else:
+            self.sums = store.array('neighbour_sums', np.int32,
+                                    (dim_y, dim_x, 3), fill=0)
+            self.counts = store.array('neighbour_counts', np.int32,
+                                      (dim_y, dim_x), fill=0)
+
+    def add(self, x, y, color, filled, offsets):
+        add_color(self.sums, self.counts, filled, x, y, color, offsets)
+
+    def add_many(self, xs, ys, colors, filled):
+        """
+        Adds the colors of pixels that were placed together. `xs`, `ys` and
+        `colors` list one neighbour cell and the color it gets per entry, so
+        a cell can appear more than once.
+        """
+        empty = ~filled[ys, xs]
+        xs = xs[empty]
+        ys = ys[empty]
+        np.add.at(self.sums, (ys, xs), colors[empty])
+        np.add.at(self.counts, (ys, xs), 1)
+
+    def average(self, x, y):
+        """Mean color of the filled neighbours of (x, y), rounded"""
+        count = self.counts[y, x]
+        return (self.sums[y, x] + count // 2) // count
+
+    def rebuild(self, canvas, filled, offsets):
+        """Recomputes every sum from the canvas, e.g. after a restore"""
+        self.sums[...] = 0
+        self.counts[...] = 0
+        fill_sums(self.sums, self.counts, canvas, filled, offsets)
@@ -0,0 +1,230 @@
+"""
+Nearest-color lookups over a palette that shrinks as colors get used up.
+
+The palette is split into a cube of buckets (16 per channel by default).
+Each bucket owns a contiguous run of `entries`; the live colors of a bucket
+sit at the front of that run, so removing a color is a swap with the last
+live entry. A query walks outwards from the bucket of the query color one
+shell at a time and stops as soon as no unvisited bucket can beat the best
+match. Ties are broken on the palette index, which gives exactly the color
+the old linear scan over `color_list` returned.
+
+Removal is O(1) and the bookkeeping is three int32 arrays (`owner`,
+`entries` and `slots`), so with the uint8 palette itself an index costs
+15 bytes per color however large the palette gets.
+"""
+import numpy as np
+from numba import njit
+
+BUCKET_BITS = 4
+
+
+@njit
+def bucket_of(color, shift, per_axis):
+    return (((color[0] >> shift) * per_axis + (color[1] >> shift))
+            * per_axis + (color[2] >> shift))
+
+
+@njit
+def fill_owners(colors, shift, per_axis, owner):
+    for i in range(colors.shape[0]):
+        owner[i] = bucket_of(colors[i], shift, per_axis)
+
+
+def rgb_owners(colors, shift, per_axis):
+    owner = np.empty(colors.shape[0], dtype=np.int32)
+    fill_owners(colors, shift, per_axis, owner)
+    return owner
+
+
+@njit
+def fill_buckets(owner, starts, counts, entries, slots):
+    """
+    Counting sort of palette indices by the bucket that owns them, stable in
+    index order, into arrays the caller provides
+    """
+    counts[:] = 0
+    for i in range(owner.shape[0]):
+        counts[owner[i]] += 1
+
+    starts[0] = 0
+    for b in range(counts.shape[0]):
+        starts[b + 1] = starts[b] + counts[b]
+
+    fill = starts[:-1].copy()
+    for i in range(owner.shape[0]):
+        entries[fill[owner[i]]] = i
+        slots[i] = fill[owner[i]]
+        fill[owner[i]] += 1
+
+
+def build_buckets(owner, n_buckets):
+    """Returns `starts`, `counts`, `entries` and `slots` for `owner`"""
+    starts = np.empty(n_buckets + 1, dtype=np.int64)
+    counts = np.empty(n_buckets, dtype=np.int64)
+    entries = np.empty(owner.shape[0], dtype=np.int32)
+    slots = np.empty(owner.shape[0], dtype=np.int32)
+    fill_buckets(owner, starts, counts, entries, slots)
+    return starts, counts, entries, slots
+
+
+@njit
+def remove_color(index, owner, starts, counts, entries, slots):
+    """Swaps `index` behind the live entries of its bucket"""
+    bucket = owner[index]
+    last = starts[bucket] + counts[bucket] - 1
+    position = slots[index]
+    if position > last:
+        return False
+    moved = entries[last]
+    entries[position] = moved
+    slots[moved] = position
+    entries[last] = index
+    slots[index] = last
+    counts[bucket] -= 1
+    return True
+
+
+@njit
+def box_distance(value, bucket, cell):
+    # Distance along one axis from a value to the span of a bucket
+    low = bucket * cell
+    if value < low:
+        return low - value
+    high = low + cell - 1
+    if value > high:
+        return value - high
+    return 0
+
+
+@njit
+def nearest_color(color, colors, starts, counts, entries, shift, per_axis):
+    """
+    Returns the palette index of the live color closest to `color`, or -1
+    once the palette is empty.
+    """
+    cell = 1 << shift
+    q_0 = color[0] >> shift
+    q_1 = color[1] >> shift
+    q_2 = color[2] >> shift
+    best_distance = np.iinfo(np.int64).max
+    best_index = -1
+
+    for shell in range(per_axis):
+        if shell > 0 and best_index != -1:
+            # Nothing in this shell or beyond can be closer than this
+            bound = (shell - 1) * cell + 1
+            if bound * bound > best_distance:
+                break
+        for b_0 in range(max(0, q_0 - shell), min(per_axis, q_0 + shell + 1)):
+            d_0 = box_distance(color[0], b_0, cell)
+            on_face_0 = abs(b_0 - q_0) == shell
+            for b_1 in range(max(0, q_1 - shell),
+                             min(per_axis, q_1 + shell + 1)):
+                d_1 = box_distance(color[1], b_1, cell)
+                on_face = on_face_0 or abs(b_1 - q_1) == shell
+                # Interior of the shell was covered by earlier shells, so
+                # only the two caps along the last axis remain
+                step = 1 if on_face else 2 * shell
+                for b_2 in range(q_2 - shell, q_2 + shell + 1, max(step, 1)):
+                    if b_2 < 0 or b_2 >= per_axis:
+                        continue
+                    bucket = (b_0 * per_axis + b_1) * per_axis + b_2
+                    if counts[bucket] == 0:
+                        continue
+                    d_2 = box_distance(color[2], b_2, cell)
+                    if d_0 * d_0 + d_1 * d_1 + d_2 * d_2 > best_distance:
+                        continue
+                    start = starts[bucket]
+                    for k in range(start, start + counts[bucket]):
+                        i = entries[k]
+                        dr = colors[i, 0] - color[0]
+                        dg = colors[i, 1] - color[1]
+                        db = colors[i, 2] - color[2]
+                        distance = dr * dr + dg * dg + db * db
+                        if distance < best_distance or (
+                                distance == best_distance and i < best_index):
+                            best_distance = distance
+                            best_index = i
+    return best_index
+
+
+@njit
+def take_nearest_colors(queries, colors, owner, starts, counts, entries,
+                        slots, shift, per_axis):
+    """
+    Finds and removes the nearest color for each query in turn, so when two
+    queries want the same color the earlier one gets it and the later one
+    gets the next best
+    """
+    found = np.empty(queries.shape[0], dtype=np.int64)
+    for k in range(queries.shape[0]):
+        found[k] = nearest_color(queries[k], colors, starts, counts, entries,
+                                 shift, per_axis)
+        if found[k] != -1:
+            remove_color(found[k], owner, starts, counts, entries, slots)
+    return found
+
+
+class PaletteIndex:
+    """
+    Spatial index over the colors that have not been placed yet.
+
+    With a disk.DiskStore as `store` the bookkeeping arrays live on disk,
+    and an index reopened from a store it was saved to carries on with the
+    colors that were left.
+    """
+
+    def __init__(self, colors, bucket_bits=BUCKET_BITS, store=None):
+        # Only ever read, so a palette in shared memory is used in place
+        self.colors = np.asarray(colors)
+        self.shift = 8 - bucket_bits
+        self.per_axis = 1 << bucket_bits
+        if store is None:
+            self.owner = rgb_owners(self.colors, self.shift, self.per_axis)
+            self.starts, self.counts, self.entries, self.slots = \
+                build_buckets(self.owner, self.per_axis ** 3)
+            self.remaining = len(self.colors)
+            return
+
+        n_colors = len(self.colors)
+        n_buckets = self.per_axis ** 3
+        self.owner = store.array('owner', np.int32, n_colors)
+        self.starts = store.array('starts', np.int64, n_buckets + 1)
+        self.counts = store.array('counts', np.int64, n_buckets)
+        self.entries = store.array('entries', np.int32, n_colors)
+        self.slots = store.array('slots', np.int32, n_colors)
+        if not store.resuming:
+            fill_owners(self.colors, self.shift, self.per_axis, self.owner)
+            fill_buckets(self.owner, self.starts, self.counts, self.entries,
+                         self.slots)
+        self.remaining = int(np.sum(self.counts))
+
+    def __len__(self):
+        return self.remaining
+
+    def nearest(self, color):
+        """Index of the closest remaining color, -1 if none are left"""
+        return nearest_color(np.asarray(color, dtype=np.int64), self.colors,
+                             self.starts, self.counts, self.entries,
+                             self.shift, self.per_axis)
+
+    def remove(self, index):
+        if remove_color(index, self.owner, self.starts, self.counts,
+                        self.entries, self.slots):
+            self.remaining -= 1
+
+    def take_nearest(self, queries):
+        """
+        Removes and returns the indices of the closest remaining colors to
+        each row of `queries`, resolving them in order
+        """
+        found = take_nearest_colors(np.asarray(queries, dtype=np.int64),
+                                    self.colors, self.owner, self.starts,
+                                    self.counts, self.entries, self.slots,
+                                    self.shift, self.per_axis)
+        self.remaining -= int(np.count_nonzero(found != -1))
+        return found
+
+    def color(self, index):
+        return tuple(self.colors[index].tolist())
@@ -0,0 +1,283 @@
+"""
+Perceptual (CIEDE2000) nearest-color lookups.
+
+The palette is converted to CIELAB once, up front, and bucketed on a regular
+grid in Lab space using the same swap-remove bookkeeping as PaletteIndex.
+A query collects the few closest colors by plain Euclidean distance in Lab
+(CIE76), which the grid can bound, and only those candidates are ranked
+with the much more expensive CIEDE2000 formula.
+"""
+import math
+
+import numpy as np
+from numba import njit
+
+from palette_index import build_buckets, remove_color
+
+# sRGB channel value -> linear light, for every 8-bit value
+LINEAR = np.where(np.arange(256) / 255 <= 0.04045,
+                  np.arange(256) / 255 / 12.92,
+                  ((np.arange(256) / 255 + 0.055) / 1.055) ** 2.4)
+
+# Linear sRGB -> XYZ, divided through by the D65 white point
+TO_XYZ = np.array([[0.4124564, 0.3575761, 0.1804375],
+                   [0.2126729, 0.7151522, 0.0721750],
+                   [0.0193339, 0.1191920, 0.9503041]]) \
+    / np.array([[0.95047], [1.0], [1.08883]])
+
+
+@njit
+def lab_f(t):
+    if t > (6 / 29) ** 3:
+        return t ** (1 / 3)
+    return t / (3 * (6 / 29) ** 2) + 4 / 29
+
+
+@njit
+def srgb_to_lab(color):
+    r = LINEAR[color[0]]
+    g = LINEAR[color[1]]
+    b = LINEAR[color[2]]
+    f_x = lab_f(TO_XYZ[0, 0] * r + TO_XYZ[0, 1] * g + TO_XYZ[0, 2] * b)
+    f_y = lab_f(TO_XYZ[1, 0] * r + TO_XYZ[1, 1] * g + TO_XYZ[1, 2] * b)
+    f_z = lab_f(TO_XYZ[2, 0] * r + TO_XYZ[2, 1] * g + TO_XYZ[2, 2] * b)
+    return np.array([116 * f_y - 16, 500 * (f_x - f_y), 200 * (f_y - f_z)])
+
+
+@njit
+def palette_to_lab(colors):
+    lab = np.empty((colors.shape[0], 3))
+    for i in range(colors.shape[0]):
+        lab[i] = srgb_to_lab(colors[i])
+    return lab
+
+
+@njit
+def ciede2000(lab_1, lab_2):
+    """CIEDE2000 color difference, after Sharma, Wu and Dalal (2005)"""
+    l_1, a_1, b_1 = lab_1[0], lab_1[1], lab_1[2]
+    l_2, a_2, b_2 = lab_2[0], lab_2[1], lab_2[2]
+
+    c_bar = (math.hypot(a_1, b_1) + math.hypot(a_2, b_2)) / 2
+    g = 0.5 * (1 - math.sqrt(c_bar ** 7 / (c_bar ** 7 + 25 ** 7)))
+    a_1 *= 1 + g
+    a_2 *= 1 + g
+    c_1 = math.hypot(a_1, b_1)
+    c_2 = math.hypot(a_2, b_2)
+    h_1 = math.degrees(math.atan2(b_1, a_1)) % 360 if c_1 else 0.0
+    h_2 = math.degrees(math.atan2(b_2, a_2)) % 360 if c_2 else 0.0
+
+    delta_l = l_2 - l_1
+    delta_c = c_2 - c_1
+    delta_h = 0.0
+    if c_1 * c_2:
+        delta_h = h_2 - h_1
+        if delta_h > 180:
+            delta_h -= 360
+        elif delta_h < -180:
+            delta_h += 360
+    delta_h = 2 * math.sqrt(c_1 * c_2) * math.sin(math.radians(delta_h) / 2)
+
+    l_bar = (l_1 + l_2) / 2
+    c_bar = (c_1 + c_2) / 2
+    if not c_1 * c_2:
+        h_bar = h_1 + h_2
+    elif abs(h_1 - h_2) <= 180:
+        h_bar = (h_1 + h_2) / 2
+    elif h_1 + h_2 < 360:
+        h_bar = (h_1 + h_2 + 360) / 2
+    else:
+        h_bar = (h_1 + h_2 - 360) / 2
+
+    t = (1 - 0.17 * math.cos(math.radians(h_bar - 30))
+         + 0.24 * math.cos(math.radians(2 * h_bar))
+         + 0.32 * math.cos(math.radians(3 * h_bar + 6))
+         - 0.20 * math.cos(math.radians(4 * h_bar - 63)))
+    delta_theta = 30 * math.exp(-((h_bar - 275) / 25) ** 2)
+    r_c = 2 * math.sqrt(c_bar ** 7 / (c_bar ** 7 + 25 ** 7))
+    s_l = 1 + 0.015 * (l_bar - 50) ** 2 / math.sqrt(20 + (l_bar - 50) ** 2)
+    s_c = 1 + 0.045 * c_bar
+    s_h = 1 + 0.015 * c_bar * t
+    r_t = -math.sin(math.radians(2 * delta_theta)) * r_c
+
+    return math.sqrt((delta_l / s_l) ** 2 + (delta_c / s_c) ** 2
+                     + (delta_h / s_h) ** 2
+                     + r_t * (delta_c / s_c) * (delta_h / s_h))
+
+
+@njit
+def lab_owners(lab, origin, cell, dims):
+    owner = np.empty(lab.shape[0], dtype=np.int32)
+    for i in range(lab.shape[0]):
+        b_0 = min(int((lab[i, 0] - origin[0]) / cell), dims[0] - 1)
+        b_1 = min(int((lab[i, 1] - origin[1]) / cell), dims[1] - 1)
+        b_2 = min(int((lab[i, 2] - origin[2]) / cell), dims[2] - 1)
+        owner[i] = (b_0 * dims[1] + b_1) * dims[2] + b_2
+    return owner
+
+
+@njit
+def span_distance(value, low, high):
+    if value < low:
+        return low - value
+    if value > high:
+        return value - high
+    return 0.0
+
+
+@njit
+def nearest_lab(query, lab, starts, counts, entries, origin, cell, dims,
+                n_candidates):
+    """
+    Returns the palette index with the smallest CIEDE2000 difference to
+    `query` among its `n_candidates` nearest colors in Lab, or -1 once the
+    palette is empty.
+    """
+    candidate_distance = np.full(n_candidates, np.inf)
+    candidate_index = np.full(n_candidates, -1, dtype=np.int64)
+    found = 0
+
+    q = np.empty(3, dtype=np.int64)
+    for axis in range(3):
+        q[axis] = min(max(int((query[axis] - origin[axis]) // cell), 0),
+                      dims[axis] - 1)
+
+    for shell in range(max(dims[0], dims[1], dims[2])):
+        if shell > 0 and found == n_candidates:
+            bound = (shell - 1) * cell
+            if bound * bound > candidate_distance[-1]:
+                break
+        for b_0 in range(max(0, q[0] - shell), min(dims[0], q[0] + shell + 1)):
+            low_0 = origin[0] + b_0 * cell
+            d_0 = span_distance(query[0], low_0, low_0 + cell)
+            on_face_0 = abs(b_0 - q[0]) == shell
+            for b_1 in range(max(0, q[1] - shell),
+                             min(dims[1], q[1] + shell + 1)):
+                low_1 = origin[1] + b_1 * cell
+                d_1 = span_distance(query[1], low_1, low_1 + cell)
+                on_face = on_face_0 or abs(b_1 - q[1]) == shell
+                step = 1 if on_face else 2 * shell
+                for b_2 in range(q[2] - shell, q[2] + shell + 1, max(step, 1)):
+                    if b_2 < 0 or b_2 >= dims[2]:
+                        continue
+                    bucket = (b_0 * dims[1] + b_1) * dims[2] + b_2
+                    if counts[bucket] == 0:
+                        continue
+                    low_2 = origin[2] + b_2 * cell
+                    d_2 = span_distance(query[2], low_2, low_2 + cell)
+                    if found == n_candidates and \
+                            d_0 ** 2 + d_1 ** 2 + d_2 ** 2 \
+                            > candidate_distance[-1]:
+                        continue
+                    start = starts[bucket]
+                    for k in range(start, start + counts[bucket]):
+                        i = entries[k]
+                        distance = ((lab[i, 0] - query[0]) ** 2
+                                    + (lab[i, 1] - query[1]) ** 2
+                                    + (lab[i, 2] - query[2]) ** 2)
+                        if found < n_candidates:
+                            position = found
+                            found += 1
+                        elif distance < candidate_distance[-1] or (
+                                distance == candidate_distance[-1]
+                                and i < candidate_index[-1]):
+                            position = n_candidates - 1
+                        else:
+                            continue
+                        # Insertion sort into the candidate list
+                        while position > 0 and (
+                                distance < candidate_distance[position - 1]
+                                or (distance
+                                    == candidate_distance[position - 1]
+                                    and i < candidate_index[position - 1])):
+                            candidate_distance[position] = \
+                                candidate_distance[position - 1]
+                            candidate_index[position] = \
+                                candidate_index[position - 1]
+                            position -= 1
+                        candidate_distance[position] = distance
+                        candidate_index[position] = i
+
+    best_index = -1
+    best_difference = np.inf
+    for k in range(found):
+        i = candidate_index[k]
+        difference = ciede2000(query, lab[i])
+        if difference < best_difference or (
+                difference == best_difference and i < best_index):
+            best_difference = difference
+            best_index = i
+    return best_index
+
+
+@njit
+def take_nearest_lab(queries, lab, owner, starts, counts, entries, slots,
+                     origin, cell, dims, n_candidates):
+    """Lab counterpart of palette_index.take_nearest_colors"""
+    found = np.empty(queries.shape[0], dtype=np.int64)
+    for k in range(queries.shape[0]):
+        found[k] = nearest_lab(srgb_to_lab(queries[k]), lab, starts, counts,
+                               entries, origin, cell, dims, n_candidates)
+        if found[k] != -1:
+            remove_color(found[k], owner, starts, counts, entries, slots)
+    return found
+
+
+class LabPaletteIndex:
+    """
+    Drop-in replacement for PaletteIndex that matches colors by CIEDE2000.
+
+    Parameters
+    ----------
+    colors : array
+        (N, 3) palette of 8-bit sRGB colors
+    cell : float, optional
+        Edge length of a grid bucket in Lab units, by default 8.0
+    candidates : int, optional
+        How many of the nearest colors by CIE76 get ranked with CIEDE2000,
+        by default 8
+    """
+
+    def __init__(self, colors, cell=8.0, candidates=8):
+        self.colors = np.asarray(colors)
+        self.lab = palette_to_lab(self.colors)
+        self.cell = float(cell)
+        self.candidates = candidates
+        self.origin = self.lab.min(axis=0)
+        self.dims = ((self.lab.max(axis=0) - self.origin) // self.cell
+                     ).astype(np.int64) + 1
+        self.owner = lab_owners(self.lab, self.origin, self.cell, self.dims)
+        self.starts, self.counts, self.entries, self.slots = build_buckets(
+            self.owner, int(np.prod(self.dims)))
+        self.remaining = len(self.colors)
+
+    def __len__(self):
+        return self.remaining
+
+    def nearest(self, color):
+        """Index of the closest remaining color, -1 if none are left"""
+        query = srgb_to_lab(np.asarray(color, dtype=np.int64))
+        return nearest_lab(query, self.lab, self.starts, self.counts,
+                           self.entries, self.origin, self.cell, self.dims,
+                           self.candidates)
+
+    def remove(self, index):
+        if remove_color(index, self.owner, self.starts, self.counts,
+                        self.entries, self.slots):
+            self.remaining -= 1
+
+    def take_nearest(self, queries):
+        """
+        Removes and returns the indices of the closest remaining colors to
+        each row of `queries`, resolving them in order
+        """
+        found = take_nearest_lab(np.asarray(queries, dtype=np.int64),
+                                 self.lab, self.owner, self.starts,
+                                 self.counts, self.entries, self.slots,
+                                 self.origin, self.cell, self.dims,
+                                 self.candidates)
+        self.remaining -= int(np.count_nonzero(found != -1))
+        return found
+
+    def color(self, index):
+        return tuple(self.colors[index].tolist())
@@ -0,0 +1,94 @@
+"""
+Per-instance random numbers for the growth loop.
+
+Each ImageGeneration owns a RandomStream built on a numpy Generator instead
+of sharing the global `random` module, so instances in one process do not
+disturb each other. The stream pulls raw 64-bit words from the bit generator
+a block at a time and turns each one into a bounded integer with a multiply
+and a shift, which is far cheaper per draw than a call into `random`.
+Streams come from a SeedSequence, and `spawn` hands out children that are
+reproducible and guaranteed not to overlap, e.g. one per worker process.
+"""
+import numpy as np
+
+
+def children(seed_sequence, n):
+    """
+    The first `n` children `seed_sequence.spawn` would give, without
+    advancing its spawn counter, so the same seed always yields the same
+    children
+    """
+    return [np.random.SeedSequence(seed_sequence.entropy,
+                                   spawn_key=seed_sequence.spawn_key + (i,),
+                                   pool_size=seed_sequence.pool_size)
+            for i in range(n)]
+
+
+def seed_to_json(seed_sequence):
+    return [seed_sequence.entropy, list(seed_sequence.spawn_key)]
+
+
+def seed_from_json(data):
+    entropy, spawn_key = data
+    return np.random.SeedSequence(entropy, spawn_key=tuple(spawn_key))
+
+
+class RandomStream:
+    """
+    Block-buffered source of uniform integers.
+
+    Parameters
+    ----------
+    seed : int, SeedSequence or None, optional
+        Seed for the stream. None draws fresh entropy from the OS
+    block : int, optional
+        How many 64-bit words to draw from the bit generator at once, by
+        default 4096
+    """
+
+    def __init__(self, seed=None, block=4096):
+        if isinstance(seed, np.random.SeedSequence):
+            self.seed_sequence = seed
+        else:
+            self.seed_sequence = np.random.SeedSequence(seed)
+        self.generator = np.random.default_rng(self.seed_sequence)
+        self.block = block
+        self.words = []
+        self.position = 0
+
+    def spawn(self, n):
+        """Returns `n` independent child streams"""
+        return [RandomStream(child, self.block)
+                for child in self.seed_sequence.spawn(n)]
+
+    def raw(self):
+        """Returns the next 64-bit word as a Python int"""
+        if self.position == len(self.words):
+            self.words = self.generator.bit_generator.random_raw(
+                self.block).tolist()
+            self.position = 0
+        word = self.words[self.position]
+        self.position += 1
+        return word
+
+    def below(self, n):
+        """Returns a uniform integer in [0, n)"""
+        # Lemire's multiply-shift; the bias is at most n / 2**64
+        return self.raw() * n >> 64
+
+    def choice(self, sequence):
+        return sequence[self.below(len(sequence))]
+
+    def getstate(self):
+        """
+        Returns the bit generator state and the words drawn but not used
+        yet, which together pin down every later draw
+        """
+        return (self.generator.bit_generator.state,
+                np.array(self.words[self.position:], dtype=np.uint64))
+
+    def setstate(self, state):
+        bit_generator_state, words = state
+        self.generator.bit_generator.state = bit_generator_state
+        self.words = np.asarray(words, dtype=np.uint64).tolist()
+        self.position = 0
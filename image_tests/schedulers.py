@@ -0,0 +1,297 @@
+"""
+Priority-driven growth orders.
+
+By default every step colors a uniformly random frontier cell. A Scheduler
+instead keeps the frontier as a binary min-heap and always colors the cell
+with the smallest key:
+
+- 'bfs' keys cells by when they joined the frontier, so the image grows out
+  of the seeds in ripples
+- 'error' keys them by how far their target color is from the closest color
+  left in the palette, so cells that can be matched well go first. A cell's
+  target is the color of the pixel that brought it into the frontier, and
+  its key is the error when it joined. Colors taken since then can make the
+  real error larger, but re-keying stale cells costs a palette search each
+  and made runs several times slower for a rougher image, so keys are
+  never updated
+- 'distance' keys them by their squared distance to the closest seed, which
+  grows a round patch out of each seed
+
+Ties go to the cell that joined the frontier first. The heap lives in the
+Frontier's own `cells` and `positions` arrays, so its length and membership
+test keep working, and pushes and pops are O(log n). The loop is a
+numba kernel like growth_kernel.grow, and 'bfs' and 'distance' pick their
+target the same way it does.
+"""
+import numpy as np
+from numba import njit
+
+from growth_kernel import random_below
+from neighbourhood import add_color, average_color
+from palette_index import nearest_color, remove_color
+
+SCHEDULERS = ('random', 'bfs', 'error', 'distance')
+BFS, ERROR, DISTANCE = 1, 2, 3
+
+
+@njit
+def before(keys, ticks, a, b):
+    """Whether cell `a` comes off the heap before cell `b`"""
+    return keys[a] < keys[b] or (keys[a] == keys[b] and ticks[a] < ticks[b])
+
+
+@njit
+def sift_up(cells, positions, keys, ticks, slot):
+    cell = cells[slot]
+    while slot > 0:
+        parent = (slot - 1) >> 1
+        above = cells[parent]
+        if not before(keys, ticks, cell, above):
+            break
+        cells[slot] = above
+        positions[above] = slot
+        slot = parent
+    cells[slot] = cell
+    positions[cell] = slot
+
+
+@njit
+def sift_down(cells, positions, keys, ticks, slot, size):
+    cell = cells[slot]
+    while True:
+        child = 2 * slot + 1
+        if child >= size:
+            break
+        if child + 1 < size and before(keys, ticks, cells[child + 1],
+                                       cells[child]):
+            child += 1
+        below = cells[child]
+        if not before(keys, ticks, below, cell):
+            break
+        cells[slot] = below
+        positions[below] = slot
+        slot = child
+    cells[slot] = cell
+    positions[cell] = slot
+
+
+@njit
+def push(cells, positions, keys, ticks, size, cell):
+    """Adds `cell`, whose key and tick are already set. Returns the new size"""
+    cells[size] = cell
+    sift_up(cells, positions, keys, ticks, size)
+    return size + 1
+
+
+@njit
+def pop(cells, positions, keys, ticks, size):
+    """Removes the first cell. Returns the new size"""
+    positions[cells[0]] = -1
+    size -= 1
+    if size > 0:
+        cells[0] = cells[size]
+        sift_down(cells, positions, keys, ticks, 0, size)
+    return size
+
+
+@njit
+def match_error(canvas, source, colors, starts, counts, entries, shift,
+                per_axis, query):
+    """
+    Returns the live palette color closest to the color at flat cell
+    `source`, and its squared distance
+    """
+    dim_x = canvas.shape[1]
+    for c in range(3):
+        query[c] = canvas[source // dim_x, source % dim_x, c]
+    index = nearest_color(query, colors, starts, counts, entries,
+                          shift, per_axis)
+    error = 0
+    for c in range(3):
+        delta = np.int64(colors[index, c]) - query[c]
+        error += delta * delta
+    return index, error
+
+
+@njit
+def seed_distance(cell, dim_x, origins):
+    """Squared distance from flat cell `cell` to the closest of `origins`"""
+    x = cell % dim_x
+    y = cell // dim_x
+    best = np.iinfo(np.int64).max
+    for k in range(origins.shape[0]):
+        d_x = x - origins[k] % dim_x
+        d_y = y - origins[k] // dim_x
+        best = min(best, d_x * d_x + d_y * d_y)
+    return best
+
+
+@njit
+def build_heap(canvas, filled, cells, positions, size, keys, ticks, sources,
+               colors, starts, counts, entries, shift, per_axis,
+               offsets, origins, mode):
+    """
+    Keys the cells already in the frontier, in the order they were added,
+    and arranges them into a heap. Returns the next tick.
+    """
+    dim_y, dim_x = filled.shape
+    query = np.empty(3, dtype=np.int64)
+    for slot in range(size):
+        cell = cells[slot]
+        x = cell % dim_x
+        y = cell // dim_x
+        # The first filled neighbour stands in for the pixel that brought
+        # the cell in
+        for k in range(offsets.shape[0]):
+            i = x + offsets[k, 0]
+            j = y + offsets[k, 1]
+            if 0 <= i < dim_x and 0 <= j < dim_y and filled[j, i]:
+                sources[cell] = j * dim_x + i
+                break
+        ticks[cell] = slot
+        if mode == ERROR:
+            keys[cell] = match_error(canvas, sources[cell], colors, starts,
+                                     counts, entries, shift, per_axis,
+                                     query)[1]
+        elif mode == DISTANCE:
+            keys[cell] = seed_distance(cell, dim_x, origins)
+        else:
+            keys[cell] = 0
+    for slot in range(size // 2 - 1, -1, -1):
+        sift_down(cells, positions, keys, ticks, slot, size)
+    return size
+
+
+@njit
+def grow_scheduled(canvas, filled,
+                   cells, positions, size, keys, ticks, sources, tick,
+                   colors, owner, starts, counts, entries, slots, shift,
+                   per_axis, offsets, origins, mode, state, order,
+                   sums, sum_counts, average):
+    """
+    Places up to `len(order)` pixels in heap order, writing the flat index
+    of each one into `order`. Returns how many were placed, the new frontier
+    size and the next tick.
+    """
+    dim_y, dim_x = filled.shape
+    neighbours = np.empty(offsets.shape[0], dtype=np.int64)
+    query = np.empty(3, dtype=np.int64)
+
+    step = 0
+    while step < order.shape[0] and size > 0:
+        cell = cells[0]
+        if mode == ERROR:
+            index = match_error(canvas, sources[cell], colors, starts,
+                                counts, entries, shift, per_axis, query)[0]
+        elif average:
+            average_color(sums, sum_counts, cell % dim_x, cell // dim_x,
+                          query)
+            index = nearest_color(query, colors, starts, counts, entries,
+                                  shift, per_axis)
+        else:
+            x = cell % dim_x
+            y = cell // dim_x
+            n_found = 0
+            for k in range(offsets.shape[0]):
+                i = x + offsets[k, 0]
+                j = y + offsets[k, 1]
+                if 0 <= i < dim_x and 0 <= j < dim_y and filled[j, i]:
+                    neighbours[n_found] = j * dim_x + i
+                    n_found += 1
+            neighbour = neighbours[random_below(state, n_found)]
+            for c in range(3):
+                query[c] = canvas[neighbour // dim_x, neighbour % dim_x, c]
+            index = nearest_color(query, colors, starts, counts, entries,
+                                  shift, per_axis)
+
+        x = cell % dim_x
+        y = cell // dim_x
+        remove_color(index, owner, starts, counts, entries, slots)
+        for c in range(3):
+            canvas[y, x, c] = colors[index, c]
+        filled[y, x] = True
+        order[step] = cell
+        step += 1
+        if average:
+            add_color(sums, sum_counts, filled, x, y, colors[index], offsets)
+        size = pop(cells, positions, keys, ticks, size)
+
+        # Every cell this pixel brings in shares its target, and so its key
+        key = -1
+        for k in range(offsets.shape[0]):
+            i = x + offsets[k, 0]
+            j = y + offsets[k, 1]
+            if 0 <= i < dim_x and 0 <= j < dim_y and not filled[j, i]:
+                flat = j * dim_x + i
+                if positions[flat] != -1:
+                    continue
+                sources[flat] = cell
+                ticks[flat] = tick
+                tick += 1
+                if mode == ERROR:
+                    if key == -1:
+                        key = match_error(canvas, cell, colors, starts,
+                                          counts, entries, shift, per_axis,
+                                          query)[1]
+                    keys[flat] = key
+                elif mode == DISTANCE:
+                    keys[flat] = seed_distance(flat, dim_x, origins)
+                else:
+                    keys[flat] = 0
+                size = push(cells, positions, keys, ticks, size, flat)
+
+    return step, size, tick
+
+
+class Scheduler:
+    """
+    Heap keys and bookkeeping for a priority-driven frontier.
+
+    Parameters
+    ----------
+    name : str
+        One of SCHEDULERS other than 'random'
+    dim_x, dim_y : int
+        Canvas size
+    """
+
+    def __init__(self, name, dim_x, dim_y):
+        if name not in SCHEDULERS[1:]:
+            raise ValueError(f'Unknown scheduler {name!r}')
+        self.name = name
+        self.mode = SCHEDULERS.index(name)
+        n_cells = dim_x * dim_y
+        dtype = np.int32 if n_cells <= np.iinfo(np.int32).max else np.int64
+        # Indexed by cell: its key, when it joined the frontier, and the
+        # cell whose color is its target
+        self.keys = np.zeros(n_cells, dtype=np.int64)
+        self.ticks = np.zeros(n_cells, dtype=np.int64)
+        self.sources = np.full(n_cells, -1, dtype=dtype)
+        self.tick = 0
+        # Flat indices of the seeds, set when the heap is first built
+        self.origins = None
+
+    def grow(self, canvas, filled, frontier, index, offsets, state, order,
+             sums, sum_counts, average):
+        """
+        Places up to `len(order)` pixels, writing their flat indices into
+        `order`, and returns how many were placed. The last three arguments
+        are as for growth_kernel.grow.
+        """
+        if self.origins is None:
+            # Only the seeds are filled before the first pixel is placed
+            self.origins = np.flatnonzero(filled)
+            self.tick = build_heap(
+                canvas, filled, frontier.cells, frontier.positions,
+                frontier.size, self.keys, self.ticks, self.sources,
+                index.colors, index.starts, index.counts, index.entries,
+                index.shift, index.per_axis, offsets, self.origins,
+                self.mode)
+        placed, frontier.size, self.tick = grow_scheduled(
+            canvas, filled, frontier.cells, frontier.positions, frontier.size,
+            self.keys, self.ticks, self.sources, self.tick,
+            index.colors, index.owner, index.starts, index.counts,
+            index.entries, index.slots, index.shift, index.per_axis,
+            offsets, self.origins, self.mode, state, order,
+            sums, sum_counts, average)
+        return placed
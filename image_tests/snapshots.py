@@ -0,0 +1,299 @@
+"""
+Growth snapshots written from a background thread.
+
+The growth loop only hands over the pixels placed since the previous frame.
+The writer thread applies them to its own persistent copy of the canvas and
+encodes the frame, so taking a snapshot costs the growth loop time in
+proportion to what changed rather than to the size of the canvas. Frames of
+an animation are encoded into the file as they arrive, so no more than the
+current frame is ever held in memory.
+"""
+import math
+import os
+import queue
+import struct
+import threading
+import zlib
+
+import numpy as np
+from PIL import GifImagePlugin, Image
+
+from disk import png_chunk
+from numba_funcs import is_perfect_square
+
+
+class SnapshotWriter:
+    """
+    Streams frames of a growing image to disk.
+
+    Parameters
+    ----------
+    dim_x, dim_y : int
+        Size of the canvas being grown
+    pattern : str, optional
+        Format string for an image sequence, filled in with `frame` and
+        `iteration`, e.g. `'frames/{frame:05d}.png'`. By default None
+    animation : str, optional
+        Path of an animated GIF or PNG (APNG), chosen by its extension and
+        written frame by frame. By default None
+    every : int, optional
+        Take a frame every `every` placed pixels. If `None`, frames are taken
+        on perfect-square iterations, which keeps early growth visible
+        without flooding the output later on. By default None
+    duration : int, optional
+        Milliseconds per frame in the animation, by default 40
+    append : bool, optional
+        Carry on an animation already at `animation`, such as one a resumed
+        run wrote before it was interrupted, instead of starting it over.
+        Frame numbers for `pattern` carry on from its frame count. By
+        default False
+    """
+
+    def __init__(self, dim_x, dim_y, pattern=None, animation=None,
+                 every=None, duration=40, append=False):
+        self.pattern = pattern
+        self.animation = animation
+        self.every = every
+        self.duration = duration
+
+        self.buffer = np.zeros((dim_y, dim_x, 3), dtype=np.uint8)
+        self.stream = None
+        if animation is not None:
+            self.stream = open_animation(animation, dim_x, dim_y, duration,
+                                         append)
+        self.frame = 0 if self.stream is None else self.stream.frames
+        self.xs = []
+        self.ys = []
+        # What stopped the writer thread, raised again in the growth loop
+        self.error = None
+
+        # Each pixel is sent once and frames are encoded as they arrive, so
+        # the queue never holds more than one canvas worth of data and can
+        # be left unbounded
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def is_frame(self, iteration):
+        if self.every is None:
+            return is_perfect_square(iteration)
+        return iteration % self.every == 0
+
+    def next_frame(self, iteration):
+        """Returns the first iteration from `iteration` on that is a frame"""
+        if self.every is None:
+            root = math.isqrt(iteration)
+            if root * root < iteration:
+                root += 1
+            return root * root
+        return -(-iteration // self.every) * self.every
+
+    def start(self, canvas, filled):
+        """Sends the pixels that were placed before growth began"""
+        ys, xs = np.nonzero(filled)
+        self.queue.put((xs, ys, canvas[ys, xs], -1))
+
+    def update(self, canvas, x, y, iteration):
+        """Records one placed pixel and emits a frame when one is due"""
+        self.xs.append(x)
+        self.ys.append(y)
+        if self.is_frame(iteration):
+            self.emit(canvas, iteration)
+
+    def extend(self, canvas, xs, ys, iteration):
+        """
+        Records a run of placed pixels ending at `iteration` and emits a
+        frame if that iteration is due one
+        """
+        self.xs.extend(xs.tolist())
+        self.ys.extend(ys.tolist())
+        if self.is_frame(iteration):
+            self.emit(canvas, iteration)
+
+    def emit(self, canvas, iteration):
+        if self.error is not None:
+            raise self.error
+        self.queue.put((*self.pending(canvas), iteration))
+
+    def close(self, canvas, iteration):
+        """
+        Emits the final frame and waits for everything to be written. Raises
+        whatever stopped the writer thread, if anything did.
+        """
+        if self.error is None:
+            self.queue.put((*self.pending(canvas), iteration))
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def pending(self, canvas):
+        """Takes the pixels recorded since the last frame, with their colors"""
+        xs = np.array(self.xs, dtype=np.int64)
+        ys = np.array(self.ys, dtype=np.int64)
+        self.xs = []
+        self.ys = []
+        return xs, ys, canvas[ys, xs]
+
+    def run(self):
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                xs, ys, colors, iteration = item
+                self.buffer[ys, xs] = colors
+                if iteration < 0:
+                    continue
+                self.write(iteration)
+        except Exception as error:  # pylint: disable=broad-except
+            self.error = error
+        finally:
+            if self.stream is not None:
+                self.stream.close()
+
+    def write(self, iteration):
+        if self.pattern is not None:
+            path = self.pattern.format(frame=self.frame, iteration=iteration)
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            Image.fromarray(self.buffer).save(path)
+        if self.stream is not None:
+            self.stream.append(self.buffer)
+        self.frame += 1
+
+
+def open_animation(path, dim_x, dim_y, duration, append=False):
+    """
+    Opens an animation stream for `path` by its extension: GifStream for
+    '.gif', ApngStream for '.png' and '.apng'. With `append` an existing
+    file is carried on rather than replaced.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    append = append and os.path.exists(path)
+    if extension == '.gif':
+        return GifStream(path, duration, append)
+    if extension in ('.png', '.apng'):
+        return ApngStream(path, dim_x, dim_y, duration, append)
+    raise ValueError(f'Cannot stream an animation to {path!r}, '
+                     f'use .gif or .png')
+
+
+class GifStream:
+    """
+    Animated GIF written one frame at a time. Each frame is quantized to its
+    own palette, which goes in as a local color table. An appended file
+    loses its trailer and takes new frames after its last one.
+    """
+
+    def __init__(self, path, duration, append=False):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.duration = duration
+        self.started = False
+        self.frames = 0
+        if append:
+            with Image.open(path) as image:
+                self.frames = image.n_frames
+            self.handle = open(path, 'r+b')
+            self.handle.seek(-1, os.SEEK_END)
+            if self.handle.read(1) != b';':
+                raise ValueError(f'{path} is not a finished GIF')
+            self.handle.seek(-1, os.SEEK_END)
+            self.handle.truncate()
+            self.started = True
+        else:
+            self.handle = open(path, 'wb')
+
+    def append(self, pixels):
+        frame = Image.fromarray(pixels).quantize(256)
+        if not self.started:
+            header, _ = GifImagePlugin.getheader(frame, info={'loop': 0})
+            self.handle.write(b''.join(header))
+            self.started = True
+        self.handle.write(b''.join(GifImagePlugin.getdata(
+            frame, duration=self.duration, include_color_table=True)))
+        self.frames += 1
+
+    def close(self):
+        if self.started:
+            # Trailer
+            self.handle.write(b';')
+        self.handle.close()
+
+
+class ApngStream:
+    """
+    Animated PNG written one frame at a time as full RGB frames. The frame
+    count in the animation control chunk is filled in on close. An appended
+    file loses its end chunk and takes new frames after its last one.
+    """
+
+    def __init__(self, path, dim_x, dim_y, duration, append=False):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.dim_x = dim_x
+        self.dim_y = dim_y
+        self.duration = duration
+        self.frames = 0
+        self.sequence = 0
+        # Each row is prefixed by its filter type, 0 for none
+        self.rows = np.zeros((dim_y, dim_x * 3 + 1), dtype=np.uint8)
+        if append:
+            self.handle = open(path, 'r+b')
+            self.reopen(path)
+            return
+
+        self.handle = open(path, 'wb')
+        self.handle.write(b'\x89PNG\r\n\x1a\n')
+        self.handle.write(png_chunk(b'IHDR', struct.pack(
+            '>IIBBBBB', dim_x, dim_y, 8, 2, 0, 0, 0)))
+        self.control = self.handle.tell()
+        self.handle.write(png_chunk(b'acTL', struct.pack('>II', 0, 0)))
+
+    def append(self, pixels):
+        self.handle.write(png_chunk(b'fcTL', struct.pack(
+            '>IIIIIHHBB', self.sequence, self.dim_x, self.dim_y, 0, 0,
+            self.duration, 1000, 0, 0)))
+        self.sequence += 1
+        self.rows[:, 1:] = pixels.reshape(self.dim_y, -1)
+        data = zlib.compress(self.rows.tobytes())
+        if self.frames == 0:
+            # The first frame doubles as the still image
+            self.handle.write(png_chunk(b'IDAT', data))
+        else:
+            self.handle.write(png_chunk(
+                b'fdAT', struct.pack('>I', self.sequence) + data))
+            self.sequence += 1
+        self.frames += 1
+
+    def reopen(self, path):
+        """
+        Reads the frame count and next sequence number back from the chunks
+        of a finished file, and drops its end chunk
+        """
+        self.handle.seek(8)
+        while True:
+            start = self.handle.tell()
+            header = self.handle.read(8)
+            if len(header) < 8:
+                raise ValueError(f'{path} is not a finished APNG')
+            length, kind = struct.unpack('>I4s', header)
+            data = self.handle.read(length)
+            self.handle.seek(4, os.SEEK_CUR)
+            if kind == b'IHDR' and \
+                    struct.unpack('>II', data[:8]) != (self.dim_x, self.dim_y):
+                raise ValueError(f'{path} is not {self.dim_x}x{self.dim_y}')
+            if kind == b'acTL':
+                self.control = start
+                self.frames = struct.unpack('>I', data[:4])[0]
+            elif kind in (b'fcTL', b'fdAT'):
+                self.sequence = struct.unpack('>I', data[:4])[0] + 1
+            elif kind == b'IEND':
+                self.handle.seek(start)
+                self.handle.truncate()
+                return
+
+    def close(self):
+        self.handle.write(png_chunk(b'IEND', b''))
+        self.handle.seek(self.control)
+        self.handle.write(png_chunk(b'acTL', struct.pack(
+            '>II', self.frames, 0)))
+        self.handle.close()
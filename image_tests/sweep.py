@@ -0,0 +1,139 @@
+"""
+Renders a grid of ImageGeneration parameters on a pool of processes.
+
+Every combination of radius, power, random seed and minimum color value is
+its own image. The palette for each minimum value is built once in the
+parent and handed to the workers through shared memory, and the workers
+report finished pixels into one shared counter that drives a single
+progress bar.
+"""
+import pyximport; pyximport.install()
+
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import Value, shared_memory
+
+import numpy as np
+from tqdm import tqdm
+
+from color_test import ImageGeneration
+
+# Set in each worker by init_worker
+PIXELS_DONE = None
+
+
+class SharedProgress:
+    """tqdm-style `update(n)` that adds to a counter shared between processes"""
+
+    def __init__(self, counter):
+        self.counter = counter
+
+    def update(self, n):
+        with self.counter.get_lock():
+            self.counter.value += n
+
+
+def init_worker(counter):
+    global PIXELS_DONE
+    PIXELS_DONE = counter
+
+
+def render(job):
+    """Grows and saves one image; runs inside a worker process"""
+    palette_memory = shared_memory.SharedMemory(name=job['palette_name'])
+    try:
+        palette = np.ndarray(job['palette_shape'], dtype=np.uint8,
+                             buffer=palette_memory.buf)
+        palette.flags.writeable = False
+        start = time.time()
+        image_generator = ImageGeneration(job['dim_x'], job['dim_y'],
+                                          job['seeds'],
+                                          radius=job['radius'],
+                                          power=job['power'],
+                                          random_seed=job['random_seed'],
+                                          progress_bar=False,
+                                          palette=palette)
+        image_generator.fit_colors(progress=SharedProgress(PIXELS_DONE))
+        image_generator.save(job['path'])
+        # Drop every view of the shared buffer before closing it
+        del image_generator, palette
+        return job['path'], time.time() - start
+    finally:
+        palette_memory.close()
+
+
+def sweep(dim_x, dim_y,
+          radii=(1.0,), powers=(1.0,),
+          random_seeds=(None,), min_values=(0,),
+          seeds=1,
+          output_dir='image_tests/images/sweep',
+          processes=None,
+          palette_seed=42):
+    """
+    Renders every combination of `radii`, `powers`, `random_seeds` and
+    `min_values` and returns a list of `(path, seconds)` in job order.
+
+    Images that share a minimum value also share one palette, shuffled once
+    from a child of `palette_seed`.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    palette_seeds = np.random.SeedSequence(palette_seed).spawn(
+        len(min_values))
+
+    palettes = {}
+    jobs = []
+    try:
+        for min_value, seed in zip(min_values, palette_seeds):
+            palette = ImageGeneration.build_palette(unique_colors=dim_x*dim_y,
+                                                    min_value=min_value,
+                                                    rng=seed)
+            memory = shared_memory.SharedMemory(create=True,
+                                                size=palette.nbytes)
+            np.ndarray(palette.shape, dtype=np.uint8,
+                       buffer=memory.buf)[:] = palette
+            palettes[min_value] = (memory, palette.shape)
+
+        for radius, power, random_seed, min_value in itertools.product(
+                radii, powers, random_seeds, min_values):
+            memory, shape = palettes[min_value]
+            jobs.append({
+                'dim_x': dim_x,
+                'dim_y': dim_y,
+                'seeds': seeds,
+                'radius': radius,
+                'power': power,
+                'random_seed': random_seed,
+                'palette_name': memory.name,
+                'palette_shape': shape,
+                'path': os.path.join(
+                    output_dir,
+                    f'{dim_x}x{dim_y}_{random_seed}_radius_{radius:.5f}_'
+                    f'power_{power:.5f}_min_{min_value}.png'),
+            })
+
+        pixels_done = Value('q', 0)
+        total = len(jobs) * (dim_x * dim_y - seeds)
+        with ProcessPoolExecutor(max_workers=processes,
+                                 initializer=init_worker,
+                                 initargs=(pixels_done,)) as executor:
+            futures = [executor.submit(render, job) for job in jobs]
+            with tqdm(total=total, unit='px') as progress_bar:
+                pending = set(futures)
+                while pending:
+                    _, pending = wait(pending, timeout=0.25)
+                    progress_bar.update(pixels_done.value - progress_bar.n)
+            return [future.result() for future in futures]
+    finally:
+        for memory, _ in palettes.values():
+            memory.close()
+            memory.unlink()
+
+
+if __name__ == '__main__':
+    for path, seconds in sweep(256, 256,
+                               radii=[1.0, 2.0, 3.0],
+                               powers=[0.5, 1.0, 2.0],
+                               random_seeds=[1, 2]):
+        print(f'{seconds:8.2f}s {path}')
@@ -0,0 +1,168 @@
+"""
+Grows one large image as independent tiles on a pool of processes.
+
+The canvas is cut into a grid of tiles. Each tile gets its own seeds and
+its own disjoint slice of the shuffled palette, so every color is still used
+exactly once. The tiles are grown concurrently and pasted together, and a
+blending pass then hides the seams by swapping pixels across them. Swapping
+moves colors around without adding or dropping any.
+"""
+import pyximport; pyximport.install()
+
+import random
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import Value
+
+import numpy as np
+from numba import njit
+from PIL import Image
+from tqdm import tqdm
+
+import sweep
+from color_test import ImageGeneration
+
+
+def split(length, parts):
+    """Returns `parts + 1` cut points spreading `length` as evenly as possible"""
+    return [length * i // parts for i in range(parts + 1)]
+
+
+def grow_tile(job):
+    """Grows a single tile; runs inside a worker process"""
+    image_generator = ImageGeneration(job['dim_x'], job['dim_y'],
+                                      job['seeds'],
+                                      radius=job['radius'],
+                                      power=job['power'],
+                                      random_seed=job['random_seed'],
+                                      progress_bar=False,
+                                      palette=job['palette'])
+    image_generator.fit_colors(
+        progress=sweep.SharedProgress(sweep.PIXELS_DONE))
+    return image_generator.canvas
+
+
+@njit
+def local_error(canvas, x, y):
+    # Squared color difference between a pixel and its 4-neighbours
+    height, width, _ = canvas.shape
+    error = 0
+    for n_x, n_y in ((x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)):
+        if 0 <= n_x < width and 0 <= n_y < height:
+            for c in range(3):
+                delta = np.int64(canvas[y, x, c]) - np.int64(canvas[n_y, n_x, c])
+                error += delta * delta
+    return error
+
+
+@njit
+def try_swap(canvas, a_x, a_y, b_x, b_y):
+    """Swaps two pixels if that lowers the error around them"""
+    before = local_error(canvas, a_x, a_y) + local_error(canvas, b_x, b_y)
+    for c in range(3):
+        canvas[a_y, a_x, c], canvas[b_y, b_x, c] = \
+            canvas[b_y, b_x, c], canvas[a_y, a_x, c]
+    after = local_error(canvas, a_x, a_y) + local_error(canvas, b_x, b_y)
+    if after >= before:
+        for c in range(3):
+            canvas[a_y, a_x, c], canvas[b_y, b_x, c] = \
+                canvas[b_y, b_x, c], canvas[a_y, a_x, c]
+
+
+@njit
+def blend_seams(canvas, cuts_x, cuts_y, width, passes, seed):
+    """
+    Pairs pixels on either side of each seam, within `width` of it, and
+    keeps every swap that makes the neighbourhood smoother.
+    """
+    np.random.seed(seed)
+    height, full_width, _ = canvas.shape
+    for _ in range(passes):
+        for seam in cuts_x:
+            for y in range(height):
+                for _ in range(width):
+                    a_x = seam - 1 - np.random.randint(width)
+                    b_x = seam + np.random.randint(width)
+                    b_y = min(max(y + np.random.randint(-width, width + 1),
+                                  0), height - 1)
+                    if a_x >= 0 and b_x < full_width:
+                        try_swap(canvas, a_x, y, b_x, b_y)
+        for seam in cuts_y:
+            for x in range(full_width):
+                for _ in range(width):
+                    a_y = seam - 1 - np.random.randint(width)
+                    b_y = seam + np.random.randint(width)
+                    b_x = min(max(x + np.random.randint(-width, width + 1),
+                                  0), full_width - 1)
+                    if a_y >= 0 and b_y < height:
+                        try_swap(canvas, x, a_y, b_x, b_y)
+
+
+def grow_tiled(dim_x, dim_y,
+               tiles_x=2, tiles_y=2,
+               seeds=1,
+               radius=1.0, power=1.0,
+               min_value_color=0,
+               random_seed=None,
+               blend_width=4, blend_passes=4,
+               processes=None):
+    """
+    Grows a `dim_x` by `dim_y` image as `tiles_x * tiles_y` tiles, each with
+    `seeds` seeds, and returns it as a PIL image.
+    """
+    # Every tile grows from its own child of the seed, so tiles are
+    # reproducible and their random streams never overlap
+    palette_seed, blend_seed, *tile_seeds = np.random.SeedSequence(
+        42 if random_seed is None else random_seed).spawn(
+            2 + tiles_x * tiles_y)
+    palette = ImageGeneration.build_palette(unique_colors=dim_x*dim_y,
+                                            min_value=min_value_color,
+                                            rng=palette_seed)
+
+    cuts_x = split(dim_x, tiles_x)
+    cuts_y = split(dim_y, tiles_y)
+    jobs = []
+    offset = 0
+    for t_y in range(tiles_y):
+        for t_x in range(tiles_x):
+            tile_x = cuts_x[t_x + 1] - cuts_x[t_x]
+            tile_y = cuts_y[t_y + 1] - cuts_y[t_y]
+            jobs.append({
+                'dim_x': tile_x,
+                'dim_y': tile_y,
+                'seeds': seeds,
+                'radius': radius,
+                'power': power,
+                'random_seed': tile_seeds[len(jobs)],
+                'palette': palette[offset:offset + tile_x * tile_y],
+            })
+            offset += tile_x * tile_y
+
+    canvas = np.zeros((dim_y, dim_x, 3), dtype=np.uint8)
+    pixels_done = Value('q', 0)
+    total = sum(job['dim_x'] * job['dim_y'] - job['seeds'] for job in jobs)
+    with ProcessPoolExecutor(max_workers=processes,
+                             initializer=sweep.init_worker,
+                             initargs=(pixels_done,)) as executor:
+        futures = [executor.submit(grow_tile, job) for job in jobs]
+        with tqdm(total=total, unit='px') as progress_bar:
+            pending = set(futures)
+            while pending:
+                _, pending = wait(pending, timeout=0.25)
+                progress_bar.update(pixels_done.value - progress_bar.n)
+        for index, future in enumerate(futures):
+            t_y, t_x = divmod(index, tiles_x)
+            canvas[cuts_y[t_y]:cuts_y[t_y + 1],
+                   cuts_x[t_x]:cuts_x[t_x + 1]] = future.result()
+
+    blend_seams(canvas, np.array(cuts_x[1:-1], dtype=np.int64),
+                np.array(cuts_y[1:-1], dtype=np.int64),
+                blend_width, blend_passes,
+                int(blend_seed.generate_state(1)[0] >> 1))
+    return Image.fromarray(canvas)
+
+
+if __name__ == '__main__':
+    seed_to_use = random.randint(0, 1_000_000_000)
+    grow_tiled(3840, 2160, tiles_x=4, tiles_y=2,
+               random_seed=seed_to_use).save(
+        f'image_tests/images/grow/3840x2160_{seed_to_use}_tiled.png')
@@ -0,0 +1,96 @@
+"""
+Peak and retained memory of a single call
+"""
+import gc
+import os
+import threading
+import tracemalloc
+
+METHODS = ('tracemalloc', 'rss')
+
+# Bytes a call can vary by from frames, small ints and the like, whatever
+# its input
+NOISE_BYTES = 1024
+
+
+def traced_memory(call):
+    """
+    Returns the peak bytes Python allocated during `call()` and the bytes
+    still allocated after it, with its result alive, as traced by
+    tracemalloc. Allocations made by native code outside Python's allocators
+    are not seen.
+    """
+    gc.collect()
+    already_tracing = tracemalloc.is_tracing()
+    if already_tracing:
+        tracemalloc.reset_peak()
+    else:
+        tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        result = call()
+        gc.collect()
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        if not already_tracing:
+            tracemalloc.stop()
+    del result
+    return peak - before, after - before
+
+
+def resident_bytes():
+    """Resident set size of this process in bytes"""
+    with open('/proc/self/statm') as handle:
+        return int(handle.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def sampled_rss(call, interval=0.001):
+    """
+    Returns the peak growth of the resident set size during `call()` and its
+    growth after it, with its result alive. The peak is sampled by a thread
+    every `interval` seconds, so it catches memory native code allocates,
+    but can miss short spikes while Python code holds the interpreter lock.
+    """
+    gc.collect()
+    before = resident_bytes()
+    peak = before
+    done = threading.Event()
+
+    def sample():
+        nonlocal peak
+        while not done.wait(interval):
+            peak = max(peak, resident_bytes())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        result = call()
+    finally:
+        done.set()
+        sampler.join()
+    gc.collect()
+    after = resident_bytes()
+    del result
+    return max(peak, after) - before, after - before
+
+
+def measure(call, method='tracemalloc'):
+    """
+    Returns (peak, net) bytes of `call()` by one of METHODS. Traced calls
+    are made twice and the smaller bytes kept, since a first call can
+    allocate caches and free lists that later calls reuse. Freed memory
+    stays resident, so 'rss' is best used with a fresh process per size.
+
+    Raises
+    ------
+    ValueError
+        For a method not in METHODS, or 'rss' where /proc is unavailable
+    """
+    if method == 'tracemalloc':
+        first, second = traced_memory(call), traced_memory(call)
+        return min(first[0], second[0]), min(first[1], second[1])
+    if method == 'rss':
+        if not os.path.exists('/proc/self/statm'):
+            raise ValueError("'rss' needs /proc/self/statm")
+        return sampled_rss(call)
+    raise ValueError(f'Unknown memory method {method!r}')
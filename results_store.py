@@ -0,0 +1,343 @@
+"""
+Stores timing sweeps on disk and compares them against earlier runs
+
+Each run is one JSON line keyed by the function, the sizes it was timed at,
+the interpreter and a fingerprint of the machine, so that only like is
+compared with like. Run as a script to list runs or to compare the latest
+run of a function with a baseline:
+
+    python results_store.py list
+    python results_store.py compare timing_methods.binary_contains
+
+`compare` exits with status 1 when it finds a statistically significant
+slowdown, so it can gate changes to hot functions. Changes in the fitted
+complexity class are reported alongside.
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+from scipy import stats as scipy_stats
+
+import complexity_fit
+
+RESULTS = 'benchmarks/timings.jsonl'
+
+# Slowdowns smaller than this fraction are not reported
+THRESHOLD = 0.05
+# Significance level of the test over all sizes
+ALPHA = 0.05
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def interpreter():
+    """Implementation and version of the running Python, e.g. CPython-3.11.4"""
+    return f'{platform.python_implementation()}-{platform.python_version()}'
+
+
+def machine():
+    """
+    Short fingerprint of the hardware and operating system, stable across
+    runs on the same machine
+    """
+    parts = [platform.node(), platform.system(), platform.machine(),
+             platform.processor(), str(os.cpu_count())]
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()[:12]
+
+
+def function_name(function):
+    """
+    Module-qualified name of a function, used as the key of its runs. A
+    function of the script being run is named after the script's file, so
+    it is stored under the same name whether it is run or imported.
+    """
+    module = function.__module__
+    if module == '__main__':
+        path = getattr(sys.modules['__main__'], '__file__', None)
+        if path is not None:
+            module = os.path.splitext(os.path.basename(path))[0]
+    return f'{module}.{function.__qualname__}'
+
+
+def run_key(function, sizes, python=None, host=None):
+    """The key runs are grouped by; sizes are folded into a digest"""
+    digest = hashlib.sha1(json.dumps(list(sizes)).encode()).hexdigest()[:12]
+    return '/'.join([function, digest, python or interpreter(),
+                     host or machine()])
+
+
+def run_record(function, sizes, times, unit='seconds', stats=None,
+               models=None, label=None):
+    """
+    Builds the record of one sweep, with the best fitting complexity class
+
+    Parameters
+    ----------
+    function : str
+        Name the run is stored under, see `function_name`
+    sizes, times : sequence of float
+        Each size and the time it took
+    unit : str, optional
+        Unit of `times`, by default 'seconds'
+    stats : list of dict, optional
+        Sample summaries behind each time, see sample_stats.summarize
+    models : dict, optional
+        Models to fit, by default complexity_fit.MODELS
+    label : str, optional
+        Name to select the run by later, such as 'baseline'
+    """
+    sizes = [int(n) for n in sizes]
+    times = [float(t) for t in times]
+    record = {
+        'function': function,
+        'sizes': sizes,
+        'times': times,
+        'unit': unit,
+        'interpreter': interpreter(),
+        'machine': machine(),
+        'platform': platform.platform(),
+        'revision': git_revision(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'label': label,
+    }
+    record['key'] = run_key(function, sizes, record['interpreter'],
+                            record['machine'])
+    if stats is not None:
+        record['low'] = [float(s['low']) for s in stats]
+        record['high'] = [float(s['high']) for s in stats]
+        record['samples'] = [int(s['samples']) for s in stats]
+        if stats and 'peak' in stats[0]:
+            record['peak'] = [int(s['peak']) for s in stats]
+            record['net'] = [int(s['net']) for s in stats]
+    if len(sizes) > 2:
+        name, params, r_2 = complexity_fit.best_fit(sizes, times, models)
+        if name:
+            record['complexity'] = name
+            record['params'] = [float(p) for p in params]
+            record['r2'] = float(r_2)
+    return record
+
+
+def save(record, results=RESULTS):
+    """Appends a record to the store at `results`"""
+    os.makedirs(os.path.dirname(results) or '.', exist_ok=True)
+    with open(results, 'a') as handle:
+        handle.write(json.dumps(record) + '\n')
+
+
+def load(results=RESULTS):
+    """All records in the store, oldest first"""
+    if not os.path.exists(results):
+        return []
+    with open(results) as handle:
+        return [json.loads(line) for line in handle if line.strip()]
+
+
+def matching(records, function, python=None, host=None):
+    """Records of `function` on this interpreter and machine, oldest first"""
+    python = python or interpreter()
+    host = host or machine()
+    return [record for record in records
+            if record['function'] == function
+            and record['interpreter'] == python
+            and record['machine'] == host]
+
+
+def find_baseline(records, current, label=None):
+    """
+    The run `current` is compared with: the latest one with `label` if given,
+    otherwise the latest earlier run with the same key, otherwise the latest
+    earlier run sharing any sizes
+    """
+    earlier = [record for record in records if record is not current]
+    if label is not None:
+        earlier = [record for record in earlier if record.get('label') == label]
+        return earlier[-1] if earlier else None
+    for record in reversed(earlier):
+        if record['key'] == current['key']:
+            return record
+    for record in reversed(earlier):
+        if set(record['sizes']) & set(current['sizes']):
+            return record
+    return None
+
+
+# Growth of each fixed complexity class as (tier, power, log power): tiers
+# are constant, polylogarithmic, polynomial, exponential and factorial.
+# Exponentials are ranked by their base
+GROWTH = {
+    '1': (0, 0, 0),
+    'log(n)': (1, 1, 0),
+    'log(n)^2': (1, 2, 0),
+    'n': (2, 1, 0),
+    'n*log(n)': (2, 1, 1),
+    'n*log(n)^2': (2, 1, 2),
+    'n^2': (2, 2, 0),
+    'n^3': (2, 3, 0),
+    'n^4': (2, 4, 0),
+    '2^n': (3, 2, 0),
+    'n!': (4, 0, 0),
+}
+
+
+def growth_rank(name, params=None):
+    """
+    Key that orders complexity classes by how fast they grow, or None for a
+    class that cannot be placed. n^a sits among the polynomials and a^n
+    among the exponentials by the fitted `a`, the first of `params`;
+    exponents that do not grow rank as constant.
+    """
+    if name in GROWTH:
+        return GROWTH[name]
+    if params is None or name not in ('n^a', 'a^n'):
+        return None
+    a = float(params[0])
+    if name == 'n^a':
+        return (2, a, 0) if a > 0 else GROWTH['1']
+    return (3, a, 0) if a > 1 else GROWTH['1']
+
+
+def compare(baseline, current, threshold=THRESHOLD, alpha=ALPHA):
+    """
+    Compares two runs of a function at the sizes they share.
+
+    A size is flagged when it is more than `threshold` slower and, where both
+    runs have confidence intervals, the intervals do not overlap. The run as
+    a whole is a slowdown when a one-sided Wilcoxon signed-rank test over the
+    log time ratios is significant at `alpha` and the median ratio exceeds
+    1 + `threshold`, and only a slowdown is a regression. The best fitting
+    complexity class can flip between neighbouring classes on noise alone,
+    so a change of class is reported but does not count as a regression.
+
+    Returns
+    -------
+    dict
+        'sizes', per size 'ratios' and 'flagged', the 'median_ratio', the
+        test's 'p_value' (None with too few sizes), 'slowdown', the
+        'complexity' of both runs, 'complexity_changed', 'growth' of the
+        new class against the old (1 faster, -1 slower, 0 the same or None
+        when either cannot be ranked) and 'regression'
+    """
+    base = dict(zip(baseline['sizes'], range(len(baseline['sizes']))))
+    sizes, ratios, flagged = [], [], []
+    intervals = 'high' in baseline and 'low' in current
+    for i, n in enumerate(current['sizes']):
+        j = base.get(n)
+        if j is None or baseline['times'][j] <= 0 or current['times'][i] <= 0:
+            continue
+        ratio = current['times'][i] / baseline['times'][j]
+        slower = ratio > 1 + threshold
+        if slower and intervals:
+            slower = current['low'][i] > baseline['high'][j]
+        sizes.append(n)
+        ratios.append(ratio)
+        flagged.append(slower)
+
+    p_value = None
+    median_ratio = float(np.median(ratios)) if ratios else math.nan
+    # Five sizes is the fewest the test can call significant at 0.05
+    if len(ratios) >= 5:
+        logs = np.log(ratios)
+        if np.any(logs != 0):
+            p_value = float(scipy_stats.wilcoxon(
+                logs, alternative='greater').pvalue)
+    slowdown = (p_value is not None and p_value < alpha
+                and median_ratio > 1 + threshold)
+
+    before = baseline.get('complexity')
+    after = current.get('complexity')
+    changed = before is not None and after is not None and before != after
+    growth = None
+    rank_before = growth_rank(before, baseline.get('params'))
+    rank_after = growth_rank(after, current.get('params'))
+    if rank_before is not None and rank_after is not None:
+        growth = (rank_after > rank_before) - (rank_after < rank_before)
+    return {'sizes': sizes, 'ratios': ratios, 'flagged': flagged,
+            'median_ratio': median_ratio, 'p_value': p_value,
+            'slowdown': slowdown, 'complexity': (before, after),
+            'complexity_changed': changed, 'growth': growth,
+            'regression': bool(slowdown)}
+
+
+def print_comparison(baseline, current, result):
+    """Prints a comparison from `compare` as a table and a verdict"""
+    print(f"{current['function']}: {current['created']} "
+          f"({current['revision']}) against {baseline['created']} "
+          f"({baseline['revision']})")
+    print(f"{'Size':<16} {'Ratio':>16} {'':>8}")
+    for n, ratio, slower in zip(result['sizes'], result['ratios'],
+                                result['flagged']):
+        print(f"{n:<16} {ratio:>16.4f} {'SLOWER' if slower else '':>8}")
+    if result['p_value'] is None:
+        print(f"Median ratio {result['median_ratio']:.4f}, too few shared "
+              f"sizes to test")
+    else:
+        print(f"Median ratio {result['median_ratio']:.4f}, "
+              f"p = {result['p_value']:.4g}")
+    before, after = result['complexity']
+    if result['complexity_changed']:
+        direction = {1: ', a faster growing class',
+                     -1: ', a slower growing class'}.get(result['growth'], '')
+        print(f'Complexity changed from O({before}) to O({after})'
+              f'{direction}')
+    elif after is not None:
+        print(f'Complexity unchanged at O({after})')
+    if result['slowdown']:
+        print('Significant slowdown')
+    print('REGRESSION' if result['regression'] else 'OK')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--results', default=RESULTS)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list')
+    compare_parser = commands.add_parser('compare')
+    compare_parser.add_argument('function')
+    compare_parser.add_argument('--baseline',
+                                help='label of the run to compare against')
+    compare_parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    compare_parser.add_argument('--alpha', type=float, default=ALPHA)
+    args = parser.parse_args(argv)
+
+    records = load(args.results)
+    if args.command == 'list':
+        for record in records:
+            print(f"{record['created']} {record['function']} "
+                  f"{len(record['sizes'])} sizes "
+                  f"O({record.get('complexity', '?')}) "
+                  f"{record['interpreter']} {record['machine']} "
+                  f"{record.get('label') or ''}")
+        return 0
+
+    runs = matching(records, args.function)
+    if not runs:
+        print(f'No runs of {args.function} on this interpreter and machine')
+        return 2
+    current = runs[-1]
+    baseline = find_baseline(runs, current, args.baseline)
+    if baseline is None:
+        print(f'No baseline to compare the latest run of {args.function} with')
+        return 2
+    result = compare(baseline, current, args.threshold, args.alpha)
+    print_comparison(baseline, current, result)
+    return 1 if result['regression'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,53 @@
+"""
+Robust summaries of repeated timing samples
+"""
+import math
+from statistics import NormalDist
+
+import numpy as np
+
+
+def reject_outliers(samples):
+    """
+    Returns the samples inside Tukey's fences, 1.5 interquartile ranges
+    beyond the quartiles, along with that range
+    """
+    samples = np.asarray(samples, dtype=np.float64)
+    q_1, q_3 = np.percentile(samples, [25, 75])
+    iqr = q_3 - q_1
+    inside = (samples >= q_1 - 1.5 * iqr) & (samples <= q_3 + 1.5 * iqr)
+    return samples[inside], iqr
+
+
+def median_interval(samples, confidence=0.95):
+    """
+    Distribution-free confidence interval for the median: the order
+    statistics whose ranks bracket the median with the given probability,
+    by the normal approximation to the binomial
+    """
+    ordered = np.sort(np.asarray(samples, dtype=np.float64))
+    n = len(ordered)
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    half_width = z * math.sqrt(n) / 2
+    low = max(math.floor(n / 2 - half_width), 1)
+    high = min(math.ceil(1 + n / 2 + half_width), n)
+    # Ranks are 1-based
+    return float(ordered[low - 1]), float(ordered[high - 1])
+
+
+def summarize(samples, confidence=0.95):
+    """
+    Median of the samples that survive outlier rejection, with its
+    confidence interval and how many samples went into it
+
+    Returns
+    -------
+    dict
+        'median', 'low' and 'high' bounds of the interval, 'iqr',
+        'samples' taken and how many were 'rejected'
+    """
+    kept, iqr = reject_outliers(samples)
+    low, high = median_interval(kept, confidence)
+    return {'median': float(np.median(kept)), 'low': low, 'high': high,
+            'iqr': float(iqr), 'samples': len(samples),
+            'rejected': len(samples) - len(kept)}
@@ -1,14 +1,16 @@
 """
 Timing experiments
 """
-import math
+import os
 import time
 
 import numpy as np
 from matplotlib import pyplot as plt
-from scipy import optimize
 from sklearn import metrics
 
+import results_store
+from complexity_fit import MODELS, best_fit
+
 REPETITIONS = 1000
 DURATION = 5000
 SIZE = 1024
@@ -16,20 +18,15 @@ MAX_TIME = 60 * 5
 PLOT = True
 LIMIT = 2 ** 30
 MULTIPLIER = 2
+# Results store the sweeps are appended to, see results_store. Opt in by
+# setting TIMING_RESULTS to a path; unset keeps nothing
+RESULTS = os.environ.get('TIMING_RESULTS')
 
-FUNCTIONS = {
-    "log(n)": np.vectorize(lambda x, a, b: a * math.log2(x) + b),
-    "log(n)^2": np.vectorize(lambda x, a, b: a * math.log2(x) ** 2 + b),
-    "n": np.vectorize(lambda x, a, b: a * x + b),
-    "n*log(n)": np.vectorize(lambda x, a, b: a * x * math.log2(x) + b),
-    "n*log(n)^2": np.vectorize(lambda x, a, b: a * x * math.log2(x) ** 2 + b),
-    "n^2": np.vectorize(lambda x, a, b: a * x ** 2 + b),
-    "n^3": np.vectorize(lambda x, a, b: a * x ** 3 + b),
-    "2^n": np.vectorize(lambda x, a, b: a * 2 ** x + b),
-    # "n^a": np.vectorize(lambda x, a, b: x ** a + b),
-    # "a^n": np.vectorize(lambda x, a, b: a ** x + b),
-    "n!": np.vectorize(lambda x, a, b: a * math.factorial(x) + b),
-}
+FUNCTIONS = {name: MODELS[name]
+             for name in ("log(n)", "log(n)^2", "n", "n*log(n)", "n*log(n)^2",
+                          "n^2", "n^3", "2^n",
+                          # "n^a", "a^n",
+                          "n!")}
 
 
 def main():
@@ -79,6 +76,7 @@ def main():
             x_vals.append(size)
             y_vals.append(current_time)
             iteration += 1
+        store_results(time_binary_search_5, x_vals, y_vals)
         if PLOT:
             plot_and_fit(x_vals, y_vals, label='Binary Search 5')
         print()
@@ -101,6 +99,7 @@ def main():
             x_vals.append(size)
             y_vals.append(current_time)
             iteration += 1
+        store_results(time_binary_search_6, x_vals, y_vals)
         if PLOT:
             plot_and_fit(x_vals, y_vals, label='Binary Search 6')
         print()
@@ -123,6 +122,7 @@ def main():
             x_vals.append(size)
             y_vals.append(current_time)
             iteration += 1
+        store_results(time_binary_search_7, x_vals, y_vals)
         if PLOT:
             plot_and_fit(x_vals, y_vals, label='Binary Search 7')
         print()
@@ -145,6 +145,7 @@ def main():
             x_vals.append(size)
             y_vals.append(current_time)
             iteration += 1
+        store_results(time_linear_search_1, x_vals, y_vals)
         if PLOT:
             plot_and_fit(x_vals, y_vals, label='Linear Search 1')
     if PLOT:
@@ -479,6 +480,18 @@ def print_header():
     print(f"{'Size':<16} {'Time (msec)':<16} {'Delta (msec)':<16} {'Ratio':<16}")
 
 
+def store_results(function, x_vals, y_vals):
+    """
+    Appends a sweep of `function`, timed in milliseconds, to the results
+    store, for `results_store.py compare` to check later runs against
+    """
+    if RESULTS is None or not x_vals:
+        return
+    results_store.save(results_store.run_record(
+        results_store.function_name(function), x_vals, y_vals,
+        unit='milliseconds', models=FUNCTIONS), RESULTS)
+
+
 def plot_and_fit(x_vals, y_vals, label):
     """
     Simultaneously plots recorded values and does its best to fit and plot an
@@ -505,26 +518,7 @@ def find_best_fit(x_data, y_data):
     """
     Calculates the line of best fit given x and y data.
     """
-    best_r = float('-inf')
-    best_function = ""
-    best_params = ()
-    for name, function in FUNCTIONS.items():
-        try:
-            params, _ = optimize.curve_fit(
-                function, x_data, y_data, p0=[1, 1])
-            current_r2 = coefficient_of_determination(
-                function, params, x_data, y_data)
-            # print(f'{name} gives {current_r2}')
-            if current_r2 > best_r:
-                # print(f'New best! {name} replaces {best_function}, \
-                #     with {current_r2:.6f} > {best_r:.6f}')
-                best_function = name
-                best_params = params
-                best_r = current_r2
-        except OverflowError:
-            pass
-    # print(best_function, best_params)
-    return best_function, best_params, best_r
+    return best_fit(x_data, y_data, FUNCTIONS)
 
 
 def function_label(name, beta, alpha, r_squared):
@@ -1,17 +1,23 @@
 """
 A (fairly) simple timing class
 """
+import collections
 import gc
-import math
+import multiprocessing
+import os
 import random
 import time
 from typing import Generator
 
 import numpy as np
 from matplotlib import pyplot as plt
-from scipy import optimize
 from sklearn import metrics
 
+import complexity_fit
+import memory_usage
+import results_store
+from sample_stats import summarize
+
 
 class SimpleTiming:
     """A class for timing functions"""
@@ -25,7 +31,14 @@ class SimpleTiming:
                  data_or_generator=None,
                  selector=None,
                  arg_dict=None,
-                 skip_fits=None
+                 skip_fits=None,
+                 sample_time: float = 0.005,
+                 precision: float = 0.02,
+                 min_samples: int = 5,
+                 workers: int = 0,
+                 results: str = None,
+                 label: str = None,
+                 memory: str = None
                  ):
         """
         Initializer for SimpleTiming
@@ -40,8 +53,8 @@ class SimpleTiming:
             Maximum number of seconds allowed of time before continuing to
             another iteration of timing, by default 60
         duration : float, optional
-            Minimum number of seconds required for timing an individual
-            iteration of `n`, by default 1
+            Maximum number of seconds spent sampling an individual iteration
+            of `n`, by default 1
         n_iterator : [type], optional
             If `None`, times in powers of 2, from n=2^4 to n=2^30. Either a
             generator that yields numbers or a collection that can be iterated
@@ -63,12 +76,49 @@ class SimpleTiming:
         skip_fits : list, optional
             If `None`, defaults to `['n!', 'a^n', 'n^a']`. The `time_function`
             method does not attempt to fit these functions. By default None
+        sample_time : float, optional
+            Minimum number of seconds one sample, a batch of calls, should
+            take, by default 0.005
+        precision : float, optional
+            Sampling for an `n` stops once the 95% confidence interval of the
+            median is within this fraction of it, by default 0.02
+        min_samples : int, optional
+            Number of samples taken before checking the interval, by
+            default 5
+        workers : int, optional
+            If more than 0, sizes are timed in that many worker processes at
+            once, at most one per available core, as `time_in_pool`
+            describes. The function, its arguments and the data must then be
+            picklable, and the calling script needs an
+            `if __name__ == '__main__':` guard. By default 0, which times
+            sizes one after another in this process
+        results : str, optional
+            Path of a results store, see `results_store`, that each sweep is
+            appended to along with its best fit. By default None, which
+            keeps nothing
+        label : str, optional
+            Label stored with the sweep, such as 'baseline', that
+            `results_store.py compare --baseline` selects runs by. By
+            default None
+        memory : str, optional
+            Also measures the peak and net bytes of one call for each `n`,
+            by 'tracemalloc' for Python allocations or by sampling the
+            resident set size with 'rss' for native code, see
+            `memory_usage`. Both are fitted like the times and reported as
+            the space complexity. By default None, which only times
         """
         # User options
         self.plot = plot
         self.print_out = print_out
         self.max_time = max_time
         self.duration = duration
+        self.sample_time = sample_time
+        self.precision = precision
+        self.min_samples = min_samples
+        self.workers = workers
+        self.results = results
+        self.label = label
+        self.memory = memory
         self.data_or_generator = data_or_generator
         self.selector = selector
         self.arg_dict = arg_dict
@@ -77,6 +127,11 @@ class SimpleTiming:
         # Default Values
         self.x_vals = []  # type: ignore
         self.y_vals = []  # type: ignore
+        # Summary of the samples behind each y value, see sample_stats
+        self.stats = []  # type: ignore
+        # Peak and net bytes of a call for each x value, when measured
+        self.peak_vals = []  # type: ignore
+        self.net_vals = []  # type: ignore
         self.shared_dict = dict()  # type: ignore
         self.alpha = None
         self.beta = None
@@ -84,6 +139,8 @@ class SimpleTiming:
         self.data = None
 
         # Conditional setup
+        if self.memory is not None and self.memory not in memory_usage.METHODS:
+            raise ValueError(f'Unknown memory method {self.memory!r}')
         if self.arg_dict is None:
             self.arg_dict = {'n': 'n',
                              'item': False,
@@ -114,23 +171,9 @@ class SimpleTiming:
 
         self.multiples = ['seconds', 'milliseconds', 'nanoseconds']
 
-        # Function lookup
-        self.functions = {
-            "log(n)": np.vectorize(lambda x, a, b: a * math.log2(x) + b),
-            "log(n)^2": np.vectorize(lambda x, a, b:
-                                     a * math.log2(x) ** 2 + b),
-            "n": np.vectorize(lambda x, a, b: a * x + b),
-            "n*log(n)": np.vectorize(lambda x, a, b: a * x * math.log2(x) + b),
-            "n*log(n)^2": np.vectorize(lambda x, a, b:
-                                       a * x * math.log2(x) ** 2 + b),
-            "n^2": np.vectorize(lambda x, a, b: a * x ** 2 + b),
-            "n^3": np.vectorize(lambda x, a, b: a * x ** 3 + b),
-            "n^4": np.vectorize(lambda x, a, b: a * x ** 4 + b),
-            "2^n": np.vectorize(lambda x, a, b: a * 2 ** x + b),
-            "n^a": np.vectorize(lambda x, a, b: x ** a + b),
-            "a^n": np.vectorize(lambda x, a, b: a ** x + b),
-            "n!": np.vectorize(lambda x, a, b: a * math.factorial(x) + b),
-        }
+        # Function lookup. Every model takes whole arrays of sizes; see
+        # complexity_fit for how each one is fitted
+        self.functions = dict(complexity_fit.MODELS)
 
         # Remove functions that should be skipped
         for i in self.skip_fits:
@@ -209,53 +252,20 @@ class SimpleTiming:
 
         print(type(function_to_time))
 
-        function_takes_data = self.arg_dict['data'] is not False
-        function_takes_n = self.arg_dict['n'] is not False
+        if self.print_out:
+            self.print_header(memory=self.memory is not None)
 
-        iteration = 0
-        previous_time = 0
-        test_start = time.time()
+        if self.workers:
+            self.time_in_pool(function_to_time, args, kwargs)
+        else:
+            self.time_serially(function_to_time, args, kwargs)
 
-        if self.print_out:
-            self.print_header()
+        if self.results is not None and self.x_vals:
+            self.save_results(function_to_time)
 
-        # Disable garbage collection so it doesn't interfere with timing
-        gc.disable()
-        while time.time() - self.max_time < test_start:
-            try:
-                n = next(self.n_iterator)
-                if function_takes_n:
-                    self.shared_dict[self.arg_dict['n']] = n
-
-                if self.data_or_generator is None:
-                    current_time = self.time_n(function_to_time,
-                                               *args, **kwargs)
-
-                else:
-                    if self.data_generator_exists:
-                        self.data = self.data_or_generator(n)
-                    else:
-                        self.data = self.data_or_generator
-                    if function_takes_data:
-                        self.shared_dict[self.arg_dict['data']] = self.data
-
-                    current_time = self.time_n(function_to_time,
-                                               *args, **kwargs)
-
-                self.x_vals.append(n)
-                self.y_vals.append(current_time)
-                if self.print_out:
-                    self.print_info(n, current_time, previous_time, iteration)
-                previous_time = current_time
-                iteration += 1
-            except StopIteration:
-                # Iterator exhausted: stop the loop
-                break
-            except (KeyboardInterrupt, MemoryError) as _:
-                break
+        if self.memory is not None and self.print_out and self.x_vals:
+            self.print_complexity()
 
-        # Re-enable garbage collection now that timing is done
-        gc.enable()
         if self.plot:
             iteration = 0
             # mypy: ignore
@@ -267,72 +277,235 @@ class SimpleTiming:
             plt.style.use('ggplot')
             plt.xlabel("n")
             plt.ylabel(f"Time in {self.multiples[iteration]}")
-            plt.legend()
+            if self.peak_vals:
+                self.plot_memory()
+            else:
+                plt.legend()
             plt.show()
 
+    def time_serially(self, function_to_time, args, kwargs):
+        """Times one size after another in this process"""
+        test_start = time.time()
+
+        # Disable garbage collection so it doesn't interfere with timing
+        gc.disable()
+        while time.time() - self.max_time < test_start:
+            try:
+                n = next(self.n_iterator)
+                self.load(n, self.data_for(n))
+                current_time = self.time_n(function_to_time, *args, **kwargs)
+                if self.memory is not None:
+                    self.measure_memory(function_to_time, args, kwargs)
+                self.record(n, current_time, self.stats[-1])
+            except StopIteration:
+                # Iterator exhausted: stop the loop
+                break
+            except (KeyboardInterrupt, MemoryError) as _:
+                break
+
+        # Re-enable garbage collection now that timing is done
+        gc.enable()
+
+    def time_in_pool(self, function_to_time, args, kwargs):
+        """
+        Times sizes in `workers` processes at once. Every size gets a fresh
+        process, so no size inherits the heap or garbage of the one
+        before it, and each process pins itself to a core no other worker
+        is using while it runs. Sizes are handed out in order and recorded
+        in order as they finish. No new sizes start after `max_time`.
+        """
+        if hasattr(os, 'sched_getaffinity'):
+            cores = sorted(os.sched_getaffinity(0))
+        else:
+            cores = list(range(os.cpu_count()))
+        workers = min(self.workers, len(cores))
+        # A fork server imports the heavy dependencies once and forks a
+        # clean child from itself for each size, which is far quicker than
+        # spawning one that imports everything again
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(WORKER_PRELOAD)
+        else:
+            context = multiprocessing.get_context('spawn')
+        free_cores = context.Queue()
+        for core in cores[:workers]:
+            free_cores.put(core)
+        settings = {'duration': self.duration,
+                    'sample_time': self.sample_time,
+                    'precision': self.precision,
+                    'min_samples': self.min_samples,
+                    'selector': self.selector,
+                    'arg_dict': self.arg_dict,
+                    'memory': self.memory}
+
+        pending = collections.deque()
+        exhausted = False
+        test_start = time.time()
+        with context.Pool(workers, initializer=init_worker,
+                          initargs=(free_cores,), maxtasksperchild=1) as pool:
+            try:
+                while True:
+                    while not exhausted and len(pending) < workers \
+                            and time.time() - self.max_time < test_start:
+                        try:
+                            n = next(self.n_iterator)
+                        except StopIteration:
+                            exhausted = True
+                            break
+                        # Drawn here so that a seeded parent gives the same
+                        # inputs on every run
+                        job = (settings, function_to_time, args, kwargs, n,
+                               self.data_for(n), random.getrandbits(64))
+                        pending.append((n, pool.apply_async(time_size,
+                                                            (job,))))
+                    if not pending:
+                        break
+                    n, result = pending.popleft()
+                    current_time, stats = result.get()
+                    self.stats.append(stats)
+                    self.record(n, current_time, stats)
+            except (KeyboardInterrupt, MemoryError) as _:
+                pool.terminate()
+
+    def save_results(self, function_to_time):
+        """Appends this sweep and its best fit to the results store"""
+        record = results_store.run_record(
+            results_store.function_name(function_to_time), self.x_vals,
+            self.y_vals, stats=self.stats, models=self.functions,
+            label=self.label)
+        if self.peak_vals:
+            record['space_complexity'] = \
+                self.find_space_fit(self.peak_vals)[0]
+        results_store.save(record, self.results)
+        return record
+
+    def data_for(self, n):
+        """The data for size `n`, or None if the function takes none"""
+        if self.data_or_generator is None:
+            return None
+        if self.data_generator_exists:
+            return self.data_or_generator(n)
+        return self.data_or_generator
+
+    def load(self, n, data):
+        """Sets up the arguments the function gets for size `n`"""
+        if self.arg_dict['n'] is not False:
+            self.shared_dict[self.arg_dict['n']] = n
+        if data is not None:
+            self.data = data
+            if self.arg_dict['data'] is not False:
+                self.shared_dict[self.arg_dict['data']] = data
+
+    def record(self, n, current_time, stats):
+        """Adds the time for size `n` to the results and prints it"""
+        previous_time = self.y_vals[-1] if self.y_vals else 0
+        stats['n'] = n
+        self.x_vals.append(n)
+        self.y_vals.append(current_time)
+        if 'peak' in stats:
+            self.peak_vals.append(stats['peak'])
+            self.net_vals.append(stats['net'])
+        if self.print_out:
+            self.print_info(n, current_time, previous_time,
+                            len(self.x_vals) - 1, stats)
+
     def time_n(self, function_to_time, *args, **kwargs):
-        # Repeat the timing of the function, but only until the number of
-        # repetitions surpasses duration
-        function_takes_item = self.arg_dict['item'] is not False
-        repetitions = 1
-        elapsed = 0
-        while elapsed < self.duration:
-            repetitions *= 2
-            start = time.process_time()
-            for _ in range(repetitions):
-                try:
-                    if function_takes_item:
-                        item = self.selector(self.data)
-                        self.shared_dict[self.arg_dict['item']] = item
-                    function_to_time(*args, **self.shared_dict, **kwargs)
-                except StopIteration:
-                    # Iterator exhausted: stop the loop
-                    break
-            end = time.process_time()
-            elapsed = end - start
-        final_time = elapsed / repetitions
+        """
+        Returns the median time of one call for the current `n`.
 
-        # Do the same timing as before, but don't actually call the function
-        # This basically calculates overhead just due to running loops
+        Calls are timed in batches that take at least `sample_time`, each
+        followed by the same loop without the call, so that every sample has
+        its own overhead subtracted. Samples outside the interquartile
+        fences are dropped, and sampling stops once the confidence interval
+        of the median is within `precision` of it, or after `duration`.
+        """
         repetitions = 1
-        elapsed = 0
-        while elapsed < self.duration:
+        while self.time_batch(function_to_time, repetitions, True,
+                              args, kwargs) < self.sample_time:
             repetitions *= 2
-            start = time.process_time()
-            for _ in range(repetitions):
-                try:
-                    if function_takes_item:
-                        item = self.selector(self.data)
-                        self.shared_dict[self.arg_dict['item']] = item
-                    # function_to_time(*args, **self.shared_dict, **kwargs)
-                except StopIteration:
-                    # Iterator exhausted: stop the loop
+
+        samples = []
+        start = time.perf_counter()
+        while True:
+            elapsed = self.time_batch(function_to_time, repetitions, True,
+                                      args, kwargs)
+            overhead = self.time_batch(function_to_time, repetitions, False,
+                                       args, kwargs)
+            samples.append((elapsed - overhead) / repetitions)
+            if time.perf_counter() - start >= self.duration:
+                break
+            if len(samples) >= self.min_samples:
+                summary = summarize(samples)
+                if summary['high'] - summary['low'] \
+                        <= 2 * self.precision * abs(summary['median']):
                     break
-            end = time.process_time()
-            elapsed = end - start
-        overhead_time = elapsed / repetitions  # / size
 
-        # Subtract the overhead
-        timing_for_n = final_time - overhead_time
+        summary = summarize(samples)
+        summary['repetitions'] = repetitions
+        self.stats.append(summary)
+        # Overhead can outweigh a call that costs next to nothing
+        return max(summary['median'], 0.0)
 
-        # print(f"{function_to_time.__name__} ran in {timing_for_n:.8f} s")
-        return timing_for_n
+    def measure_memory(self, function_to_time, args, kwargs):
+        """
+        Adds the peak and net bytes of one call for the current `n` to its
+        sample summary, as measured by the `memory` method
+        """
+        if self.arg_dict['item'] is not False:
+            self.shared_dict[self.arg_dict['item']] = self.selector(self.data)
+        peak, net = memory_usage.measure(
+            lambda: function_to_time(*args, **self.shared_dict, **kwargs),
+            self.memory)
+        self.stats[-1]['peak'] = peak
+        self.stats[-1]['net'] = net
+
+    def time_batch(self, function_to_time, repetitions, call, args, kwargs):
+        """
+        Returns the process time of `repetitions` calls, or of the same loop
+        with everything but the call itself when `call` is False
+        """
+        function_takes_item = self.arg_dict['item'] is not False
+        start = time.process_time()
+        for _ in range(repetitions):
+            try:
+                if function_takes_item:
+                    item = self.selector(self.data)
+                    self.shared_dict[self.arg_dict['item']] = item
+                if call:
+                    function_to_time(*args, **self.shared_dict, **kwargs)
+            except StopIteration:
+                # Iterator exhausted: stop the loop
+                break
+        return time.process_time() - start
 
     @classmethod
-    def print_header(cls):
+    def print_header(cls, memory=False):
         """
-        Prints the header for the timings in an aligned manner.
+        Prints the header for the timings in an aligned manner, with columns
+        for the peak and net bytes if `memory` is measured.
         """
-        print(f"{'Size':<16} {'Time (sec)':>16}"
-              f" {'Delta (sec)':>16} {'Ratio':>16}")
+        print(f"{'Size':<16} {'Time (sec)':>16} {'95% CI +/-':>16}"
+              f" {'Samples':>8} ", end="")
+        if memory:
+            print(f"{'Peak (bytes)':>14} {'Net (bytes)':>14} ", end="")
+        print(f"{'Delta (sec)':>16} {'Ratio':>16}")
 
     @classmethod
-    def print_info(cls, current_n, current_time, previous_time, iteration):
+    def print_info(cls, current_n, current_time, previous_time, iteration,
+                   stats=None):
         """
         Prints information of the timings, in line with the other timings.
+        `stats` is the summary of the samples behind `current_time`.
         """
         print(f"{current_n:<16} {current_time:>16.8f} ", end="")
-        if iteration > 0:
+        if stats is not None:
+            print(f"{(stats['high'] - stats['low']) / 2:>16.8f}"
+                  f" {stats['samples']:>8} ", end="")
+            if 'peak' in stats:
+                print(f"{stats['peak']:>14} {stats['net']:>14} ", end="")
+        else:
+            print(f"{'':>16} {'':>8} ", end="")
+        if iteration > 0 and previous_time > 0:
             print(
                 f"{current_time - previous_time:>16.8f}"
                 f" {current_time/previous_time:>16.8f}")
@@ -356,6 +529,56 @@ class SimpleTiming:
                  y_vals,
                  label=self.function_label(function_name))
 
+    def find_space_fit(self, values):
+        """
+        Calculates the line of best fit for bytes used at each x value. Bytes
+        that stay within 1% of the largest, or within
+        `memory_usage.NOISE_BYTES`, are reported as constant, '1', with the
+        mean as the offset.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if np.ptp(values) <= max(0.01 * np.max(np.abs(values)),
+                                 memory_usage.NOISE_BYTES):
+            return '1', (0.0, float(np.mean(values))), 1.0
+        return complexity_fit.best_fit(self.x_vals, values, self.functions)
+
+    def print_complexity(self):
+        """
+        Prints the best fitting time complexity next to the space
+        complexity of the peak and net bytes.
+        """
+        rows = [('Time', self.find_best_fit())]
+        if self.peak_vals:
+            rows.append(('Peak memory', self.find_space_fit(self.peak_vals)))
+            rows.append(('Net memory', self.find_space_fit(self.net_vals)))
+        for name, (function_name, _, r2) in rows:
+            print(f"{name:<16} O({function_name}) with r^2={r2:.4f}")
+
+    def plot_memory(self):
+        """
+        Plots the peak bytes and their best fit against a second y axis of
+        the time plot, and adds a legend covering both axes.
+        """
+        time_axis = plt.gca()
+        memory_axis = time_axis.twinx()
+        function_name, params, r2 = self.find_space_fit(self.peak_vals)
+        memory_axis.plot(self.x_vals, self.peak_vals, label='Peak bytes',
+                         linestyle=':', color='tab:purple')
+        x_vals = np.linspace(self.x_vals[0], self.x_vals[-1], 1_000)
+        if function_name == '1':
+            y_vals = np.full_like(x_vals, params[1])
+        else:
+            y_vals = self.functions[function_name](x_vals, params[0],
+                                                   params[1])
+        memory_axis.plot(x_vals, y_vals, color='tab:pink',
+                         label=f'Space O({function_name})'
+                               f' with $r^2={r2:.4f}$')
+        memory_axis.set_ylabel("Peak bytes")
+        lines, labels = time_axis.get_legend_handles_labels()
+        memory_lines, memory_labels = \
+            memory_axis.get_legend_handles_labels()
+        memory_axis.legend(lines + memory_lines, labels + memory_labels)
+
     def get_r_2(self, regressor, params):
         """
         Returns the coefficient of determination for a fit given the x values,
@@ -368,27 +591,53 @@ class SimpleTiming:
         """
         Calculates the line of best fit given x and y data.
         """
-        best_r = float('-inf')
-        best_function = ""
-        best_params = ()
-        for name, function in self.functions.items():
-            try:
-                params, _ = optimize.curve_fit(function,
-                                               self.x_vals,
-                                               self.y_vals,
-                                               p0=[1, 1])
-                current_r2 = self.get_r_2(function, params)
-                # print(f'{name} gives {current_r2}')
-                if current_r2 > best_r:
-                    # print(f'New best! {name} replaces {best_function}, '
-                    #       f'with {current_r2:.6f} > {best_r:.6f}')
-                    best_function = name
-                    best_params = params
-                    best_r = current_r2
-            except OverflowError:
-                pass
-        # print(best_function, best_params)
-        return best_function, best_params, best_r
+        return complexity_fit.best_fit(self.x_vals, self.y_vals,
+                                       self.functions)
+
+
+# Modules the fork server behind `time_in_pool` imports before forking
+# workers. It only sees the interpreter's default path, so these have to be
+# installed packages rather than modules of this repository
+WORKER_PRELOAD = ['numpy', 'matplotlib.pyplot', 'scipy.optimize',
+                  'scipy.special', 'sklearn.metrics']
+
+# Cores that no worker of the pool is pinned to, set up in each worker
+FREE_CORES = None
+
+
+def init_worker(free_cores):
+    global FREE_CORES  # pylint: disable=global-statement
+    FREE_CORES = free_cores
+
+
+def time_size(job):
+    """
+    Times one size in a worker process of `SimpleTiming.time_in_pool`, and
+    returns the time along with its sample summary.
+
+    A selector bound to a `random.Random`, such as the default
+    `random.choice`, arrives as a pickled copy with the parent's state, so
+    every worker would draw the same items. It is reseeded from the job's
+    seed, as is the module's own generator.
+    """
+    settings, function_to_time, args, kwargs, n, data, seed = job
+    random.seed(seed)
+    generator = getattr(settings['selector'], '__self__', None)
+    if isinstance(generator, random.Random):
+        generator.seed(seed)
+    core = FREE_CORES.get()
+    try:
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, {core})
+        timer = SimpleTiming(plot=False, print_out=False, **settings)
+        timer.load(n, data)
+        gc.disable()
+        current_time = timer.time_n(function_to_time, *args, **kwargs)
+        if timer.memory is not None:
+            timer.measure_memory(function_to_time, args, kwargs)
+        return current_time, timer.stats[-1]
+    finally:
+        FREE_CORES.put(core)
 
 
 def linear_contains(data, item):
@@ -412,14 +661,15 @@ def binary_contains(data, item):
     return False
 
 
-SimpleTiming(
-    # pylint: disable=unnecessary-lambda
-    data_or_generator=lambda x: range(x),
-    arg_dict={
-        "n": False,
-        "data": "data",
-        "item": "item"
-    },
-    n_iterator=[100 * i for i in range(1, 301)],
-    duration=1,
-    max_time=600).time_function(binary_contains)
+if __name__ == '__main__':
+    SimpleTiming(
+        # pylint: disable=unnecessary-lambda
+        data_or_generator=lambda x: range(x),
+        arg_dict={
+            "n": False,
+            "data": "data",
+            "item": "item"
+        },
+        n_iterator=[100 * i for i in range(1, 301)],
+        duration=1,
+        max_time=600).time_function(binary_contains)